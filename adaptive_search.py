@@ -0,0 +1,211 @@
+"""
+A parameter search that decides where to look next based on the results so far, and that weeds out bad candidates
+with cheap partial replays before paying for full ones.
+"""
+
+import logging
+import random
+from math import ceil, exp, log
+
+from elo import TRAINING_YEARS
+
+logger = logging.getLogger(__name__)
+
+# The same ranges that GridParameterGenerator searches by default.
+DEFAULT_SEARCH_SPACE = dict(
+    k=(10, 150), home_field=(0, 200), season_regression=(0.5, 1.1)
+)
+
+
+class _ParzenEstimator:
+    """
+    A one-dimensional density over [low, high]: a mixture of Gaussians centred on the given points, plus one broad
+    Gaussian so that no part of the range is ever ruled out. Each point's Gaussian is as wide as the gap to its
+    farthest neighbour, so the density is sharp where the points are crowded.
+    """
+
+    def __init__(self, points, low, high):
+        self.low = low
+        self.high = high
+        width = high - low
+        sorted_points = sorted(points)
+        neighbours = [low] + sorted_points + [high]
+        min_sigma = width / min(100, len(points) + 1)
+        self.mus = [(low + high) / 2]
+        self.sigmas = [width]
+        for i, point in enumerate(sorted_points):
+            sigma = max(point - neighbours[i], neighbours[i + 2] - point)
+            self.mus.append(point)
+            self.sigmas.append(min(max(sigma, min_sigma), width))
+
+    def sample(self, rng):
+        i = rng.randrange(len(self.mus))
+        while True:
+            x = rng.gauss(self.mus[i], self.sigmas[i])
+            if self.low <= x <= self.high:
+                return x
+
+    def log_density(self, x):
+        # We only ever compare densities, so the constant factor of the Gaussians doesn't matter.
+        total = sum(
+            exp(-0.5 * ((x - mu) / sigma) ** 2) / sigma
+            for mu, sigma in zip(self.mus, self.sigmas)
+        )
+        return log(total / len(self.mus) + 1e-300)
+
+
+def default_rung_years(training_years):
+    """
+    Returns the rungs for successive halving over training_years: the years a third and two thirds of the way
+    through them (e.g. 2014 and 2016 for 2013-2018), leaving out any that would be the last training year.
+    """
+    years = sorted(training_years)
+    indices = [len(years) * i // 3 - 1 for i in (1, 2)]
+    return tuple(
+        sorted({years[index] for index in indices if 0 <= index < len(years) - 1})
+    )
+
+
+class TPEParameterGenerator:
+    """
+    A ParameterSearch class that implements sequential model-based search with a tree-structured Parzen estimator
+    (TPE), combined with successive halving.
+
+    The search runs in brackets. Each bracket proposes bracket_size candidates: at random for the first
+    num_startup of them, and after that by favouring values that look like those of the best candidates so far
+    (the fraction gamma of them with the lowest loss) and unlike the rest. If we have a partial_evaluator, the
+    candidates are first replayed through each year in rung_years, keeping only the best 1/eta of them after each
+    rung, and only the survivors are handed to ParameterTester.optimize for full replays.
+
+    Losses through different years can't be compared, so we keep the observations of each rung, and of the full
+    replays, apart. As in BOHB, proposals are modelled on the most complete replays that we have num_startup
+    observations of, so the full losses take over once enough survivors have been replayed.
+
+    partial_evaluator(param_dicts, through_year) should return the loss of each dict over the seasons up to
+    through_year, e.g. ParameterTester.evaluate_partial_losses. Partial replays share their seasons with the full
+    ones, so with a checkpoint cache the full replay of a survivor only pays for the seasons after the last rung.
+    """
+
+    def __init__(
+        self,
+        partial_evaluator=None,
+        num_brackets=30,
+        bracket_size=9,
+        eta=3,
+        rung_years=None,
+        num_startup=20,
+        gamma=0.25,
+        num_samples=24,
+        search_space=None,
+        seed=0,
+        training_years=None,
+    ):
+        """
+        training_years should be the training years of the tester behind partial_evaluator (TRAINING_YEARS by
+        default). rung_years defaults to default_rung_years(training_years). Every rung must be a year from the first
+        training year up to (but not including) the last, since a rung before the training years has no loss to
+        compare, and a rung at the end is a full replay.
+        """
+        self.partial_evaluator = partial_evaluator
+        self.num_brackets = num_brackets
+        self.bracket_size = bracket_size
+        self.eta = eta
+        years = sorted(TRAINING_YEARS if training_years is None else training_years)
+        if rung_years is None:
+            rung_years = default_rung_years(years)
+        rung_years = tuple(rung_years)
+        if rung_years and (
+            list(rung_years) != sorted(set(rung_years))
+            or rung_years[0] < years[0]
+            or rung_years[-1] >= years[-1]
+        ):
+            raise ValueError(
+                "rung_years must be increasing years from {} up to (but not including) {}, not {}.".format(
+                    years[0], years[-1], rung_years
+                )
+            )
+        self.rung_years = rung_years
+        self.num_startup = num_startup
+        self.gamma = gamma
+        # The number of samples that we draw from the model of the good candidates before choosing one.
+        self.num_samples = num_samples
+        self.search_space = search_space or DEFAULT_SEARCH_SPACE
+        self.seed = seed
+
+    def _model_observations(self, observations):
+        """
+        Given a list of observations for each fidelity, from the first rung to the full replays, returns those of the
+        most complete fidelity with at least num_startup of them, or else those of the first.
+        """
+        for fidelity_observations in reversed(observations):
+            if len(fidelity_observations) >= self.num_startup:
+                return fidelity_observations
+        return observations[0]
+
+    def _propose(self, observations, rng):
+        """
+        Returns a new candidate, given a list of (loss, param_dict) observations.
+        """
+        if len(observations) < self.num_startup:
+            return {
+                field: rng.uniform(low, high)
+                for field, (low, high) in self.search_space.items()
+            }
+
+        ranked = sorted(observations, key=lambda x: x[0])
+        num_good = max(1, ceil(self.gamma * len(ranked)))
+        good_estimators = {}
+        bad_estimators = {}
+        for field, (low, high) in self.search_space.items():
+            good_estimators[field] = _ParzenEstimator(
+                [params[field] for _, params in ranked[:num_good]], low, high
+            )
+            bad_estimators[field] = _ParzenEstimator(
+                [params[field] for _, params in ranked[num_good:]], low, high
+            )
+
+        # Draw from the good model, and keep the sample that is most likely under the good model relative to the bad.
+        best_score, best_params = None, None
+        for _ in range(self.num_samples):
+            params = {
+                field: estimator.sample(rng)
+                for field, estimator in good_estimators.items()
+            }
+            score = sum(
+                good_estimators[field].log_density(value)
+                - bad_estimators[field].log_density(value)
+                for field, value in params.items()
+            )
+            if best_score is None or score > best_score:
+                best_score, best_params = score, params
+        return best_params
+
+    def get_next_param_batches(self):
+        """
+        A generator function that yields the survivors of each bracket as a batch, and expects to be sent back
+        their full losses.
+        """
+        rng = random.Random(self.seed)
+        rung_years = self.rung_years if self.partial_evaluator is not None else ()
+        # For each rung and then for the full replays, tuples of (loss, param_dict) for every candidate that got
+        # that far.
+        observations = [[] for _ in range(len(rung_years) + 1)]
+        for bracket in range(self.num_brackets):
+            model_observations = self._model_observations(observations)
+            candidates = [
+                self._propose(model_observations, rng) for _ in range(self.bracket_size)
+            ]
+            for rung, through_year in enumerate(rung_years):
+                losses = self.partial_evaluator(candidates, through_year)
+                observations[rung].extend(zip(losses, candidates))
+                num_survivors = max(1, len(candidates) // self.eta)
+                ranked = sorted(zip(losses, range(len(candidates))))
+                candidates = [candidates[i] for _, i in ranked[:num_survivors]]
+            losses = yield candidates
+            observations[-1].extend(zip(losses, candidates))
+            logger.debug(
+                "Bracket %s: best full loss %s (%s)",
+                bracket,
+                min(losses),
+                candidates[losses.index(min(losses))],
+            )
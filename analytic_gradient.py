@@ -0,0 +1,281 @@
+"""
+Exact gradients of the training log loss with respect to the Elo parameters, and an optimizer that uses them.
+
+Alongside every rating, we carry its derivative with respect to each parameter (forward-mode differentiation), so a
+single replay yields both the log loss and its gradient. Finite differences need two replays per parameter instead.
+"""
+import logging
+from math import log
+
+import numpy as np
+
+from elo import TRAINING_YEARS, WEEKS_IN_SEASON, EloMachine, initial_param_dict
+from game_table import GameTable
+
+
+logger = logging.getLogger(__name__)
+
+LN_10 = log(10)
+
+# Weeks 16 and 17 (zero-indexed 15 and 16) have too few games to tune, as in GradientParameterGenerator.
+FROZEN_WEEK_INDICES = (15, 16)
+
+
+def _parameter_names(param_dict):
+    """
+    Returns the names of the parameters in the order in which we lay them out in a vector. k_list contributes one
+    entry per week, named ("k_list", i).
+    """
+    if "k_list" in param_dict:
+        k_names = [("k_list", i) for i in range(len(param_dict["k_list"]))]
+    else:
+        k_names = ["k"]
+    return k_names + ["home_field", "season_regression"]
+
+
+def _get_value(param_dict, name):
+    if isinstance(name, tuple):
+        return param_dict[name[0]][name[1]]
+    return param_dict[name]
+
+
+def _with_values(param_dict, names, values):
+    new_params = {key: value for key, value in param_dict.items() if key != "k_list"}
+    if "k_list" in param_dict:
+        new_params["k_list"] = list(param_dict["k_list"])
+    for name, value in zip(names, values):
+        if isinstance(name, tuple):
+            new_params[name[0]][name[1]] = float(value)
+        else:
+            new_params[name] = float(value)
+    return new_params
+
+
+def loss_and_gradient(scores, param_dict, initial_rating=1000, training_years=None):
+    """
+    Replays scores (a GameTable or a list of score tuples) with param_dict, exactly as ParameterTester.run_one_cycle
+    does. Returns a tuple of the resulting EloMachine and a dict with the same keys as param_dict that holds the
+    derivative of elo.log_loss with respect to each parameter. As there, the log loss only covers training_years
+    (which defaults to TRAINING_YEARS).
+    """
+    if training_years is None:
+        training_years = TRAINING_YEARS
+    game_table = (
+        scores if isinstance(scores, GameTable) else GameTable.from_scores(scores)
+    )
+    names = _parameter_names(param_dict)
+    num_params = len(names)
+    home_field_index = names.index("home_field")
+    season_regression_index = names.index("season_regression")
+    home_field = param_dict["home_field"]
+    season_regression = param_dict["season_regression"]
+    if "k_list" in param_dict:
+        k_for_week = list(param_dict["k_list"])
+        k_index_for_week = list(range(WEEKS_IN_SEASON))
+    else:
+        k_for_week = [param_dict["k"]] * WEEKS_IN_SEASON
+        k_index_for_week = [0] * WEEKS_IN_SEASON
+
+    ratings = [float(initial_rating)] * len(game_table.teams)
+    # The derivative of each team's rating with respect to each parameter.
+    derivatives = np.zeros((len(game_table.teams), num_params))
+    log_loss = 0.0
+    gradient = np.zeros(num_params)
+
+    # The derivative of the winner's home field adjustment with respect to the parameters, for a winner at home.
+    home_field_direction = np.zeros(num_params)
+    home_field_direction[home_field_index] = 1.0
+
+    last_year = None
+    for year, week, winner, loser, sign in zip(
+        game_table.year.tolist(),
+        game_table.week.tolist(),
+        game_table.winner_id.tolist(),
+        game_table.loser_id.tolist(),
+        game_table.home_sign.tolist(),
+    ):
+        if year != last_year:
+            # rating' = initial + (rating - initial) * z, so d(rating')/dz = rating - initial.
+            offsets = np.array(ratings) - initial_rating
+            derivatives *= season_regression
+            derivatives[:, season_regression_index] += offsets
+            ratings = [
+                initial_rating + (rating - initial_rating) * season_regression
+                for rating in ratings
+            ]
+            last_year = year
+
+        initial_rating_winner = ratings[winner]
+        initial_rating_loser = ratings[loser]
+        adjusted_rating_winner = initial_rating_winner
+        if sign == 1.0:
+            adjusted_rating_winner += home_field
+        elif sign == -1.0:
+            adjusted_rating_winner -= home_field
+        predicted_outcome = 1 / (
+            1 + 10 ** ((initial_rating_loser - adjusted_rating_winner) / 400)
+        )
+
+        # x is the exponent in the expected outcome, and dx is its derivative.
+        dx = derivatives[loser] - derivatives[winner]
+        if sign:
+            dx -= sign * home_field_direction
+        dx /= 400
+        if year in training_years:
+            log_loss -= log(predicted_outcome)
+            gradient += (LN_10 * (1 - predicted_outcome)) * dx
+
+        k = k_for_week[week - 1]
+        delta = k * (1 - predicted_outcome)
+        d_delta = (k * LN_10 * predicted_outcome * (1 - predicted_outcome)) * dx
+        d_delta[k_index_for_week[week - 1]] += 1 - predicted_outcome
+        ratings[winner] = initial_rating_winner + delta
+        ratings[loser] = initial_rating_loser - delta
+        derivatives[winner] += d_delta
+        derivatives[loser] -= d_delta
+
+    elo = EloMachine(
+        initial_rating=initial_rating,
+        home_team_advantage=home_field,
+        teams=game_table.team_registry,
+    )
+    elo.load_ratings(ratings)
+    elo.log_loss = log_loss
+
+    gradient_dict = {
+        name: float(value) for name, value in zip(names, gradient) if name in param_dict
+    }
+    if "k_list" in param_dict:
+        gradient_dict["k_list"] = gradient[: len(param_dict["k_list"])].tolist()
+    return elo, gradient_dict
+
+
+class LBFGSParameterGenerator:
+    """
+    A ParameterSearch class that implements L-BFGS with exact gradients.
+
+    Rather than losses, ParameterTester.optimize sends back (loss, gradient) tuples to generators with
+    requires_gradients set. Each iteration costs about one replay, instead of two replays per parameter.
+    """
+
+    requires_gradients = True
+
+    def __init__(
+        self,
+        k=100,
+        home_field=50,
+        season_regression=0.9,
+        allow_different_k_different_weeks=False,
+        max_iterations=100,
+        tolerance=1e-4,
+        history_size=10,
+        initial_step=3.0,
+    ):
+        self.allow_different_k_different_weeks = allow_different_k_different_weeks
+        self.k_start = k
+        self.home_field_start = home_field
+        self.season_regression_start = season_regression
+        self.max_iterations = max_iterations
+        # We stop once an iteration improves the loss by less than this.
+        self.tolerance = tolerance
+        self.history_size = history_size
+        # The length of the first step, in the same units as GradientParameterGenerator's delta.
+        self.initial_step = initial_step
+
+    @staticmethod
+    def _scales(names):
+        """
+        We optimize over parameters divided by these scales, so that a unit step means about the same thing for each
+        of them. (season_regression is two orders of magnitude smaller than the rest.)
+        """
+        return np.array(
+            [0.01 if name == "season_regression" else 1.0 for name in names]
+        )
+
+    @staticmethod
+    def _mask(names):
+        return np.array(
+            [
+                not (isinstance(name, tuple) and name[1] in FROZEN_WEEK_INDICES)
+                for name in names
+            ],
+            dtype=float,
+        )
+
+    def _direction(self, gradient, history):
+        """
+        Returns the L-BFGS search direction, using the two-loop recursion over history, a list of (s, y) pairs.
+        """
+        if not history:
+            return -gradient * (self.initial_step / np.linalg.norm(gradient))
+        q = gradient.copy()
+        alphas = []
+        for s, y in reversed(history):
+            alpha = s.dot(q) / y.dot(s)
+            alphas.append(alpha)
+            q -= alpha * y
+        s, y = history[-1]
+        q *= s.dot(y) / y.dot(y)
+        for (s, y), alpha in zip(history, reversed(alphas)):
+            beta = y.dot(q) / y.dot(s)
+            q += (alpha - beta) * s
+        return -q
+
+    def get_next_param_batches(self):
+        """
+        A generator function that yields one set of parameters at a time (as a batch of one), and expects to be sent
+        back a list containing its (loss, gradient) tuple.
+        """
+        params = initial_param_dict(
+            self.k_start,
+            self.home_field_start,
+            self.season_regression_start,
+            self.allow_different_k_different_weeks,
+        )
+        names = _parameter_names(params)
+        scales = self._scales(names)
+        mask = self._mask(names)
+
+        def to_vector(gradient_dict):
+            return np.array([_get_value(gradient_dict, name) for name in names])
+
+        x = np.array([_get_value(params, name) for name in names]) / scales
+        ((loss, gradient_dict),) = yield [params]
+        gradient = to_vector(gradient_dict) * scales * mask
+        history = []
+        for _ in range(self.max_iterations):
+            if not gradient.any():
+                break
+            direction = self._direction(gradient, history)
+            slope = gradient.dot(direction)
+            if slope >= 0:
+                # The curvature estimate has gone bad. Start again from steepest descent.
+                history = []
+                direction = self._direction(gradient, history)
+                slope = gradient.dot(direction)
+
+            # Backtracking line search until the Armijo condition holds.
+            step = 1.0
+            for _ in range(20):
+                new_x = x + step * direction
+                new_params = _with_values(params, names, new_x * scales)
+                ((new_loss, new_gradient_dict),) = yield [new_params]
+                if new_loss <= loss + 1e-4 * step * slope:
+                    break
+                step /= 2
+            else:
+                return
+
+            new_gradient = to_vector(new_gradient_dict) * scales * mask
+            s, y = new_x - x, new_gradient - gradient
+            if s.dot(y) > 1e-10:
+                history = (history + [(s, y)])[-self.history_size :]
+            improvement = loss - new_loss
+            x, params, loss, gradient = new_x, new_params, new_loss, new_gradient
+            logger.info(
+                "Accepting new best params (%s) because it produced loss of %s",
+                params,
+                loss,
+            )
+            if improvement < self.tolerance:
+                break
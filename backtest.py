@@ -0,0 +1,357 @@
+"""
+Rolling-origin backtests: for each of many splits of the seasons, tune the parameters on the training seasons, then
+score them on the seasons that follow. This tells us whether the tuned parameters generalize, which the training loss
+alone can't.
+
+    python backtest.py --min-training-years 3 --workers 2
+
+Every split replays the same games from the very first season, so the splits share a CheckpointCache. With expanding
+windows, a split that trains through 2016 can resume each candidate from the state at the end of 2015 that the split
+training through 2015 left behind, and only has to replay one season. The splits' searches advance in lockstep, one
+batch at a time, so those checkpoints are still in the cache when the next split needs them.
+"""
+import argparse
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from checkpoints import CheckpointCache
+from elo import (
+    TRAINING_YEARS,
+    EloMachine,
+    GradientParameterGenerator,
+    GridParameterGenerator,
+    ParameterTester,
+    get_k_for_week,
+)
+from game_table import GameTable
+from loss_cache import LossCache
+
+
+logger = logging.getLogger(__name__)
+
+
+def rolling_origin_splits(
+    first_training_year, last_test_year, min_training_years=3, test_years=1, window=None
+):
+    """
+    Returns a list of (training years, test years) tuples, each a tuple of consecutive years, with the test years
+    immediately after the training years. The first split trains on min_training_years seasons, and each later split
+    moves the test seasons forward by one year, up to last_test_year.
+
+    By default the training window expands, always starting at first_training_year. If window is set, it instead
+    rolls forward, covering only the window seasons before the test seasons. Either way, every season before the
+    training window is replayed to warm up the ratings, but doesn't count towards the loss.
+    """
+    first_origin = first_training_year + (
+        min_training_years if window is None else window
+    )
+    splits = []
+    for origin in range(first_origin, last_test_year - test_years + 2):
+        training_start = first_training_year if window is None else origin - window
+        splits.append(
+            (
+                tuple(range(training_start, origin)),
+                tuple(range(origin, origin + test_years)),
+            )
+        )
+    return splits
+
+
+def grid_search(best_params):
+    """
+    A tuning stage: searches the default grid. (Stages are module-level functions, so that they can be sent to worker
+    processes.)
+    """
+    return GridParameterGenerator()
+
+
+def gradient_refinement(best_params):
+    """
+    A tuning stage: refines the best parameters from the previous stage with gradient descent.
+    """
+    return GradientParameterGenerator(**best_params)
+
+
+def score_predictions(elo, param_dict, games, test_years, num_bins=5):
+    """
+    Plays games (an iterable of (year, week, winning_team, losing_team, winning_team_location) tuples) forward from
+    the ratings in elo, predicting each one before updating the ratings with its result, and scores the predictions
+    for the games in test_years. Returns a dict with:
+
+        test_games: the number of games that we scored
+        test_log_loss: their log loss, in the same units as ParameterTester's
+        brier_score: the mean squared error of the probability that we gave the winner
+        calibration: for each bin of the favorite's predicted probability of winning (from 0.5 to 1, in num_bins
+            equal steps) that has any games, a dict of its bounds, its number of games, the mean predicted
+            probability and the fraction of those games that the favorite actually won
+        calibration_error: the mean absolute difference between predicted and observed, weighted by games
+
+    elo must hold the ratings at the end of a season, before they regress to the mean. It isn't modified.
+    """
+    test_elo = EloMachine(
+        initial_rating=elo.initial_rating,
+        home_team_advantage=param_dict["home_field"],
+    )
+    test_elo.player_to_rating = elo.player_to_rating
+    winner_probabilities = []
+    last_year = None
+    for year, week, winning_team, losing_team, winning_team_location in games:
+        if year != last_year:
+            test_elo.regress_to_mean(param_dict["season_regression"])
+            last_year = year
+        include_in_log_loss = year in test_years
+        if include_in_log_loss:
+            winner_probabilities.append(
+                test_elo.predict_outcome(
+                    winning_team, losing_team, winning_team_location
+                )
+            )
+        test_elo.update_ratings_with_result(
+            winning_team,
+            losing_team,
+            winning_team_location,
+            k=get_k_for_week(param_dict, week),
+            include_in_log_loss=include_in_log_loss,
+        )
+
+    winner_probabilities = np.array(winner_probabilities)
+    favorite_probabilities = np.maximum(winner_probabilities, 1 - winner_probabilities)
+    favorite_won = winner_probabilities >= 0.5
+    bins = np.minimum(
+        ((favorite_probabilities - 0.5) * 2 * num_bins).astype(int), num_bins - 1
+    )
+    calibration = []
+    calibration_error = 0
+    for i in range(num_bins):
+        in_bin = bins == i
+        num_games = int(in_bin.sum())
+        if not num_games:
+            continue
+        predicted = float(favorite_probabilities[in_bin].mean())
+        observed = float(favorite_won[in_bin].mean())
+        calibration.append(
+            dict(
+                lower=0.5 + i / (2 * num_bins),
+                upper=0.5 + (i + 1) / (2 * num_bins),
+                games=num_games,
+                predicted=predicted,
+                observed=observed,
+            )
+        )
+        calibration_error += num_games * abs(predicted - observed)
+    num_games = len(winner_probabilities)
+    return dict(
+        test_games=num_games,
+        test_log_loss=test_elo.log_loss,
+        brier_score=(
+            float(((1 - winner_probabilities) ** 2).mean()) if num_games else None
+        ),
+        calibration=calibration,
+        calibration_error=calibration_error / num_games if num_games else None,
+    )
+
+
+class Backtest:
+    """
+    Tunes and scores the parameters for every split of a list of splits.
+    """
+
+    def __init__(
+        self,
+        scores,
+        splits,
+        stages=(grid_search,),
+        backend="compiled",
+        checkpoint_cache=None,
+    ):
+        """
+        scores may be a GameTable or a list of (year, week, visiting_school, visiting_score, home_school,
+        home_score) tuples, and splits is a list of (training years, test years) tuples (e.g. from
+        rolling_origin_splits).
+
+        Each split is tuned by running stages in order. A stage is a function that takes the best parameters so far
+        (None for the first stage) and returns a parameter generator for ParameterTester.optimize.
+
+        The replays of all the splits share checkpoint_cache, which defaults to a new CheckpointCache.
+        """
+        if not isinstance(scores, GameTable):
+            scores = GameTable.from_scores(scores)
+        self.game_table = scores
+        self.splits = splits
+        self.stages = stages
+        self.backend = backend
+        self.checkpoint_cache = (
+            CheckpointCache() if checkpoint_cache is None else checkpoint_cache
+        )
+
+    def _tune(self, tester):
+        """
+        A generator that runs our stages on tester, one batch of candidates each time that it's advanced.
+        """
+        best_params = None
+        for stage in self.stages:
+            yield from tester.optimize_stepwise(stage(best_params))
+            best_params = tester.results[0][1]
+
+    def _run_splits(self, splits):
+        """
+        Tunes and scores splits in this process, and returns a list of their results.
+        """
+        testers = [
+            ParameterTester(
+                self.game_table.through_year(max(training_years)),
+                checkpoint_cache=self.checkpoint_cache,
+                backend=self.backend,
+                loss_cache=LossCache(),
+                pruning_margin=0,
+                training_years=training_years,
+            )
+            for training_years, _ in splits
+        ]
+        # Advance every search by one batch in turn, in order of how far they train, so that each search finds the
+        # checkpoints of the searches with shorter training windows while they are still fresh.
+        searches = [
+            self._tune(tester)
+            for tester in sorted(testers, key=lambda tester: max(tester.training_years))
+        ]
+        while searches:
+            for search in list(searches):
+                try:
+                    next(search)
+                except StopIteration:
+                    searches.remove(search)
+
+        results = []
+        for tester, (training_years, test_years) in zip(testers, splits):
+            training_log_loss, params = tester.results[0]
+            # Resumes from the checkpoint at the start of the last training season.
+            elo = tester.run_one_cycle(params)
+            last_training_year = max(training_years)
+            games = (
+                game
+                for game in self.game_table.through_year(max(test_years)).iter_games()
+                if game[0] > last_training_year
+            )
+            result = dict(
+                training_years=list(training_years),
+                test_years=list(test_years),
+                params=params,
+                training_games=int(
+                    np.isin(tester.game_table.year, list(training_years)).sum()
+                ),
+                training_log_loss=training_log_loss,
+            )
+            result.update(score_predictions(elo, params, games, test_years))
+            results.append(result)
+        return results
+
+    def run(self, workers=None):
+        """
+        Returns a list with a dict of results for each split, in the same order as the splits: its training_years
+        and test_years, the best params on the training years, the number of training_games and the
+        training_log_loss, and everything that score_predictions returns for the test years.
+
+        If workers is set, the splits are divided into that many blocks of neighboring splits, and each block runs in
+        its own process with its own checkpoint cache.
+        """
+        if not workers:
+            return self._run_splits(self.splits)
+        block_size = -(-len(self.splits) // workers)
+        blocks = [
+            self.splits[start : start + block_size]
+            for start in range(0, len(self.splits), block_size)
+        ]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            block_results = pool.map(
+                _run_block,
+                [
+                    (self.game_table, block, self.stages, self.backend)
+                    for block in blocks
+                ],
+            )
+            return [result for results in block_results for result in results]
+
+
+def _describe_years(years):
+    if len(years) == 1:
+        return str(years[0])
+    return "{}-{}".format(years[0], years[-1])
+
+
+def _run_block(args):
+    game_table, splits, stages, backend = args
+    return Backtest(game_table, splits, stages, backend)._run_splits(splits)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Tune the Elo parameters on rolling splits of the seasons and score them on held-out seasons."
+    )
+    parser.add_argument("--log-level", default="INFO")
+    parser.add_argument(
+        "--first-training-year",
+        type=int,
+        default=min(TRAINING_YEARS),
+        help="Seasons before this one only warm up the ratings.",
+    )
+    parser.add_argument("--min-training-years", type=int, default=3)
+    parser.add_argument("--test-years", type=int, default=1)
+    parser.add_argument(
+        "--window",
+        type=int,
+        help="Train on this many seasons before the test seasons, rather than on every season since the first.",
+    )
+    parser.add_argument(
+        "--refine",
+        action="store_true",
+        help="Refine the grid search with gradient descent.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Run blocks of splits in parallel across this many processes. 0 runs them all here.",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(message)s")
+
+    scores = GameTable.load_cached("scores.csv")
+    splits = rolling_origin_splits(
+        args.first_training_year,
+        int(scores.year[-1]),
+        min_training_years=args.min_training_years,
+        test_years=args.test_years,
+        window=args.window,
+    )
+    stages = (grid_search, gradient_refinement) if args.refine else (grid_search,)
+    backtest = Backtest(scores, splits, stages)
+    start = time.perf_counter()
+    results = backtest.run(workers=args.workers)
+    logger.info(
+        "Backtested %s splits in %.1fs", len(splits), time.perf_counter() - start
+    )
+    if not args.workers:
+        logger.info(
+            "Checkpoint cache: %s hits, %s misses",
+            backtest.checkpoint_cache.hits,
+            backtest.checkpoint_cache.misses,
+        )
+    for result in results:
+        print(
+            "{} -> {}: {}".format(
+                _describe_years(result["training_years"]),
+                _describe_years(result["test_years"]),
+                result["params"],
+            )
+        )
+        print(
+            "    log loss per game: {:.4f} training, {:.4f} test. Brier score: {:.4f}. Calibration error: {:.4f}".format(
+                result["training_log_loss"] / result["training_games"],
+                result["test_log_loss"] / result["test_games"],
+                result["brier_score"],
+                result["calibration_error"],
+            )
+        )
@@ -0,0 +1,405 @@
+"""
+Benchmarks for the hot paths in this project. Run from the root of the repository:
+
+    python benchmark.py --output results.json
+
+Pass --save-baseline to record the results as a baseline, and --baseline to compare against one. The script exits
+with status 1 if any timing (or memory measurement) is more than --threshold worse than the baseline.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import html_parser
+from elo import GradientParameterGenerator, GridParameterGenerator, ParameterTester
+from game_table import GameTable
+from replay_backends import BACKENDS
+
+
+DEFAULT_THRESHOLD = 0.25
+# The most that importing elo may take in a fresh interpreter. Without matplotlib it takes about a tenth of this.
+IMPORT_BUDGET_SECONDS = 1.0
+PARAMS = dict(k=100, home_field=60, season_regression=0.9)
+
+
+def synthetic_scores(num_teams=240, num_seasons=10, first_year=2010, seed=0):
+    """
+    A generator of made-up (year, week, visiting_school, visiting_score, home_school, home_score) tuples, in the
+    same order as scores.csv. The defaults give about as many games as scores.csv, so num_teams and num_seasons can
+    be scaled up from there.
+
+    Each team has a hidden strength, and stronger teams are more likely to win, so the ratings behave realistically.
+    """
+    rng = random.Random(seed)
+    teams = ["Team {}".format(i) for i in range(num_teams)]
+    strengths = [rng.gauss(0, 200) for _ in teams]
+    for year in range(first_year, first_year + num_seasons):
+        # Fifteen weeks in which about half of the teams play, then a smaller postseason in week 18.
+        for week in list(range(1, 16)) + [18]:
+            fraction_playing = 0.3 if week == 18 else 0.48
+            playing = rng.sample(range(num_teams), int(num_teams * fraction_playing))
+            for visitor, home in zip(playing[::2], playing[1::2]):
+                home_win_probability = 1 / (
+                    1 + 10 ** ((strengths[visitor] - strengths[home] - 60) / 400)
+                )
+                winning_score = rng.randint(14, 56)
+                losing_score = rng.randint(0, winning_score - 1)
+                if rng.random() < home_win_probability:
+                    visiting_score, home_score = losing_score, winning_score
+                else:
+                    visiting_score, home_score = winning_score, losing_score
+                yield year, week, teams[visitor], visiting_score, teams[
+                    home
+                ], home_score
+
+
+def _time(function, repeats):
+    """
+    Returns the shortest time that function() took over repeats calls, in seconds. The minimum is the least noisy
+    estimate of how fast the code can run.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def get_datasets(scores_path="scores.csv", scales=(10,)):
+    """
+    Returns a dict mapping a name to a GameTable: scores.csv (if present), a synthetic table of the same size, and
+    synthetic tables with scale times as many teams, or scale times as many seasons.
+    """
+    datasets = {}
+    if os.path.exists(scores_path):
+        datasets["scores.csv"] = GameTable.load_cached(scores_path)
+    datasets["synthetic"] = GameTable.from_scores(list(synthetic_scores()))
+    for scale in scales:
+        datasets["synthetic teams x{}".format(scale)] = GameTable.from_scores(
+            list(synthetic_scores(num_teams=240 * scale))
+        )
+        datasets["synthetic seasons x{}".format(scale)] = GameTable.from_scores(
+            list(synthetic_scores(num_seasons=10 * scale))
+        )
+    return datasets
+
+
+def bench_replay(game_table, repeats=5):
+    """
+    Times run_one_cycle on game_table with every backend. Returns a dict mapping each backend to its statistics.
+    """
+    num_seasons = len(set(game_table.year.tolist()))
+    results = {}
+    for backend in BACKENDS:
+        searcher = ParameterTester(game_table, backend=backend)
+        # The first call may compile the backend, so leave it out.
+        searcher.run_one_cycle(PARAMS)
+        seconds = _time(lambda: searcher.run_one_cycle(PARAMS), repeats)
+        results[backend] = dict(
+            games=len(game_table),
+            seasons=num_seasons,
+            seconds_per_cycle=seconds,
+            seconds_per_season=seconds / num_seasons,
+            seconds_per_game=seconds / len(game_table),
+        )
+    return results
+
+
+def bench_grid_search(game_table, points_per_axis=(2, 3, 4), backend="reference"):
+    """
+    Times a full GridParameterGenerator sweep with points_per_axis values of each of the three parameters, i.e.
+    grids of 8, 27 and 64 points by default.
+    """
+    results = {}
+    for n in points_per_axis:
+        generator = GridParameterGenerator(
+            k_min=10,
+            k_max=10 + 5 * (n - 1),
+            k_step=5,
+            home_field_min=0,
+            home_field_max=20 * (n - 1),
+            home_field_step=20,
+            season_regression_min=0.5,
+            # Halfway past the last point, so that rounding can't add or drop a point.
+            season_regression_max=0.5 + 0.05 * (n - 0.5),
+            season_regression_step=0.05,
+        )
+        searcher = ParameterTester(game_table, backend=backend)
+        seconds = _time(lambda: searcher.optimize(generator), 1)
+        num_points = n**3
+        results["{} points".format(num_points)] = dict(
+            points=num_points,
+            seconds=seconds,
+            seconds_per_point=seconds / num_points,
+        )
+    return results
+
+
+def bench_gradient_rounds(game_table, rounds=3, backend="reference"):
+    """
+    Times the first few rounds of GradientParameterGenerator, evaluating each round's batch as optimize() would.
+    """
+    searcher = ParameterTester(game_table, backend=backend)
+    parameter_generator = GradientParameterGenerator(**PARAMS).get_next_param_batches()
+    round_seconds = []
+    candidates = 0
+    # The first batch is the starting point, which isn't part of a round.
+    batch = next(parameter_generator)
+    losses = [elo.log_loss for elo in searcher.evaluate_batch(batch)]
+    for _ in range(rounds):
+        try:
+            batch = parameter_generator.send(losses)
+        except StopIteration:
+            break
+        start = time.perf_counter()
+        losses = [elo.log_loss for elo in searcher.evaluate_batch(batch)]
+        round_seconds.append(time.perf_counter() - start)
+        candidates += len(batch)
+    return dict(
+        rounds=len(round_seconds),
+        candidates_per_round=candidates / len(round_seconds),
+        mean_seconds_per_round=statistics.mean(round_seconds),
+    )
+
+
+def bench_ranking(game_table, repeats=20):
+    """
+    Times get_players_with_ratings_descending_order on the ratings at the end of a replay: once when the ranking
+    index must be built from scratch, and once when it is already up to date.
+    """
+    elo = ParameterTester(game_table, backend="compiled").run_one_cycle(PARAMS)
+    player_to_rating = elo.player_to_rating
+
+    def cold():
+        # Assigning the ratings throws away the ranking index.
+        elo.player_to_rating = player_to_rating
+        elo.get_players_with_ratings_descending_order()
+
+    cold_seconds = _time(cold, repeats)
+    elo.get_players_with_ratings_descending_order()
+    warm_seconds = _time(elo.get_players_with_ratings_descending_order, repeats)
+    return dict(
+        teams=len(player_to_rating),
+        cold_seconds=cold_seconds,
+        warm_seconds=warm_seconds,
+    )
+
+
+def bench_prediction(game_table, repeats=5):
+    """
+    Times predicting every game in game_table one at a time with predict_outcome and all at once with
+    predict_outcomes, and times building the neutral-site outcome matrix of every team.
+    """
+    elo = ParameterTester(game_table, backend="compiled").run_one_cycle(PARAMS)
+    games = list(game_table.iter_games())
+    winners = [game[2] for game in games]
+    losers = [game[3] for game in games]
+    locations = [game[4] for game in games]
+
+    def one_at_a_time():
+        for winner, loser, location in zip(winners, losers, locations):
+            elo.predict_outcome(winner, loser, location)
+
+    loop_seconds = _time(one_at_a_time, repeats)
+    names_seconds = _time(
+        lambda: elo.predict_outcomes(winners, losers, locations), repeats
+    )
+    ids_seconds = _time(
+        lambda: elo.predict_outcomes(
+            game_table.winner_id, game_table.loser_id, game_table.location
+        ),
+        repeats,
+    )
+    matrix_seconds = _time(elo.outcome_matrix, repeats)
+    return dict(
+        games=len(games),
+        teams=len(elo.player_to_rating),
+        loop_seconds_per_game=loop_seconds / len(games),
+        names_seconds_per_game=names_seconds / len(games),
+        ids_seconds_per_game=ids_seconds / len(games),
+        matrix_seconds=matrix_seconds,
+        ids_speedup=loop_seconds / ids_seconds,
+    )
+
+
+def bench_html_parsing(raw_data_dir="raw_data/", limit=None):
+    """
+    Times extract_score_tuples on every page in raw_data_dir with each extraction mode, and measures the peak memory
+    allocated while parsing the largest page. Returns a dict mapping each mode to its statistics.
+    """
+    files = sorted(file for file in os.listdir(raw_data_dir) if file.endswith(".html"))
+    files = files[:limit]
+    pages = []
+    for file in files:
+        with open(os.path.join(raw_data_dir, file)) as file_handle:
+            pages.append(file_handle.read())
+
+    modes = {"dom-html.parser": dict(features="html.parser")}
+    if html_parser.DEFAULT_PARSER_FEATURES == "lxml":
+        modes["dom-lxml"] = dict(features="lxml")
+    modes["streaming"] = dict(streaming=True)
+
+    results = {}
+    for mode, kwargs in modes.items():
+        page_seconds = []
+        # Cancelled games are reported with print(), which we don't want to time or see.
+        with contextlib.redirect_stdout(io.StringIO()):
+            for page in pages:
+                start = time.perf_counter()
+                html_parser.extract_score_tuples(page, **kwargs)
+                page_seconds.append(time.perf_counter() - start)
+
+            tracemalloc.start()
+            html_parser.extract_score_tuples(max(pages, key=len), **kwargs)
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        results[mode] = dict(
+            pages=len(pages),
+            mean_seconds_per_page=statistics.mean(page_seconds),
+            median_seconds_per_page=statistics.median(page_seconds),
+            pages_per_second=len(pages) / sum(page_seconds),
+            peak_bytes_largest_page=peak_bytes,
+        )
+    return results
+
+
+def bench_import(module="elo", repeats=3):
+    """
+    Times importing module in a fresh interpreter, and reports whether that pulls in matplotlib.
+    """
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import {}\n"
+        "print(time.perf_counter() - start, 'matplotlib' in sys.modules)"
+    ).format(module)
+    timings = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.split()
+        timings.append(float(output[0]))
+    return dict(seconds=min(timings), loads_matplotlib=output[1] == "True")
+
+
+def run_benchmarks(scores_path="scores.csv", raw_data_dir="raw_data/", scales=(10,)):
+    """
+    Runs every benchmark and returns the results as a nested dict.
+    """
+    datasets = get_datasets(scores_path, scales)
+    # The optimizers are benchmarked on the real data if we have it, since that's what they run on in practice.
+    search_table = datasets.get("scores.csv", datasets["synthetic"])
+    results = dict(
+        import_elo=bench_import(),
+        replay={name: bench_replay(table) for name, table in datasets.items()},
+        grid_search=bench_grid_search(search_table),
+        gradient_rounds=bench_gradient_rounds(search_table),
+        ranking={name: bench_ranking(table) for name, table in datasets.items()},
+        prediction={name: bench_prediction(table) for name, table in datasets.items()},
+    )
+    if os.path.isdir(raw_data_dir):
+        results["html_parsing"] = bench_html_parsing(raw_data_dir)
+    return results
+
+
+def _flatten(results, prefix=""):
+    """
+    Turns nested results into a flat dict mapping dotted names (e.g. "replay.scores.csv.reference.seconds_per_game")
+    to numbers.
+    """
+    flat = {}
+    for key, value in results.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        else:
+            flat[name] = value
+    return flat
+
+
+def _is_cost(name):
+    """
+    Whether a metric measures a cost, so that a bigger number is worse. Counts (like the number of games) and rates
+    (like pages per second) aren't compared.
+    """
+    metric = name.rsplit(".", 1)[-1]
+    return "seconds" in metric.split("_per_")[0] or "bytes" in metric
+
+
+def find_regressions(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Returns a list of (name, baseline value, new value) tuples for every cost in results that is more than threshold
+    (a fraction) worse than it is in baseline. Metrics that only appear in one of them are ignored.
+    """
+    flat_results = _flatten(results)
+    flat_baseline = _flatten(baseline)
+    regressions = []
+    for name, value in flat_results.items():
+        if not _is_cost(name) or name not in flat_baseline:
+            continue
+        if value > flat_baseline[name] * (1 + threshold):
+            regressions.append((name, flat_baseline[name], value))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare the results to this JSON file.")
+    parser.add_argument(
+        "--save-baseline", help="Also write the results to this baseline file."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="The fraction by which a cost may exceed the baseline before we fail.",
+    )
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="*",
+        default=[10],
+        help="Benchmark synthetic data with this many times the teams and seasons of scores.csv.",
+    )
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(scales=args.scales)
+    print(json.dumps(results, indent=2))
+    for path in [args.output, args.save_baseline]:
+        if path:
+            with open(path, "w") as file_handle:
+                json.dump(results, file_handle, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file_handle:
+            baseline = json.load(file_handle)
+        regressions = find_regressions(results, baseline, args.threshold)
+        for name, baseline_value, value in regressions:
+            print(
+                "Regression in {}: {:.4g} -> {:.4g} ({:+.0%})".format(
+                    name, baseline_value, value, value / baseline_value - 1
+                ),
+                file=sys.stderr,
+            )
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
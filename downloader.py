@@ -1,26 +1,209 @@
 """
 Downloads all the raw data that we need in order to create our prediction engine.
 """
-import subprocess
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
 
 YEARS_OF_INTEREST = list(range(2010, 2020))
 MAX_WEEK = 18
-WEEKS_IN_SEASON = list(range(15, MAX_WEEK))
+WEEKS_IN_SEASON = list(range(1, MAX_WEEK))
 ROOT_URL = "https://www.footballdb.com/college-football/scores.html?lg=FBS"
 
-target_urls = []
-target_filenames = []
-for year in YEARS_OF_INTEREST:
-    for week in WEEKS_IN_SEASON:
-        target_urls.append(ROOT_URL + "&type=reg&yr={}&wk={}".format(year, week))
-        target_filenames.append("raw_data/year-{}-week-{}.html".format(year, week))
-    target_urls.append(ROOT_URL + "&type=post&yr={}".format(year))
-    target_filenames.append("raw_data/year-{}-week-{}.html".format(year, MAX_WEEK))
-
-
-for url, filename in zip(target_urls, target_filenames):
-    print("Downloading {} to {}...".format(url, filename))
-    # Ideally I would be able to use the "requests" library for this, but for some reason this website is giving
-    # me "permission denied" when I use requests. Whatever.
-    subprocess.check_call('wget -O {} "{}"'.format(filename, url), shell=True)
+# This website gives "permission denied" to some HTTP clients (e.g. the "requests" library), but not to wget, so
+# we identify ourselves the same way that wget does.
+USER_AGENT = "Wget/1.20.3 (linux-gnu)"
+# Retry on these status codes, which usually mean that the server is temporarily overloaded.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_REDIRECTS = 5
+
+
+def get_targets(years=YEARS_OF_INTEREST, weeks=WEEKS_IN_SEASON, root_url=ROOT_URL):
+    """
+    Returns a list of (url, filename) tuples for every page that we want: each regular-season week of each year,
+    followed by the postseason (which we store as week MAX_WEEK).
+    """
+    targets = []
+    for year in years:
+        for week in weeks:
+            targets.append(
+                (
+                    root_url + "&type=reg&yr={}&wk={}".format(year, week),
+                    "year-{}-week-{}.html".format(year, week),
+                )
+            )
+        targets.append(
+            (
+                root_url + "&type=post&yr={}".format(year),
+                "year-{}-week-{}.html".format(year, MAX_WEEK),
+            )
+        )
+    return targets
+
+
+class Downloader:
+    """
+    Fetches pages with a bounded pool of threads. Each thread keeps its own keep-alive connection to every host, so
+    we only pay for a TCP/TLS handshake once per thread rather than once per page.
+
+    Failed requests are retried with exponential backoff. We remember the ETag and Last-Modified headers of every
+    page that we download, and send them back the next time so the server can tell us the page hasn't changed.
+    """
+
+    def __init__(
+        self,
+        raw_data_dir="raw_data/",
+        max_workers=8,
+        max_retries=3,
+        backoff_seconds=1.0,
+        timeout=30,
+    ):
+        self.raw_data_dir = raw_data_dir
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+
+        # Map each filename to the validators (ETag and Last-Modified) that the server sent with it.
+        self.metadata_path = os.path.join(raw_data_dir, ".http_metadata.json")
+        try:
+            with open(self.metadata_path) as file_handle:
+                self.metadata = json.load(file_handle)
+        except FileNotFoundError:
+            self.metadata = {}
+        self._metadata_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _get_connection(self, scheme, netloc):
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        connection = connections.get((scheme, netloc))
+        if connection is None:
+            connection_class = (
+                http.client.HTTPSConnection
+                if scheme == "https"
+                else http.client.HTTPConnection
+            )
+            connection = connection_class(netloc, timeout=self.timeout)
+            connections[(scheme, netloc)] = connection
+        return connection
+
+    def _drop_connection(self, scheme, netloc):
+        connection = self._local.connections.pop((scheme, netloc), None)
+        if connection is not None:
+            connection.close()
+
+    def _request(self, url, headers):
+        """
+        Sends a GET request for url, following redirects. Returns a tuple of (status, response headers, body).
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            parsed_url = urllib.parse.urlsplit(url)
+            path = parsed_url.path or "/"
+            if parsed_url.query:
+                path += "?" + parsed_url.query
+            connection = self._get_connection(parsed_url.scheme, parsed_url.netloc)
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException):
+                # The connection is no good anymore (e.g. the server closed it while it was idle).
+                self._drop_connection(parsed_url.scheme, parsed_url.netloc)
+                raise
+            if response.will_close:
+                self._drop_connection(parsed_url.scheme, parsed_url.netloc)
+            if response.status in (301, 302, 303, 307, 308):
+                url = urllib.parse.urljoin(url, response.getheader("Location"))
+                continue
+            return response.status, response.headers, body
+        raise http.client.HTTPException("Too many redirects for {}".format(url))
+
+    def fetch(self, url, filename, skip_existing=False):
+        """
+        Downloads url to filename (inside raw_data_dir). Returns "skipped" if the file already exists and
+        skip_existing is set, "not modified" if the server says our copy is up to date, and "downloaded" otherwise.
+        """
+        path = os.path.join(self.raw_data_dir, filename)
+        exists = os.path.exists(path)
+        if skip_existing and exists:
+            return "skipped"
+
+        headers = {"User-Agent": USER_AGENT, "Connection": "keep-alive"}
+        with self._metadata_lock:
+            validators = self.metadata.get(filename, {}) if exists else {}
+        if "etag" in validators:
+            headers["If-None-Match"] = validators["etag"]
+        if "last_modified" in validators:
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                status, response_headers, body = self._request(url, headers)
+            except (OSError, http.client.HTTPException):
+                if attempt == self.max_retries:
+                    raise
+            else:
+                if status not in RETRY_STATUSES or attempt == self.max_retries:
+                    break
+            time.sleep(self.backoff_seconds * 2**attempt)
+
+        if status == 304:
+            return "not modified"
+        if status != 200:
+            raise http.client.HTTPException(
+                "Got status {} when downloading {}".format(status, url)
+            )
+
+        # Write to a temporary file first, so that an interrupted download never leaves a partial page behind.
+        temp_path = path + ".part"
+        with open(temp_path, "wb") as file_handle:
+            file_handle.write(body)
+        os.replace(temp_path, path)
+
+        validators = {}
+        if response_headers.get("ETag"):
+            validators["etag"] = response_headers["ETag"]
+        if response_headers.get("Last-Modified"):
+            validators["last_modified"] = response_headers["Last-Modified"]
+        with self._metadata_lock:
+            self.metadata[filename] = validators
+        return "downloaded"
+
+    def download_all(self, targets, skip_existing=False):
+        """
+        Fetches every (url, filename) in targets concurrently. Returns a dict mapping each filename to the result
+        of fetch().
+        """
+        os.makedirs(self.raw_data_dir, exist_ok=True)
+
+        def fetch_target(target):
+            url, filename = target
+            result = self.fetch(url, filename, skip_existing=skip_existing)
+            print("{}: {} ({})".format(filename, result, url))
+            return filename, result
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                results = dict(pool.map(fetch_target, targets))
+        finally:
+            self._save_metadata()
+        return results
+
+    def _save_metadata(self):
+        with self._metadata_lock:
+            temp_path = self.metadata_path + ".tmp"
+            with open(temp_path, "w") as file_handle:
+                json.dump(self.metadata, file_handle)
+            os.replace(temp_path, self.metadata_path)
+
+
+if __name__ == "__main__":
+    # Only fetch the weeks that we don't already have. Pass skip_existing=False to check every page for changes.
+    Downloader().download_all(get_targets(), skip_existing=True)
@@ -1,45 +1,184 @@
 """
 Rank college football teams according to elo ranking.
 """
-import csv
-import enum
-from collections import defaultdict
-from math import log
+import argparse
+import hashlib
+import heapq
+import itertools
+import logging
+import os
+import time
+from array import array
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from math import log, nan
 from copy import deepcopy
 
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
-from matplotlib import cm
+import numpy as np
 
+from checkpoints import CheckpointCache
+from game_table import (
+    WEEKS_IN_SEASON,
+    GameTable,
+    WinningTeamLocation,
+    home_field_signs,
+)
+from instrumentation import Instrumentation
+from loss_cache import LossCache
+from ranking import RankingIndex
+from results_store import ResultsStore
+from team_registry import TeamRegistry
+
+
+logger = logging.getLogger(__name__)
 
 # We use the first three years of our training set merely to generate initial elo rankings...we don't actually want
 # to measure the loss from these years.
 WARMUP_YEARS = set(range(2010, 2013))
 # The next six years constitute our training set, against which we will try to minimize loss. (We reserve 2019 as our
-# test set.)
+# test set.) ParameterTester can be given other training years, which is how backtest.py scores held-out seasons.
 TRAINING_YEARS = set(range(2013, 2019))
 
-WEEKS_IN_SEASON = 18
 
+def get_k_for_week(param_dict, week):
+    """
+    Returns the value of k that param_dict uses for games in the given week.
+    """
+    if "k_list" in param_dict:
+        return param_dict["k_list"][week - 1]
+    return param_dict["k"]
+
+
+def initial_param_dict(
+    k, home_field, season_regression, allow_different_k_different_weeks=False
+):
+    """
+    Returns the param_dict that a search starts from: a single k for every week, or a k_list holding k for every week
+    if allow_different_k_different_weeks is set.
+    """
+    params = dict(home_field=home_field, season_regression=season_regression)
+    if allow_different_k_different_weeks:
+        params["k_list"] = [k] * WEEKS_IN_SEASON
+    else:
+        params["k"] = k
+    return params
+
+
+class _RatingsView(Mapping):
+    """
+    A read-only mapping from each player with a rating to that rating, backed by the ratings array of an EloMachine.
+    It always reflects the current ratings. Players are listed in the order of their team ids.
+    """
+
+    __slots__ = ("_elo",)
+
+    def __init__(self, elo):
+        self._elo = elo
 
-class WinningTeamLocation(enum.Enum):
-    HOME = 1
-    ROAD = 2
-    NEUTRAL_SITE = 3
+    def __getitem__(self, player):
+        team_id = self._elo.teams.get(player)
+        if team_id is not None and team_id < len(self._elo._ratings):
+            rating = self._elo._ratings[team_id]
+            if rating == rating:
+                return rating
+        raise KeyError(player)
+
+    def __iter__(self):
+        names = self._elo.teams.names
+        for team_id, rating in enumerate(self._elo._ratings):
+            # NaN marks a team that we haven't rated.
+            if rating == rating:
+                yield names[team_id]
+
+    def __len__(self):
+        return self._elo._num_rated
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, dict(self))
 
 
 class EloMachine:
     """
     A class that abstracts away all the stuff specific to the Elo algorithm.
+
+    Ratings live in a flat array of doubles indexed by the team ids of a TeamRegistry. Machines built for the same
+    games (e.g. by ParameterTester) share one registry, so each machine only holds its own array.
     """
 
-    def __init__(self, initial_rating=1000, home_team_advantage=200):
+    __slots__ = (
+        "initial_rating",
+        "home_team_advantage",
+        "teams",
+        "log_loss",
+        "_ratings",
+        "_num_rated",
+        "_ranking",
+    )
+
+    def __init__(self, initial_rating=1000, home_team_advantage=200, teams=None):
         self.initial_rating = initial_rating
         self.home_team_advantage = home_team_advantage
-        # Map each player to his rating under our Elo scheme.
-        self.player_to_rating = {}
+        # The TeamRegistry that gives each player his index into _ratings.
+        self.teams = TeamRegistry() if teams is None else teams
+        # Each player's rating under our Elo scheme, indexed by team id. Players without a rating are NaN, and the
+        # array may be shorter than the registry if the last few players in it haven't been rated.
+        self._ratings = array("d")
+        self._num_rated = 0
         # Accumulate the log loss, which we will attempt to minimize.
         self.log_loss = 0
+        # A RankingIndex over player_to_rating. It's only built the first time that someone asks for rankings, so
+        # that replays which never look at rankings don't pay to maintain it.
+        self._ranking = None
+
+    @property
+    def player_to_rating(self):
+        """
+        A read-only mapping from each player to his rating. Assign a new dict (or mapping) to replace all the ratings.
+        """
+        return _RatingsView(self)
+
+    @player_to_rating.setter
+    def player_to_rating(self, player_to_rating):
+        team_id_to_rating = {
+            self.teams.id_of(player): rating
+            for player, rating in player_to_rating.items()
+        }
+        self._ratings = array("d", [nan]) * len(self.teams)
+        for team_id, rating in team_id_to_rating.items():
+            self._ratings[team_id] = rating
+        self._num_rated = len(team_id_to_rating)
+        self._ranking = None
+
+    def load_ratings(self, ratings):
+        """
+        Replaces all the ratings with a sequence of floats indexed by team id, with NaN for players without a
+        rating. This is much cheaper than assigning to player_to_rating.
+        """
+        self._ratings = array("d", ratings)
+        self._num_rated = sum(rating == rating for rating in self._ratings)
+        self._ranking = None
+
+    @property
+    def ranking(self):
+        """
+        Returns a RankingIndex that answers top(n), bottom(n), rank_of(player) and range(lo, hi) queries. Once
+        built, it is updated incrementally as ratings change.
+        """
+        if self._ranking is None:
+            self._ranking = RankingIndex(self.player_to_rating)
+        return self._ranking
+
+    def _rating_of_id(self, team_id):
+        """
+        Returns the rating of the player with team_id, or the initial rating if he doesn't have one.
+        """
+        if team_id is None or team_id >= len(self._ratings):
+            return self.initial_rating
+        rating = self._ratings[team_id]
+        if rating != rating:
+            return self.initial_rating
+        return rating
 
     @staticmethod
     def expected_outcome(rating1, rating2):
@@ -49,26 +188,84 @@ class EloMachine:
         """
         return 1 / (1 + 10 ** ((rating2 - rating1) / 400))
 
+    def _predict_outcome_from_ratings(self, rating1, rating2, team1_location):
+        # Adjust the ratings according to where the game was played. If the game was played at a neutral site,
+        # no adjustment is necessary.
+        if team1_location == WinningTeamLocation.HOME:
+            rating1 += self.home_team_advantage
+        elif team1_location == WinningTeamLocation.ROAD:
+            rating1 -= self.home_team_advantage
+        return self.expected_outcome(rating1, rating2)
+
     def predict_outcome(self, team1, team2, team1_location):
         """
         Given two teams and the location of the first team, returns the probability that team1 wins.
 
         No side effects.
         """
-        initial_rating_winner = self.player_to_rating.get(team1, self.initial_rating)
-        initial_rating_loser = self.player_to_rating.get(team2, self.initial_rating)
+        return self._predict_outcome_from_ratings(
+            self._rating_of_id(self.teams.get(team1)),
+            self._rating_of_id(self.teams.get(team2)),
+            team1_location,
+        )
 
-        # Adjust the ratings according to where the game was played. If the game was played at a neutral site,
-        # no adjustment is necessary.
-        if team1_location == WinningTeamLocation.HOME:
-            initial_rating_winner += self.home_team_advantage
-        elif team1_location == WinningTeamLocation.ROAD:
-            initial_rating_winner -= self.home_team_advantage
+    def _team_ids(self, teams):
+        """
+        Returns an integer array of the team ids of teams, which may be given as names or as ids. Names that aren't
+        registered get the id len(self.teams), which _ratings_by_id treats as unrated.
+        """
+        if isinstance(teams, np.ndarray) and teams.dtype.kind in "iu":
+            return teams
+        unknown = len(self.teams)
+        return np.fromiter(
+            (
+                self.teams.get(team, unknown) if isinstance(team, str) else team
+                for team in teams
+            ),
+            dtype=np.intp,
+        )
+
+    def _ratings_by_id(self):
+        """
+        Returns a copy of our ratings as a NumPy array with one entry per registered team and one more at the end
+        for unknown teams, with the initial rating for every team that doesn't have a rating.
+        """
+        ratings = np.full(len(self.teams) + 1, float(self.initial_rating))
+        # A copy rather than a view, because NumPy holding on to the array's buffer would stop it from growing.
+        rated = np.array(self._ratings, dtype=float)
+        ratings[: len(rated)] = np.where(np.isnan(rated), ratings[: len(rated)], rated)
+        return ratings
 
-        expected_outcome_winner = self.expected_outcome(
-            initial_rating_winner, initial_rating_loser
+    def predict_outcomes(self, teams1, teams2, team1_locations):
+        """
+        The batch version of predict_outcome. teams1 and teams2 are arrays of team names or team ids, and
+        team1_locations is an array of WinningTeamLocations (or their values), or a single one for every game.
+        Returns a NumPy array of the probabilities that each team in teams1 wins.
+
+        Gives the same probabilities as calling predict_outcome on every game, up to floating-point rounding.
+        """
+        ratings = self._ratings_by_id()
+        home_field = home_field_signs(team1_locations) * self.home_team_advantage
+        return self.expected_outcome(
+            ratings[self._team_ids(teams1)] + home_field,
+            ratings[self._team_ids(teams2)],
         )
-        return expected_outcome_winner
+
+    def outcome_matrix(
+        self, team1_location=WinningTeamLocation.NEUTRAL_SITE, teams=None
+    ):
+        """
+        Returns an n x n NumPy array whose entry (i, j) is the probability that team i beats team j when team i
+        plays at team1_location. The teams default to every team with a rating, in the order of player_to_rating.
+        """
+        if teams is None:
+            team_ids = np.flatnonzero(~np.isnan(np.array(self._ratings, dtype=float)))
+        else:
+            team_ids = self._team_ids(teams)
+        ratings = self._ratings_by_id()[team_ids]
+        home_field = home_field_signs(team1_location) * self.home_team_advantage
+        # Broadcasting a column of team1 ratings against a row of team2 ratings gives every pair at once.
+        return self.expected_outcome(ratings[:, np.newaxis] + home_field, ratings)
 
     def update_ratings_with_result(
         self, winner, loser, winning_team_location, k=40, include_in_log_loss=True
@@ -76,44 +273,55 @@ class EloMachine:
         """
         Updates our ratings with a result. The value of k may be overridden.
         """
-        predicted_outcome = self.predict_outcome(winner, loser, winning_team_location)
+        winner_id = self.teams.id_of(winner)
+        loser_id = self.teams.id_of(loser)
+        ratings = self._ratings
+        if max(winner_id, loser_id) >= len(ratings):
+            ratings.extend([nan] * (len(self.teams) - len(ratings)))
+        initial_rating_winner = ratings[winner_id]
+        if initial_rating_winner != initial_rating_winner:
+            initial_rating_winner = self.initial_rating
+            self._num_rated += 1
+        initial_rating_loser = ratings[loser_id]
+        if initial_rating_loser != initial_rating_loser:
+            initial_rating_loser = self.initial_rating
+            self._num_rated += 1
+        predicted_outcome = self._predict_outcome_from_ratings(
+            initial_rating_winner, initial_rating_loser, winning_team_location
+        )
 
         if include_in_log_loss:
             self.log_loss -= log(predicted_outcome)
 
         delta = k * (1 - predicted_outcome)
-        initial_rating_winner = self.player_to_rating.get(winner, self.initial_rating)
-        initial_rating_loser = self.player_to_rating.get(loser, self.initial_rating)
-        self.player_to_rating[winner] = initial_rating_winner + delta
-        self.player_to_rating[loser] = initial_rating_loser - delta
+        ratings[winner_id] = initial_rating_winner + delta
+        ratings[loser_id] = initial_rating_loser - delta
+        if self._ranking is not None:
+            self._ranking.update(winner, initial_rating_winner + delta)
+            self._ranking.update(loser, initial_rating_loser - delta)
 
     def get_players_with_ratings_descending_order(self):
         """
-        Returns a list of (player, rating) tuples in descending order.
+        Returns a list of (player, rating) tuples in descending order. Players with the same rating are listed in
+        the order of their team ids, which is the order in which they were added unless our TeamRegistry is shared.
         """
-        rating_to_players = defaultdict(list)
-        for player, rating in self.player_to_rating.items():
-            rating_to_players[rating].append(player)
-
-        players = []
-        ratings = []
-        for rating in reversed(sorted(rating_to_players.keys())):
-            players.extend(rating_to_players[rating])
-            while len(ratings) < len(players):
-                ratings.append(rating)
-
-        return list(zip(players, ratings))
+        return self.ranking.all()
 
     def regress_to_mean(self, z):
         """
         For each rating, either contracts it toward the initial rating (if z < 1) or
         widens it away from the initial rating (if z > 1). z = 1 has no effect.
         """
-        player_to_new_rating = {}
-        for player, rating in self.player_to_rating.items():
-            new_rating = self.initial_rating + (rating - self.initial_rating) * z
-            player_to_new_rating[player] = new_rating
-        self.player_to_rating = player_to_new_rating
+        ratings = self._ratings
+        for team_id, rating in enumerate(ratings):
+            # Players without a rating stay at NaN.
+            ratings[team_id] = self.initial_rating + (rating - self.initial_rating) * z
+        if self._ranking is not None:
+            # Any z > 0 keeps the players in the same order, so the index doesn't need to be sorted again.
+            self._ranking.transform(
+                lambda rating: self.initial_rating + (rating - self.initial_rating) * z,
+                order_preserving=z > 0,
+            )
 
 
 class GridParameterGenerator:
@@ -121,6 +329,9 @@ class GridParameterGenerator:
     A ParameterSearch class that implements the grid search strategy.
     """
 
+    # The grid doesn't depend on the losses at all, so pruned candidates can't change what we try.
+    supports_pruning = True
+
     def __init__(
         self,
         k_min=10,
@@ -132,6 +343,7 @@ class GridParameterGenerator:
         season_regression_min=0.5,
         season_regression_max=1.1,
         season_regression_step=0.05,
+        batch_size=100,
     ):
         self.k_min = k_min
         self.k_max = k_max
@@ -142,11 +354,12 @@ class GridParameterGenerator:
         self.season_regression_min = season_regression_min
         self.season_regression_max = season_regression_max
         self.season_regression_step = season_regression_step
+        # The number of grid points handed out in each batch. None means the whole grid at once.
+        self.batch_size = batch_size
 
-    def get_next_params(self):
+    def _iter_grid(self):
         """
-        A generator function for the next values of k, home_field_advantage, and season_regression that we
-        should try.
+        Yields every combination of parameters on the grid, in the order in which we search them.
         """
         for k in range(self.k_min, self.k_max + 1, self.k_step):
             for home_field in range(
@@ -154,23 +367,56 @@ class GridParameterGenerator:
             ):
                 season_regression = self.season_regression_min
                 while season_regression < self.season_regression_max:
-                    print(
-                        "Trying parameters k={}, home_field={}, season_regression={}...".format(
-                            k, home_field, season_regression
-                        )
-                    )
-                    loss = yield dict(
+                    yield dict(
                         k=k, home_field=home_field, season_regression=season_regression
                     )
-                    print("Loss: {}".format(loss))
                     season_regression += self.season_regression_step
 
+    @staticmethod
+    def _log_trying(params):
+        logger.debug(
+            "Trying parameters k=%s, home_field=%s, season_regression=%s...",
+            params["k"],
+            params["home_field"],
+            params["season_regression"],
+        )
+
+    def get_next_params(self):
+        """
+        A generator function for the next values of k, home_field_advantage, and season_regression that we
+        should try.
+        """
+        for params in self._iter_grid():
+            self._log_trying(params)
+            loss = yield params
+            logger.debug("Loss: %s", loss)
+
+    def get_next_param_batches(self):
+        """
+        Like get_next_params, but yields a list of parameter dicts that may be evaluated independently of each
+        other, and expects to be sent back a list of losses in the same order.
+
+        None of the points on the grid depend on each other, so we hand them out in chunks of batch_size.
+        """
+        grid = list(self._iter_grid())
+        batch_size = self.batch_size or max(len(grid), 1)
+        for start in range(0, len(grid), batch_size):
+            batch = grid[start : start + batch_size]
+            for params in batch:
+                self._log_trying(params)
+            losses = yield batch
+            for loss in losses:
+                logger.debug("Loss: %s", loss)
+
 
 class GradientParameterGenerator:
     """
     A ParameterSearch class that implements a simple form of gradient descent.
     """
 
+    # We only ever move to a candidate that beats the best loss so far, which a pruned candidate never does.
+    supports_pruning = True
+
     def __init__(
         self,
         k=100,
@@ -214,44 +460,94 @@ class GradientParameterGenerator:
             yield alter_params_helper([key], delta)
             yield alter_params_helper([key], -delta)
 
+    def _initial_params(self):
+        return initial_param_dict(
+            self.k_start,
+            self.home_field_start,
+            self.season_regression_start,
+            self.allow_different_k_different_weeks,
+        )
+
+    def _params_for_round(self, params, delta):
+        """
+        Yields every tweaked set of params that we compare against params in one round of the search.
+        """
+        for key in params.keys():
+            scaled_delta = delta * 0.01 if key == "season_regression" else delta
+            yield from self._alter_params_for_key(params, key, scaled_delta)
+
+    def _finish_round(self, competing_losses_and_params, best_loss, params, delta):
+        """
+        Given the results of one round, returns the new values of best_loss, params and delta.
+        """
+        new_best_loss, new_best_params = min(
+            competing_losses_and_params, key=lambda x: x[0]
+        )
+        if new_best_loss < best_loss:
+            logger.info(
+                "Accepting new best params (%s) because it produced loss of %s",
+                new_best_params,
+                new_best_loss,
+            )
+            return new_best_loss, new_best_params, delta
+        return best_loss, params, delta / 3.0
+
     def get_next_params(self):
         """
         A generator function for the next values of k, home_field_advantage, and season_regression that we
         should try.
         """
-        params = dict(
-            home_field=self.home_field_start,
-            season_regression=self.season_regression_start,
-        )
-        if self.allow_different_k_different_weeks:
-            params["k_list"] = [self.k_start] * WEEKS_IN_SEASON
-        else:
-            params["k"] = self.k_start
-
+        params = self._initial_params()
         delta = 3
         best_loss = yield params
         while delta > 0.1:
             competing_losses_and_params = []
-            for key in params.keys():
-                scaled_delta = delta * 0.01 if key == "season_regression" else delta
-                for test_params in self._alter_params_for_key(
-                    params, key, scaled_delta
-                ):
-                    param_loss = yield test_params
-                    competing_losses_and_params.append((param_loss, test_params))
-            new_best_loss, new_best_params = min(
-                competing_losses_and_params, key=lambda x: x[0]
+            for test_params in self._params_for_round(params, delta):
+                param_loss = yield test_params
+                competing_losses_and_params.append((param_loss, test_params))
+            best_loss, params, delta = self._finish_round(
+                competing_losses_and_params, best_loss, params, delta
             )
-            if new_best_loss < best_loss:
-                best_loss = new_best_loss
-                params = new_best_params
-                print(
-                    "Accepting new best params ({}) because it produced loss of {}".format(
-                        params, best_loss
-                    )
-                )
-            else:
-                delta /= 3.0
+
+    def get_next_param_batches(self):
+        """
+        Like get_next_params, but yields a list of parameter dicts that may be evaluated independently of each
+        other, and expects to be sent back a list of losses in the same order.
+
+        All the probes in a round are independent, so each round is a single batch.
+        """
+        params = self._initial_params()
+        delta = 3
+        (best_loss,) = yield [params]
+        while delta > 0.1:
+            batch = list(self._params_for_round(params, delta))
+            losses = yield batch
+            best_loss, params, delta = self._finish_round(
+                list(zip(losses, batch)), best_loss, params, delta
+            )
+
+
+class OneAtATimeGeneratorAdapter:
+    """
+    Adapts a parameter generator that only implements get_next_params (yielding one dict and receiving one loss at a
+    time) to the batch protocol that ParameterTester.optimize consumes. Every batch contains a single dict.
+    """
+
+    def __init__(self, parameter_generator_obj):
+        self.parameter_generator_obj = parameter_generator_obj
+        self.supports_pruning = getattr(
+            parameter_generator_obj, "supports_pruning", False
+        )
+
+    def get_next_param_batches(self):
+        parameter_generator = self.parameter_generator_obj.get_next_params()
+        last_loss = None
+        while True:
+            try:
+                param_dict = parameter_generator.send(last_loss)
+            except StopIteration:
+                return
+            (last_loss,) = yield [param_dict]
 
 
 class ParameterTester:
@@ -259,106 +555,675 @@ class ParameterTester:
     The class that carries out the search for optimal parameters, according to some strategy that is given to it.
     """
 
-    def __init__(self, scores):
-        self.scores = scores
+    def __init__(
+        self,
+        scores,
+        workers=None,
+        checkpoint_cache=None,
+        backend="reference",
+        instrumentation=None,
+        results_store=None,
+        loss_cache=None,
+        pruning_margin=None,
+        training_years=None,
+    ):
+        """
+        scores may be a GameTable or a list of (year, week, visiting_school, visiting_score, home_school,
+        home_score) tuples. The log loss only covers the games in training_years, which defaults to TRAINING_YEARS.
+
+        backend names the implementation of the replay in run_one_cycle (see replay_backends.BACKENDS). "reference"
+        replays through an EloMachine, and "compiled" runs a much faster loop over integer-encoded games.
+        "vectorized" is like "compiled", but optimize replays each batch of candidates all at once (see
+        run_many_cycles), unless the generator requires gradients.
+
+        If given an Instrumentation, we record the time spent in each stage of the run, and profile run_one_cycle if
+        it asks us to.
+
+        If given a ResultsStore, optimize looks up every candidate in it before evaluating, and saves every new
+        result to it, so that interrupted or overlapping searches don't repeat work. A LossCache does the same in
+        memory, and also catches candidates that differ only by floating-point noise.
+
+        If pruning_margin is set, optimize gives up on a candidate as soon as its log loss exceeds the best loss that
+        the search has seen so far by more than pruning_margin. Such a candidate can never become the best, so this
+        doesn't change what we find, but bad candidates only cost a fraction of a replay. We only prune for parameter
+        generators that set supports_pruning, since the others would take the lower bounds for real losses, and never
+        with the vectorized backend.
+        """
+        # Imported here because replay_backends itself depends on this module.
+        from replay_backends import BACKENDS
+
+        if not isinstance(scores, GameTable):
+            scores = GameTable.from_scores(scores)
+        self.game_table = scores
+        self.training_years = frozenset(
+            TRAINING_YEARS if training_years is None else training_years
+        )
+        if backend not in BACKENDS:
+            raise ValueError(
+                "Unknown backend {!r}. Choose one of {}.".format(
+                    backend, sorted(BACKENDS)
+                )
+            )
+        self.backend_name = backend
+        self.backend = BACKENDS[backend](
+            self.game_table, training_years=self.training_years
+        )
+        # If set, candidate parameters are evaluated concurrently in a pool of this many processes.
+        self.workers = workers
+        self._pool = None
+        # The games replayed by our workers and by gradient and batched evaluations, which don't go through
+        # self.backend.
+        self._other_games_replayed = 0
+        # If set, a CheckpointCache of rating state at season boundaries, which run_one_cycle resumes from. Testers
+        # whose games are prefixes of one another (see GameTable.through_year) can share one cache.
+        self.checkpoint_cache = checkpoint_cache
+        # Tuples describing the start of every season after the first: the index of its first game, the sorted weeks
+        # of all the games before it, the number of seasons before it, and the sorted training years before it.
+        self._season_boundaries = []
+        weeks_so_far = set()
+        years_so_far = set()
+
+        def season_boundary(index):
+            return (
+                index,
+                tuple(sorted(weeks_so_far)),
+                len(years_so_far),
+                tuple(sorted(self.training_years & years_so_far)),
+            )
+
+        last_year = None
+        for index, (year, week) in enumerate(
+            zip(self.game_table.year.tolist(), self.game_table.week.tolist())
+        ):
+            if year != last_year:
+                if last_year is not None:
+                    self._season_boundaries.append(season_boundary(index))
+                last_year = year
+            weeks_so_far.add(week)
+            years_so_far.add(year)
+        self._season_boundary_at_index = {
+            boundary[0]: boundary for boundary in self._season_boundaries
+        }
+        if len(self.game_table):
+            # The end of our games is the start of a season for a tester with more games, so we checkpoint it too,
+            # although we never resume from it ourselves.
+            self._season_boundary_at_index[len(self.game_table)] = season_boundary(
+                len(self.game_table)
+            )
 
         # Tuples consisting of two elements: first, the log loss, and second, the dict of parameters that attained
         # that log loss.
         self.results = []
+        # Tuples of (lower bound on the log loss, dict of parameters) for the candidates that we pruned. These are also
+        # in results, so that the plots cover every candidate, but their losses there are only lower bounds. They are
+        # always worse than the best result, so results[0] is exact.
+        self.pruned_results = []
+        self.pruning_margin = pruning_margin
         self.best_elo = None
         self.min_loss = 1e9
+        # Built lazily the first time that we evaluate a batch of parameters.
+        self._vectorized_replay = None
+        self.instrumentation = instrumentation
+        self.results_store = results_store
+        self.loss_cache = loss_cache
+        self._data_fingerprint = None
 
-    def run_one_cycle(self, param_dict):
-        """Returns elo ratings for one set of parameters."""
-        elo = EloMachine(home_team_advantage=param_dict["home_field"])
-        last_year = None
-        for (
-            year,
-            week,
-            visiting_school,
-            visiting_score,
-            home_school,
-            home_score,
-        ) in self.scores:
-            if year != last_year:
-                elo.regress_to_mean(param_dict["season_regression"])
-                last_year = year
+    @property
+    def data_fingerprint(self):
+        """
+        A hash of everything besides the parameters that the log loss depends on: the games, and which years we
+        train on.
+        """
+        if self._data_fingerprint is None:
+            digest = hashlib.sha256(self.game_table.fingerprint().encode())
+            digest.update(repr(sorted(self.training_years)).encode())
+            self._data_fingerprint = digest.hexdigest()
+        return self._data_fingerprint
 
-            # We don't actually know which games are neutral-site games, unfortunately. We just know
-            # that bowl games are at neutral sites.
-            if week == WEEKS_IN_SEASON:
-                winning_team_location = WinningTeamLocation.NEUTRAL_SITE
-            else:
-                if home_score > visiting_score:
-                    winning_team_location = WinningTeamLocation.HOME
-                else:
-                    winning_team_location = WinningTeamLocation.ROAD
+    @property
+    def games_replayed(self):
+        """
+        The number of games that we have replayed so far, including in our workers. Replays that resume from a
+        checkpoint or stop early only count the games that they actually played.
+        """
+        return self.backend.games_replayed + self._other_games_replayed
 
-            if home_score > visiting_score:
-                winning_team, losing_team = home_school, visiting_school
-            else:
-                winning_team, losing_team = visiting_school, home_school
+    def _timer(self, stage):
+        """
+        Returns a context manager that times stage, if we are instrumented.
+        """
+        if self.instrumentation is None:
+            return nullcontext()
+        return self.instrumentation.timer(stage)
 
-            if "k_list" in param_dict:
-                k = param_dict["k_list"][week - 1]
-            else:
-                k = param_dict["k"]
-
-            elo.update_ratings_with_result(
-                winning_team,
-                losing_team,
-                winning_team_location,
-                k=k,
-                include_in_log_loss=year in TRAINING_YEARS,
+    def _replay_stage(self, index):
+        """
+        Returns the name of the instrumentation stage for replaying the season that starts at game index.
+        """
+        year = int(self.game_table.year[index])
+        if year in self.training_years:
+            return "training_replay"
+        if year < min(self.training_years, default=year + 1):
+            return "warmup_replay"
+        return "holdout_replay"
+
+    @staticmethod
+    def _checkpoint_key(param_dict, season_boundary):
+        """
+        Returns the key of the checkpoint at season_boundary, built from only the parameters that affect the
+        ratings up to that point. For example, the ratings never depend on k for weeks that haven't been played yet,
+        and regressing to the mean at the start of the very first season has no effect. The log loss only depends on
+        which of the seasons so far are training years.
+        """
+        index, weeks, num_seasons, training_years = season_boundary
+        k_values = tuple(get_k_for_week(param_dict, week) for week in weeks)
+        season_regression = param_dict["season_regression"] if num_seasons > 1 else None
+        return (
+            index,
+            param_dict["home_field"],
+            season_regression,
+            k_values,
+            training_years,
+        )
+
+    def _restore_checkpoint(self, param_dict, stop):
+        """
+        Finds the deepest checkpoint no later than game index stop that matches param_dict. Returns a tuple of the
+        index of the game from which the replay should continue, and the ratings and log loss at that point (None
+        and 0 if there is no checkpoint).
+        """
+        if self.checkpoint_cache is None:
+            return 0, None, 0
+        boundaries = [
+            boundary
+            for boundary in reversed(self._season_boundaries)
+            if boundary[0] <= stop
+        ]
+        if not boundaries:
+            return 0, None, 0
+        found = self.checkpoint_cache.find_deepest(
+            [self._checkpoint_key(param_dict, boundary) for boundary in boundaries]
+        )
+        if found is None:
+            return 0, None, 0
+        position, player_to_rating, log_loss = found
+        return boundaries[position][0], player_to_rating, log_loss
+
+    def _stop_after_year(self, year):
+        """
+        Returns the index of the first game after the given year, or the number of games if there is none.
+        """
+        for index, *_ in self._season_boundaries:
+            if self.game_table.year[index] > year:
+                return index
+        return len(self.game_table)
+
+    def run_one_cycle(
+        self, param_dict, through_year=None, max_log_loss=float("inf"), history=None
+    ):
+        """
+        Returns elo ratings for one set of parameters. If through_year is given, we only replay the seasons up to and
+        including that year, and the log loss only covers the training years among them. This is a cheaper, partial
+        measure of how good the parameters are.
+
+        If the log loss exceeds max_log_loss, we stop replaying, and the log loss of the result is only a lower bound.
+
+        If given a RatingHistoryWriter, we record every rating along the way (see rating_history). The whole replay
+        has to be recorded, so we never resume from a checkpoint in that case.
+        """
+        if through_year is None:
+            stop = len(self.game_table)
+        else:
+            stop = self._stop_after_year(through_year)
+        if history is None:
+            start, player_to_rating, log_loss = self._restore_checkpoint(
+                param_dict, stop
+            )
+        else:
+            start, player_to_rating, log_loss = 0, None, 0
+        if self.checkpoint_cache is None and self.instrumentation is None:
+            return self.backend.replay(
+                param_dict,
+                start=start,
+                player_to_rating=player_to_rating,
+                log_loss=log_loss,
+                stop=stop,
+                max_log_loss=max_log_loss,
+                history=history,
+            )
+
+        # The index of the first game of the season that we're replaying, and the time at which we started it.
+        season_start = start
+        season_start_time = time.perf_counter()
+
+        def end_season(index):
+            nonlocal season_start, season_start_time
+            if self.instrumentation is not None:
+                now = time.perf_counter()
+                self.instrumentation.add_time(
+                    self._replay_stage(season_start), now - season_start_time
+                )
+                season_start, season_start_time = index, now
+
+        def save_checkpoint(index, player_to_rating, log_loss):
+            with self._timer("checkpointing"):
+                self.checkpoint_cache.put(
+                    self._checkpoint_key(
+                        param_dict, self._season_boundary_at_index[index]
+                    ),
+                    player_to_rating,
+                    log_loss,
+                )
+
+        def on_season_start(index, player_to_rating, log_loss):
+            nonlocal season_start_time
+            end_season(index)
+            if self.checkpoint_cache is not None:
+                save_checkpoint(index, player_to_rating, log_loss)
+                season_start_time = time.perf_counter()
+
+        profiling = (
+            self.instrumentation.profiling()
+            if self.instrumentation is not None
+            else nullcontext()
+        )
+        with profiling:
+            elo = self.backend.replay(
+                param_dict,
+                start=start,
+                player_to_rating=player_to_rating,
+                log_loss=log_loss,
+                on_season_start=on_season_start,
+                stop=stop,
+                max_log_loss=max_log_loss,
+                history=history,
             )
+        end_season(stop)
+        pruned = elo.log_loss > max_log_loss
+        if (
+            self.checkpoint_cache is not None
+            and start < stop
+            and stop in self._season_boundary_at_index
+            and not pruned
+        ):
+            # Save the state at the end of the replay as well, so that a longer replay can carry on from it.
+            save_checkpoint(stop, elo.player_to_rating, elo.log_loss)
         return elo
 
+    def run_many_cycles(self, param_dicts):
+        """
+        Returns elo ratings for many sets of parameters at once, in the same order as param_dicts.
+
+        This gives the same results as calling run_one_cycle on each dict (up to floating-point rounding), but
+        replays the games only once.
+        """
+        # Imported here because vectorized_elo itself depends on this module.
+        from vectorized_elo import VectorizedEloReplay
+
+        if self._vectorized_replay is None:
+            self._vectorized_replay = VectorizedEloReplay(
+                self.game_table, training_years=self.training_years
+            )
+        self._other_games_replayed += len(param_dicts) * len(self.game_table)
+        return self._vectorized_replay.replay_to_elo_machines(param_dicts)
+
+    def _run_many_cycles_lazily(self, param_dicts):
+        """
+        Yields the results of run_many_cycles, which only runs when the first result is needed (so that the time
+        goes to whoever is waiting for it).
+        """
+        yield from self.run_many_cycles(param_dicts)
+
+    def run_one_cycle_with_gradient(self, param_dict):
+        """
+        Like run_one_cycle, but returns a tuple of the elo ratings and a dict holding the exact derivative of the
+        log loss with respect to each parameter in param_dict.
+        """
+        # Imported here because analytic_gradient itself depends on this module.
+        from analytic_gradient import loss_and_gradient
+
+        self._other_games_replayed += len(self.game_table)
+        return loss_and_gradient(
+            self.game_table, param_dict, training_years=self.training_years
+        )
+
+    def _get_pool(self):
+        """
+        Returns our process pool, creating it if necessary. Each worker receives the game table exactly once.
+        """
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(
+                    self.game_table,
+                    self.checkpoint_cache is not None,
+                    self.backend_name,
+                    self.training_years,
+                ),
+            )
+        return self._pool
+
+    def _elo_from_worker(self, param_dict, log_loss, ratings):
+        """
+        Returns the EloMachine that a worker evaluated for param_dict, given its log loss and ratings array.
+        """
+        elo = EloMachine(
+            initial_rating=self.backend.initial_rating,
+            home_team_advantage=param_dict["home_field"],
+            teams=self.game_table.team_registry,
+        )
+        elo.load_ratings(ratings)
+        elo.log_loss = log_loss
+        return elo
+
+    def _count_worker_games(self, worker_results):
+        """
+        Yields the results of worker_results, an iterable of (result, games replayed) tuples from the worker
+        functions, adding up the games replayed as we go.
+        """
+        for result, games_replayed in worker_results:
+            self._other_games_replayed += games_replayed
+            yield result
+
+    def close(self):
+        """
+        Shuts down the process pool, if we started one.
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def evaluate_batch(
+        self, param_dicts, with_gradients=False, max_log_loss=float("inf")
+    ):
+        """
+        Returns an iterator over elo ratings for every dict in param_dicts, in the same order. If we were given
+        workers, the dicts are evaluated concurrently. If with_gradients is set, each item is instead a tuple of the
+        elo ratings and the gradient of the log loss (see run_one_cycle_with_gradient). Otherwise, replays stop early
+        once their log loss exceeds max_log_loss (see run_one_cycle). With the vectorized backend, a batch that
+        doesn't need gradients or early stopping is replayed all at once (split evenly between the workers, if we
+        have them).
+
+        Results are produced lazily so that we don't have to hold an EloMachine for every dict in a large batch.
+        Workers only send back the log loss and the ratings array of each result, and we rebuild the EloMachines
+        around our own TeamRegistry.
+        """
+        replay_all_at_once = (
+            getattr(self.backend, "replays_batches", False)
+            and not with_gradients
+            and max_log_loss == float("inf")
+        )
+        if not self.workers:
+            if replay_all_at_once:
+                return self._run_many_cycles_lazily(param_dicts)
+            if with_gradients:
+                return map(self.run_one_cycle_with_gradient, param_dicts)
+            return (
+                self.run_one_cycle(param_dict, max_log_loss=max_log_loss)
+                for param_dict in param_dicts
+            )
+        if replay_all_at_once:
+            block_size = -(-len(param_dicts) // self.workers)
+            worker_results = self._get_pool().map(
+                _run_many_cycles_in_worker,
+                [
+                    param_dicts[start : start + block_size]
+                    for start in range(0, len(param_dicts), block_size)
+                ],
+            )
+            return (
+                self._elo_from_worker(param_dict, *state)
+                for param_dict, state in zip(
+                    param_dicts,
+                    itertools.chain.from_iterable(
+                        self._count_worker_games(worker_results)
+                    ),
+                )
+            )
+        chunksize = max(1, len(param_dicts) // (self.workers * 4))
+        if with_gradients:
+            worker_results = self._get_pool().map(
+                _run_one_cycle_with_gradient_in_worker,
+                param_dicts,
+                chunksize=chunksize,
+            )
+            return (
+                (self._elo_from_worker(param_dict, *state), gradient)
+                for param_dict, (state, gradient) in zip(
+                    param_dicts, self._count_worker_games(worker_results)
+                )
+            )
+        worker_results = self._get_pool().map(
+            _run_one_cycle_in_worker,
+            param_dicts,
+            [max_log_loss] * len(param_dicts),
+            chunksize=chunksize,
+        )
+        return (
+            self._elo_from_worker(param_dict, *state)
+            for param_dict, state in zip(
+                param_dicts, self._count_worker_games(worker_results)
+            )
+        )
+
+    def evaluate_partial_losses(self, param_dicts, through_year):
+        """
+        Returns the log loss of every dict in param_dicts when we replay only the seasons up to and including
+        through_year (see run_one_cycle). Parameter generators can use this to weed out bad candidates cheaply.
+        """
+        if not self.workers:
+            return [
+                self.run_one_cycle(param_dict, through_year=through_year).log_loss
+                for param_dict in param_dicts
+            ]
+        chunksize = max(1, len(param_dicts) // (self.workers * 4))
+        return list(
+            self._count_worker_games(
+                self._get_pool().map(
+                    _partial_loss_in_worker,
+                    param_dicts,
+                    [through_year] * len(param_dicts),
+                    chunksize=chunksize,
+                )
+            )
+        )
+
     def optimize(self, parameter_generator_obj):
         """
         Runs a full optimization cycle.
+
+        The generator object should implement get_next_param_batches, a generator function that yields lists of
+        parameter dicts and is sent back the list of their losses. Objects that only implement get_next_params are
+        wrapped in a OneAtATimeGeneratorAdapter. Each batch is evaluated in bulk (in parallel, if we were given
+        workers), and the results are identical to evaluating the dicts one at a time. Generators that set
+        requires_gradients are sent (loss, gradient) tuples instead of losses.
+
+        If we have a pruning_margin and the generator sets supports_pruning, candidates that we prune are sent the
+        lower bound on their loss at which we gave up. That is worse than the best loss that the generator has been
+        sent so far, so a generator that only ever moves to a better candidate makes the same moves as it would
+        without pruning. Generators that model the losses (like TPEParameterGenerator) would be misled by the lower
+        bounds, so they leave supports_pruning unset and their candidates are never pruned.
         """
-        # Prime the parameter generator and get our first set of parameters.
-        parameter_generator = parameter_generator_obj.get_next_params()
-        last_loss = None
+        for _ in self.optimize_stepwise(parameter_generator_obj):
+            pass
+
+    def optimize_stepwise(self, parameter_generator_obj):
+        """
+        Like optimize, but as a generator that evaluates one batch of candidates each time that it's advanced, so
+        that callers can interleave several searches (see backtest.py).
+        """
+        if not hasattr(parameter_generator_obj, "get_next_param_batches"):
+            parameter_generator_obj = OneAtATimeGeneratorAdapter(
+                parameter_generator_obj
+            )
+        requires_gradients = getattr(
+            parameter_generator_obj, "requires_gradients", False
+        )
+        pruning = (
+            self.pruning_margin is not None
+            and getattr(parameter_generator_obj, "supports_pruning", False)
+            and not requires_gradients
+            # Replaying a batch all at once is cheaper than pruning it (see evaluate_batch).
+            and not getattr(self.backend, "replays_batches", False)
+        )
+        # Prime the parameter generator and get our first batch of parameters.
+        parameter_generator = parameter_generator_obj.get_next_param_batches()
+        last_losses = None
+        # The best loss that we've sent to this generator. We prune against this rather than against min_loss, which
+        # may come from an earlier search, so that pruning never changes what the generator is told.
+        best_loss = float("inf")
         while True:
             try:
-                param_dict = parameter_generator.send(last_loss)
+                with self._timer("generator"):
+                    param_dicts = parameter_generator.send(last_losses)
             except StopIteration:
                 break
             else:
-                elo = self.run_one_cycle(param_dict)
-                if elo.log_loss < self.min_loss:
+                if pruning:
+                    max_log_loss = best_loss + self.pruning_margin
+                else:
+                    max_log_loss = float("inf")
+                last_losses = self._evaluate_candidates(
+                    param_dicts, requires_gradients, max_log_loss
+                )
+                if not requires_gradients and last_losses:
+                    best_loss = min(best_loss, min(last_losses))
+                yield
+        with self._timer("loss_accumulation"):
+            # Just ignore the dict element. We don't want it to be used as a tiebreaker because it isn't sortable.
+            self.results.sort(key=lambda x: x[0])
+
+    def _look_up_results(self, param_dicts, requires_gradients):
+        """
+        Returns a list holding a (log loss, EloMachine or None) tuple for each dict in param_dicts that our loss cache
+        or results store already knows, and None for the rest.
+        """
+        known = [None] * len(param_dicts)
+        if requires_gradients:
+            # Neither of them keeps gradients, so generators that need gradients always get fresh evaluations.
+            return known
+        if self.loss_cache is not None:
+            known = [self.loss_cache.get(param_dict) for param_dict in param_dicts]
+        if self.results_store is not None:
+            missing = [i for i, result in enumerate(known) if result is None]
+            stored_losses = self.results_store.get_many(
+                self.data_fingerprint, [param_dicts[i] for i in missing]
+            )
+            for i, log_loss in zip(missing, stored_losses):
+                if log_loss is not None:
+                    known[i] = (log_loss, None)
+                    if self.loss_cache is not None:
+                        self.loss_cache.put(param_dicts[i], log_loss)
+        return known
+
+    def _evaluate_candidates(
+        self, param_dicts, requires_gradients, max_log_loss=float("inf")
+    ):
+        """
+        Evaluates one batch from a parameter generator, records the results, and returns the losses (or (loss,
+        gradient) tuples) to send back to the generator. Candidates whose replays exceed max_log_loss are pruned.
+        """
+        games_replayed_before = self.games_replayed
+        known = self._look_up_results(param_dicts, requires_gradients)
+        # With a loss cache, a candidate that appears more than once in the batch is only evaluated once.
+        if self.loss_cache is not None:
+            keys = [self.loss_cache.key(param_dict) for param_dict in param_dicts]
+        else:
+            keys = list(range(len(param_dicts)))
+        to_evaluate = {}
+        for key, param_dict, result in zip(keys, param_dicts, known):
+            if result is None:
+                to_evaluate.setdefault(key, param_dict)
+        evaluations = iter(
+            self.evaluate_batch(
+                list(to_evaluate.values()),
+                with_gradients=requires_gradients,
+                max_log_loss=max_log_loss,
+            )
+        )
+
+        evaluated = {}
+        losses = []
+        new_results = []
+        num_pruned = 0
+        for key, param_dict, result in zip(keys, param_dicts, known):
+            if result is None and key not in evaluated:
+                with self._timer("evaluation"):
+                    evaluated[key] = next(evaluations)
+                is_new = True
+            else:
+                is_new = False
+            with self._timer("loss_accumulation"):
+                if result is not None:
+                    log_loss, elo = result
+                    losses.append(log_loss)
+                elif requires_gradients:
+                    elo, gradient = evaluated[key]
+                    log_loss = elo.log_loss
+                    losses.append((log_loss, gradient))
+                else:
+                    elo = evaluated[key]
+                    log_loss = elo.log_loss
+                    losses.append(log_loss)
+                    if log_loss > max_log_loss:
+                        # We stopped replaying early, so this is only a lower bound on the loss. It goes in results
+                        # (for the plots), but not in the caches.
+                        self.pruned_results.append((log_loss, param_dict))
+                        self.results.append((log_loss, param_dict))
+                        if is_new:
+                            num_pruned += 1
+                        continue
+                if is_new:
+                    new_results.append((log_loss, param_dict))
+                    if self.loss_cache is not None:
+                        self.loss_cache.put(param_dict, log_loss, elo)
+                if log_loss < self.min_loss:
+                    if elo is None:
+                        # We only kept the loss, so work out the ratings again. This happens only when the best
+                        # result so far improves.
+                        elo = self.run_one_cycle(param_dict)
                     self.best_elo = elo
-                    self.min_loss = elo.log_loss
-                last_loss = elo.log_loss
+                    self.min_loss = log_loss
+
+                self.results.append((log_loss, param_dict))
+
+        if self.results_store is not None:
+            self.results_store.add_many(self.data_fingerprint, new_results)
+        if self.instrumentation is not None:
+            self.instrumentation.count("candidates", len(to_evaluate))
+            self.instrumentation.count(
+                "games", self.games_replayed - games_replayed_before
+            )
+            if self.results_store is not None or self.loss_cache is not None:
+                self.instrumentation.count(
+                    "reused_candidates", len(param_dicts) - len(to_evaluate)
+                )
+            if self.pruning_margin is not None:
+                self.instrumentation.count("pruned_candidates", num_pruned)
+        return losses
 
-                self.results.append((last_loss, param_dict))
-        # Just ignore the dict element. We don't want it to be used as a tiebreaker because it isn't sortable.
-        self.results.sort(key=lambda x: x[0])
+    def top_results(self, n):
+        """
+        Returns the n best (log loss, param_dict) tuples, best first. With a results store, these come from every
+        search that has ever used the store (on the same data), not just this one.
+        """
+        if self.results_store is not None:
+            return self.results_store.top(self.data_fingerprint, n)
+        return heapq.nsmallest(n, self.results, key=lambda x: x[0])
 
     def plot_one_field(self, field, outfile=None):
         """
+        Plots the best loss that we found for each value of field (see plotting.plot_one_field).
+
         Throws an AssertionError if we haven't generated results yet.
         """
         assert self.results
+        # Imported here so that nothing else in this module pays for importing matplotlib.
+        import plotting
 
-        grouped_results = defaultdict(list)
-        for log_loss, params in self.results:
-            grouped_results[params[field]].append(log_loss)
-        grouped_results_flattened = [(k, min(v)) for k, v in grouped_results.items()]
-
-        x_list = []
-        y_list = []
-        for x, y in sorted(grouped_results_flattened):
-            x_list.append(x)
-            y_list.append(y)
-
-        plt.plot(x_list, y_list)
-        plt.xlabel(field)
-        plt.ylabel("log_loss")
-        if outfile:
-            plt.savefig(outfile)
-        plt.show()
+        with self._timer("plotting"):
+            plotting.plot_one_field(self.results, field, outfile)
 
     def plot_two_fields(self, first_field, second_field, outfile=None):
         """
@@ -368,62 +1233,137 @@ class ParameterTester:
         Throws an AssertionError if we haven't generated results yet.
         """
         assert self.results
+        # Imported here so that nothing else in this module pays for importing matplotlib.
+        import plotting
+
+        with self._timer("plotting"):
+            plotting.plot_two_fields(self.results, first_field, second_field, outfile)
+
+
+# The ParameterTester owned by each worker process in a parallel optimization.
+_worker_tester = None
+
+
+def _init_worker(game_table, use_checkpoint_cache, backend, training_years):
+    global _worker_tester
+    _worker_tester = ParameterTester(
+        game_table,
+        checkpoint_cache=CheckpointCache() if use_checkpoint_cache else None,
+        backend=backend,
+        training_years=training_years,
+    )
+
+
+def _with_games_replayed(function, *args):
+    """
+    Returns a tuple of the result of calling function and the number of games that the worker replayed meanwhile.
+    """
+    games_replayed = _worker_tester.games_replayed
+    result = function(*args)
+    return result, _worker_tester.games_replayed - games_replayed
+
+
+def _worker_state(elo):
+    """
+    Returns what a worker sends back for elo: its log loss and its ratings array. The parent already has the
+    TeamRegistry, so we don't pickle a copy of it with every result (see ParameterTester._elo_from_worker).
+    """
+    return elo.log_loss, elo._ratings
+
+
+def _run_one_cycle_in_worker(param_dict, max_log_loss):
+    elo, games_replayed = _with_games_replayed(
+        _worker_tester.run_one_cycle, param_dict, None, max_log_loss
+    )
+    return _worker_state(elo), games_replayed
 
-        grouped_results = defaultdict(list)
-        for log_loss, params in self.results:
-            grouped_results[(params[first_field], params[second_field])].append(
-                log_loss
-            )
-        grouped_results_flattened = {k: min(v) for k, v in grouped_results.items()}
-
-        x_list = []
-        y_list = []
-        z_list = []
-        for (x, y), z in grouped_results_flattened.items():
-            x_list.append(x)
-            y_list.append(y)
-            z_list.append(z)
-
-        fig = plt.figure()
-        ax = Axes3D(fig)
-        ax.plot_trisurf(x_list, y_list, z_list, cmap=cm.coolwarm, linewidth=0.1)
-        ax.set_xlabel(first_field)
-        ax.set_ylabel(second_field)
-        ax.set_zlabel("log_loss")
-        if outfile:
-            plt.savefig(outfile)
-        plt.show()
+
+def _run_many_cycles_in_worker(param_dicts):
+    elos, games_replayed = _with_games_replayed(
+        _worker_tester.run_many_cycles, param_dicts
+    )
+    return [_worker_state(elo) for elo in elos], games_replayed
+
+
+def _run_one_cycle_with_gradient_in_worker(param_dict):
+    (elo, gradient), games_replayed = _with_games_replayed(
+        _worker_tester.run_one_cycle_with_gradient, param_dict
+    )
+    return (_worker_state(elo), gradient), games_replayed
+
+
+def _partial_loss_in_worker(param_dict, through_year):
+    elo, games_replayed = _with_games_replayed(
+        _worker_tester.run_one_cycle, param_dict, through_year
+    )
+    return elo.log_loss, games_replayed
 
 
 if __name__ == "__main__":
-    scores = []
-    with open("scores.csv", newline="") as csvfile:
-        scores_reader = csv.reader(csvfile)
-        for (
-            year,
-            week,
-            visiting_school,
-            visiting_score,
-            home_school,
-            home_score,
-        ) in scores_reader:
-            scores.append(
-                (
-                    int(year),
-                    int(week),
-                    visiting_school,
-                    int(visiting_score),
-                    home_school,
-                    int(home_score),
-                )
-            )
-    searcher = ParameterTester(scores)
+    parser = argparse.ArgumentParser(description="Search for the best Elo parameters.")
+    parser.add_argument(
+        "--log-level",
+        default="INFO",
+        help="Use DEBUG to see every candidate that we try, or WARNING to see only the final results.",
+    )
+    parser.add_argument(
+        "--metrics", help="Write the timings and counters of the run to this JSON file."
+    )
+    parser.add_argument(
+        "--profile",
+        help="Profile run_one_cycle and write the stats to this file. Implies --workers 0.",
+    )
+    parser.add_argument(
+        "--profile-every",
+        type=int,
+        default=1,
+        help="Only profile one cycle in this many.",
+    )
+    parser.add_argument(
+        "--results-store",
+        help="Keep every result in this SQLite file, and skip candidates that it already has.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Evaluate candidates in parallel across this many processes. 0 runs them serially.",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(message)s")
+
+    instrumentation = Instrumentation(
+        profile=bool(args.profile), profile_every=args.profile_every
+    )
+    with instrumentation.timer("load"):
+        # Only parses scores.csv if it has changed since the last run.
+        scores = GameTable.load_cached("scores.csv")
+    # The profiler can only see cycles that run in this process.
+    workers = None if args.profile or not args.workers else args.workers
+    # The compiled backend gives exactly the same results as the reference EloMachine, only much faster. It replays a
+    # season faster than we can snapshot one, so we don't give it a checkpoint cache (see checkpoints.py). Without
+    # Numba, replaying each batch all at once is faster (2.1s for the grid search, against 9.2s), even though we then
+    # can't prune.
+    from replay_backends import CompiledBackend
+
+    searcher = ParameterTester(
+        scores,
+        workers=workers,
+        backend="compiled" if CompiledBackend.compiled else "vectorized",
+        instrumentation=instrumentation,
+        results_store=ResultsStore(args.results_store) if args.results_store else None,
+        loss_cache=LossCache(),
+        # Candidates that can't beat the best so far are abandoned partway through their replay.
+        pruning_margin=0,
+    )
     skip_grid_search = False
     if not skip_grid_search:
         searcher.optimize(GridParameterGenerator())
         best_loss, best_params = searcher.results[0]
-        print(
-            "Best params after initial grid search: {}".format(best_params, best_loss)
+        logger.info(
+            "Best params after initial grid search: %s (loss=%s)",
+            best_params,
+            best_loss,
         )
 
     regenerate_plots = False
@@ -440,38 +1380,55 @@ if __name__ == "__main__":
             "season_regression",
             outfile="home_field_and_season_regression.png",
         )
-    print("\n\nNow carrying out more refined search with gradient descent...")
+    # Imported here because analytic_gradient itself depends on this module.
+    from analytic_gradient import LBFGSParameterGenerator
+
+    # L-BFGS with exact gradients needs tens of replays where GradientParameterGenerator's finite differences need
+    # thousands once k varies across weeks, and it finishes within 0.001 of their loss.
+    logger.info("\n\nNow carrying out more refined search with L-BFGS...")
     if skip_grid_search:
-        gradient_parameters = GradientParameterGenerator()
+        gradient_parameters = LBFGSParameterGenerator()
     else:
-        gradient_parameters = GradientParameterGenerator(**best_params)
+        gradient_parameters = LBFGSParameterGenerator(**best_params)
     searcher.optimize(gradient_parameters)
     best_loss, best_params = searcher.results[0]
-    print(
-        "Best params after gradient refinement: {} (loss={})".format(
-            best_params, best_loss
-        )
+    logger.info(
+        "Best params after gradient refinement: %s (loss=%s)", best_params, best_loss
     )
-    print(
+    logger.info(
         "\n\nNow carrying out more refined search by allowing k to vary across weeks..."
     )
     searcher.optimize(
-        GradientParameterGenerator(
-            **best_params, allow_different_k_different_weeks=True
-        )
+        LBFGSParameterGenerator(**best_params, allow_different_k_different_weeks=True)
     )
     best_loss, best_params = searcher.results[0]
-    print(
-        "Best params after allowing k to vary across weeks: {} (loss={})".format(
-            best_params, best_loss
-        )
+    logger.info(
+        "Best params after allowing k to vary across weeks: %s (loss=%s)",
+        best_params,
+        best_loss,
     )
-    players_and_rankings = searcher.best_elo.get_players_with_ratings_descending_order()
-    top_25 = players_and_rankings[:25]
+    searcher.close()
+    instrumentation.log_report()
+    logger.info("Loss cache: %s", searcher.loss_cache.stats())
+    logger.info(
+        "Pruned %s of %s candidates",
+        len(searcher.pruned_results),
+        len(searcher.results),
+    )
+    if args.metrics:
+        instrumentation.save(args.metrics)
+    if args.profile:
+        instrumentation.dump_profile(args.profile)
+        logger.info(instrumentation.profile_stats())
+    ranking = searcher.best_elo.ranking
     print("Introducing the top 25 of 2019...")
-    for i, (player, rating) in enumerate(top_25):
+    for i, (player, rating) in enumerate(ranking.top(25)):
         print("{}) {} ({})".format(i + 1, player, int(rating)))
-    bottom_25 = players_and_rankings[-25:]
+    bottom_25 = ranking.bottom(25)
     print("And the bottom top 25 of 2019...")
     for i, (player, rating) in enumerate(bottom_25):
-        print("{}) {} ({})".format(len(players_and_rankings) - 24 + i, player, int(rating)))
+        print(
+            "{}) {} ({})".format(
+                len(ranking) - len(bottom_25) + 1 + i, player, int(rating)
+            )
+        )
@@ -0,0 +1,280 @@
+"""
+A compact, columnar representation of every game in scores.csv.
+
+Each game is stored from the winner's point of view: the year, the week, the ids of the winning and losing teams, and
+where the winning team played. Team names are interned into a table that maps ids back to names. The table can be
+saved to (and memory-mapped from) .npy files, so we only parse scores.csv when it changes.
+"""
+import csv
+import enum
+import hashlib
+import os
+
+import numpy as np
+
+from team_registry import TeamRegistry
+
+
+WEEKS_IN_SEASON = 18
+
+
+class WinningTeamLocation(enum.Enum):
+    HOME = 1
+    ROAD = 2
+    NEUTRAL_SITE = 3
+
+
+def home_field_signs(locations):
+    """
+    Returns an array holding +1.0 where a team played at home, -1.0 where it played on the road and 0.0 at a neutral
+    site, for an array (or a single value) of WinningTeamLocations or their values. Multiplying by the home field
+    advantage gives the adjustment to the team's rating.
+    """
+    if isinstance(locations, (WinningTeamLocation, int)):
+        locations = [locations]
+    if not isinstance(locations, np.ndarray):
+        locations = np.fromiter(
+            (getattr(location, "value", location) for location in locations),
+            dtype=np.int8,
+        )
+    return np.where(
+        locations == WinningTeamLocation.HOME.value,
+        1.0,
+        np.where(locations == WinningTeamLocation.ROAD.value, -1.0, 0.0),
+    )
+
+
+def get_winner_loser_and_location(
+    week, visiting_school, visiting_score, home_school, home_score
+):
+    """
+    Given one row of scores.csv (minus the year), returns a tuple of the winning team, the losing team, and the
+    WinningTeamLocation of the winning team.
+    """
+    # We don't actually know which games are neutral-site games, unfortunately. We just know
+    # that bowl games are at neutral sites.
+    if week == WEEKS_IN_SEASON:
+        winning_team_location = WinningTeamLocation.NEUTRAL_SITE
+    else:
+        if home_score > visiting_score:
+            winning_team_location = WinningTeamLocation.HOME
+        else:
+            winning_team_location = WinningTeamLocation.ROAD
+
+    if home_score > visiting_score:
+        winning_team, losing_team = home_school, visiting_school
+    else:
+        winning_team, losing_team = visiting_school, home_school
+    return winning_team, losing_team, winning_team_location
+
+
+def read_scores_csv(path):
+    """
+    Returns the rows of a scores csv as a list of (year, week, visiting_school, visiting_score, home_school,
+    home_score) tuples.
+    """
+    scores = []
+    with open(path, newline="") as csvfile:
+        scores_reader = csv.reader(csvfile)
+        for (
+            year,
+            week,
+            visiting_school,
+            visiting_score,
+            home_school,
+            home_score,
+        ) in scores_reader:
+            scores.append(
+                (
+                    int(year),
+                    int(week),
+                    visiting_school,
+                    int(visiting_score),
+                    home_school,
+                    int(home_score),
+                )
+            )
+    return scores
+
+
+class GameTable:
+    """
+    Every game as a row of a NumPy structured array, along with the list of team names indexed by team id.
+
+    Team ids are handed out in the order in which teams first appear (winner before loser), which is the same order
+    in which an EloMachine first inserts them into player_to_rating.
+    """
+
+    GAME_DTYPE = np.dtype(
+        [
+            ("year", np.int16),
+            ("week", np.int8),
+            ("winner_id", np.int32),
+            ("loser_id", np.int32),
+            ("location", np.int8),
+        ]
+    )
+
+    def __init__(self, games, teams):
+        self.games = games
+        self.teams = teams
+        # Shared by the EloMachines that replays of this table build, so that their ratings are indexed by team id.
+        self.team_registry = TeamRegistry(teams)
+        self._home_sign = None
+
+    @classmethod
+    def from_scores(cls, scores):
+        """
+        Builds a table from a list of (year, week, visiting_school, visiting_score, home_school, home_score) tuples.
+        """
+        team_to_id = {}
+        games = np.empty(len(scores), dtype=cls.GAME_DTYPE)
+        for i, (
+            year,
+            week,
+            visiting_school,
+            visiting_score,
+            home_school,
+            home_score,
+        ) in enumerate(scores):
+            winning_team, losing_team, winning_team_location = (
+                get_winner_loser_and_location(
+                    week, visiting_school, visiting_score, home_school, home_score
+                )
+            )
+            for team in (winning_team, losing_team):
+                if team not in team_to_id:
+                    team_to_id[team] = len(team_to_id)
+            games[i] = (
+                year,
+                week,
+                team_to_id[winning_team],
+                team_to_id[losing_team],
+                winning_team_location.value,
+            )
+        return cls(games, list(team_to_id))
+
+    @staticmethod
+    def _cache_paths(cache_dir):
+        return (
+            os.path.join(cache_dir, "games.npy"),
+            os.path.join(cache_dir, "teams.npy"),
+            os.path.join(cache_dir, "source.sha256"),
+        )
+
+    def save(self, cache_dir, source_fingerprint=""):
+        """
+        Writes the table to cache_dir, along with the fingerprint of the file that it was built from.
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        games_path, teams_path, fingerprint_path = self._cache_paths(cache_dir)
+        np.save(games_path, np.asarray(self.games))
+        np.save(teams_path, np.array(self.teams, dtype=str))
+        # Write the fingerprint last, so that an interrupted save is never mistaken for a valid one.
+        with open(fingerprint_path, "w") as file_handle:
+            file_handle.write(source_fingerprint)
+
+    @classmethod
+    def load(cls, cache_dir):
+        """
+        Loads a table written by save(). The games are memory-mapped rather than read.
+        """
+        games_path, teams_path, _ = cls._cache_paths(cache_dir)
+        games = np.load(games_path, mmap_mode="r")
+        teams = np.load(teams_path).tolist()
+        return cls(games, teams)
+
+    @classmethod
+    def load_cached(cls, csv_path="scores.csv", cache_dir=None):
+        """
+        Returns the table for csv_path, parsing the csv only if it has changed since we last cached it.
+
+        The cache lives in cache_dir, which defaults to a directory next to the csv (e.g. scores_table/).
+        """
+        if cache_dir is None:
+            cache_dir = os.path.splitext(csv_path)[0] + "_table"
+        with open(csv_path, "rb") as file_handle:
+            fingerprint = hashlib.sha256(file_handle.read()).hexdigest()
+
+        _, _, fingerprint_path = cls._cache_paths(cache_dir)
+        try:
+            with open(fingerprint_path) as file_handle:
+                cached_fingerprint = file_handle.read()
+        except FileNotFoundError:
+            cached_fingerprint = None
+        if cached_fingerprint == fingerprint:
+            return cls.load(cache_dir)
+
+        table = cls.from_scores(read_scores_csv(csv_path))
+        if os.path.exists(fingerprint_path):
+            os.remove(fingerprint_path)
+        table.save(cache_dir, source_fingerprint=fingerprint)
+        return table
+
+    def __len__(self):
+        return len(self.games)
+
+    def through_year(self, year):
+        """
+        Returns a table of our games up to and including year. The games are in order, so these are a prefix of ours,
+        and the new table gives every team the same id as we do.
+        """
+        games = self.games[: int(np.searchsorted(self.year, year, side="right"))]
+        ids = np.concatenate((games["winner_id"], games["loser_id"]))
+        num_teams = int(ids.max(initial=-1)) + 1
+        return GameTable(games, self.teams[:num_teams])
+
+    def fingerprint(self):
+        """
+        Returns a hash of the games and the team names. Two tables with the same fingerprint hold the same games in
+        the same order.
+        """
+        digest = hashlib.sha256(np.ascontiguousarray(self.games).tobytes())
+        digest.update("\n".join(self.teams).encode())
+        return digest.hexdigest()
+
+    @property
+    def year(self):
+        return self.games["year"]
+
+    @property
+    def week(self):
+        return self.games["week"]
+
+    @property
+    def winner_id(self):
+        return self.games["winner_id"]
+
+    @property
+    def loser_id(self):
+        return self.games["loser_id"]
+
+    @property
+    def location(self):
+        return self.games["location"]
+
+    @property
+    def home_sign(self):
+        """
+        The home_field_signs of the winners' locations, which is the direction in which home field advantage shifts
+        each winner's rating. Computed the first time that it's needed.
+        """
+        if self._home_sign is None:
+            self._home_sign = home_field_signs(self.location)
+        return self._home_sign
+
+    def iter_games(self):
+        """
+        Yields a (year, week, winning_team, losing_team, winning_team_location) tuple for every game, in order.
+        """
+        teams = self.teams
+        for year, week, winner_id, loser_id, location in zip(
+            self.year.tolist(),
+            self.week.tolist(),
+            self.winner_id.tolist(),
+            self.loser_id.tolist(),
+            self.location.tolist(),
+        ):
+            yield year, week, teams[winner_id], teams[loser_id], WinningTeamLocation(
+                location
+            )
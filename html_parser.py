@@ -4,34 +4,66 @@ database into a consistent csv format.
 """
 import os
 import csv
+import hashlib
+import json
+import re
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
 
 from bs4 import BeautifulSoup
 
+try:
+    import lxml  # noqa: F401
 
-def extract_score_tuples(contents):
+    # lxml is much faster than the pure-Python parser that ships with the standard library.
+    DEFAULT_PARSER_FEATURES = "lxml"
+except ImportError:
+    DEFAULT_PARSER_FEATURES = "html.parser"
+
+
+def _get_team_and_score(team_text, final_score_text):
+    """
+    Returns the name of the team and the score, given the text of the first and last cells of its row.
+
+    Raises a ValueError if the score isn't a number (e.g. because the game was cancelled).
+    """
+    final_score = int(final_score_text)
+    # This will look like: 'UTSA (1-1)' or '(4) Oklahoma (2-0)'
+    team_pieces = team_text.split()
+    if team_pieces[0].startswith("("):
+        del team_pieces[0]
+    if team_pieces[-1].startswith("("):
+        del team_pieces[-1]
+    team_no_record = " ".join(team_pieces)
+    return team_no_record, final_score
+
+
+def _print_cancelled_game(game):
+    print(
+        "Failed to parse result from game--likely cancelled. "
+        "Please verify by looking at the html object: {}".format(game)
+    )
+
+
+def extract_score_tuples(contents, features=None, streaming=False):
     """
 	Given an HTML file of raw college football data, returns a list of 4-tuples consisting
 	of the visiting team's name, the home team's name, the visiting team's score, and the
 	home team's score.
+
+	features selects the BeautifulSoup parser, and defaults to the fastest one that is installed.
+	If streaming is True, we instead scan the HTML token stream and only keep the game tables
+	(see extract_score_tuples_streaming).
 	"""
-    parsed_html = BeautifulSoup(contents, features="html.parser")
+    if streaming:
+        return extract_score_tuples_streaming(contents)
+    parsed_html = BeautifulSoup(contents, features=features or DEFAULT_PARSER_FEATURES)
     games = parsed_html.body.find_all("table", attrs={"class": "fb_component_tbl"})
 
     def get_team_and_score_from_table_row(row):
         """Returns the name of the team and the score, given an HTML row."""
-        final_score_elem = row("td")[-1]
-        team_elem = row("td")[0]
-
-        final_score = int(final_score_elem.text)
-        # This will look like: 'UTSA (1-1)' or '(4) Oklahoma (2-0)'
-        team_with_record = team_elem.text
-        team_pieces = team_with_record.split()
-        if team_pieces[0].startswith("("):
-            del team_pieces[0]
-        if team_pieces[-1].startswith("("):
-            del team_pieces[-1]
-        team_no_record = " ".join(team_pieces)
-        return team_no_record, final_score
+        cells = row("td")
+        return _get_team_and_score(cells[0].text, cells[-1].text)
 
     score_tuples = []
     for game in games:
@@ -44,34 +76,229 @@ def extract_score_tuples(contents):
             home_team, home_score = get_team_and_score_from_table_row(home_row)
             score_tuples.append((visiting_team, visiting_score, home_team, home_score))
         except ValueError:
-            print(
-                "Failed to parse result from game--likely cancelled. "
-                "Please verify by looking at the html object: {}".format(game)
-            )
+            _print_cancelled_game(game)
 
     return score_tuples
 
 
-files_of_interest = os.listdir("raw_data/")
-all_score_tuples = []
-for i, file in enumerate(files_of_interest):
+class _GameTableScanner(HTMLParser):
+    """
+    An event-driven parser that only keeps track of the text of the cells in the visitor and home rows of each
+    fb_component_tbl table. Nothing else in the page is ever materialized.
+    """
+
+    def __init__(self, contents):
+        super().__init__(convert_charrefs=True)
+        self.contents = contents
+        # The offset in contents at which each line starts. Only computed if we need to print the markup of a game.
+        self.line_offsets = None
+        self.score_tuples = []
+
+        # The nesting depth of tables inside the game table that we're in, or None if we aren't in one.
+        self.table_depth = None
+        self.table_start = None
+        # Map "row-visitor" and "row-home" to the text of each cell in the first such row of the current game.
+        self.rows = {}
+        self.current_row = None
+        self.current_cells = None
+        # The cells that are currently open. Text is appended to every one of them, like BeautifulSoup's .text.
+        self.open_cells = []
+
+    def _offset(self, position):
+        if self.line_offsets is None:
+            self.line_offsets = [0] + [
+                match.end() for match in re.finditer("\n", self.contents)
+            ]
+        line, column = position
+        return self.line_offsets[line - 1] + column
+
+    @staticmethod
+    def _classes(attrs):
+        for name, value in attrs:
+            if name == "class" and value:
+                return value.split()
+        return []
+
+    def handle_starttag(self, tag, attrs):
+        if self.table_depth is None:
+            if tag == "table" and "fb_component_tbl" in self._classes(attrs):
+                self.table_depth = 0
+                self.table_start = self.getpos()
+                self.rows = {}
+            return
+        if tag == "table":
+            self.table_depth += 1
+        elif tag == "tr" and self.current_row is None:
+            for row_class in ("row-visitor", "row-home"):
+                if row_class in self._classes(attrs) and row_class not in self.rows:
+                    self.current_row = row_class
+                    self.current_cells = []
+                    self.rows[row_class] = self.current_cells
+        elif tag == "td" and self.current_row is not None:
+            cell = []
+            self.current_cells.append(cell)
+            self.open_cells.append(cell)
+
+    def handle_endtag(self, tag):
+        if self.table_depth is None:
+            return
+        if tag == "td" and self.open_cells:
+            self.open_cells.pop()
+        elif tag == "tr" and self.current_row is not None:
+            self.current_row = None
+            self.open_cells = []
+        elif tag == "table":
+            if self.table_depth:
+                self.table_depth -= 1
+            else:
+                self._finish_game()
+
+    def handle_data(self, data):
+        for cell in self.open_cells:
+            cell.append(data)
+
+    def _finish_game(self):
+        table_start = self.table_start
+        table_end = self.getpos()
+        self.table_depth = None
+        self.current_row = None
+        self.open_cells = []
+        try:
+            visitor_cells = self.rows["row-visitor"]
+            visiting_team, visiting_score = _get_team_and_score(
+                "".join(visitor_cells[0]), "".join(visitor_cells[-1])
+            )
+            home_cells = self.rows["row-home"]
+            home_team, home_score = _get_team_and_score(
+                "".join(home_cells[0]), "".join(home_cells[-1])
+            )
+            self.score_tuples.append(
+                (visiting_team, visiting_score, home_team, home_score)
+            )
+        except (ValueError, KeyError, IndexError):
+            game_end = self.contents.find(">", self._offset(table_end)) + 1
+            _print_cancelled_game(self.contents[self._offset(table_start) : game_end])
+
+
+def extract_score_tuples_streaming(contents):
+    """
+    Like extract_score_tuples, but scans the HTML token stream instead of building a tree for the whole page. Only
+    the text of the cells that we need is kept, so it's much faster and uses much less memory.
+    """
+    # Skip straight to the first game, since everything before it is navigation and ads.
+    first_game = contents.find("fb_component_tbl")
+    start = (
+        contents.rfind("<table", 0, first_game) if first_game >= 0 else len(contents)
+    )
+    scanner = _GameTableScanner(contents[start:])
+    scanner.feed(contents[start:])
+    scanner.close()
+    return scanner.score_tuples
+
+
+def parse_week_file(path, streaming=True):
+    """
+    Given the path to a downloaded week of results, returns a list of (year, week, visiting_team,
+    visiting_score, home_team, home_score) tuples.
+    """
     # We expect files to be formatted as:
     # year-2018-week-11.html
-    _, year, _, week = os.path.splitext(file)[0].split("-")
+    _, year, _, week = os.path.splitext(os.path.basename(path))[0].split("-")
     year = int(year)
     week = int(week)
-    print("Processing week {} of {}...".format(i, len(files_of_interest)))
 
-    with open(os.path.join("raw_data/", file)) as file_handle:
+    with open(path) as file_handle:
         file_text = file_handle.read()
-    score_tuples = extract_score_tuples(file_text)
-    for score_tuple in score_tuples:
-        # We want to store the year and the week in addition to the score.
-        all_score_tuples.append(
-            (year, week, score_tuple[0], score_tuple[1], score_tuple[2], score_tuple[3])
+    # We want to store the year and the week in addition to the score.
+    return [
+        (year, week, score_tuple[0], score_tuple[1], score_tuple[2], score_tuple[3])
+        for score_tuple in extract_score_tuples(file_text, streaming=streaming)
+    ]
+
+
+def _file_sha256(path):
+    with open(path, "rb") as file_handle:
+        return hashlib.sha256(file_handle.read()).hexdigest()
+
+
+def _load_cache(cache_path):
+    try:
+        with open(cache_path) as file_handle:
+            return json.load(file_handle)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_cache(cache, cache_path):
+    # Write to a temporary file first, so that an interrupted run never leaves a corrupt cache behind.
+    temp_path = cache_path + ".tmp"
+    with open(temp_path, "w") as file_handle:
+        json.dump(cache, file_handle)
+    os.replace(temp_path, cache_path)
+
+
+def ingest(
+    raw_data_dir="raw_data/",
+    output_path="scores.csv",
+    cache_path="parse_cache.json",
+    workers=None,
+):
+    """
+    Parses every week file in raw_data_dir and writes the sorted results to output_path.
+
+    The results for each file are cached in cache_path, keyed by the file's modification time and size (and, if
+    those have changed, its SHA-256), so only new or changed files are parsed again. Those files are parsed in a
+    pool of worker processes. Returns the number of files that we had to parse.
+    """
+    cache = _load_cache(cache_path)
+    files_of_interest = sorted(
+        file for file in os.listdir(raw_data_dir) if file.endswith(".html")
+    )
+
+    new_cache = {}
+    files_to_parse = []
+    for file in files_of_interest:
+        path = os.path.join(raw_data_dir, file)
+        stat = os.stat(path)
+        entry = cache.get(file)
+        if entry and (entry["mtime"], entry["size"]) == (stat.st_mtime, stat.st_size):
+            new_cache[file] = entry
+            continue
+        sha256 = _file_sha256(path)
+        if entry and entry["sha256"] == sha256:
+            # The file was touched, but its contents are the same.
+            new_cache[file] = dict(entry, mtime=stat.st_mtime, size=stat.st_size)
+            continue
+        new_cache[file] = dict(mtime=stat.st_mtime, size=stat.st_size, sha256=sha256)
+        files_to_parse.append(file)
+
+    print(
+        "Parsing {} of {} files ({} cached)...".format(
+            len(files_to_parse),
+            len(files_of_interest),
+            len(files_of_interest) - len(files_to_parse),
         )
+    )
+    paths_to_parse = [os.path.join(raw_data_dir, file) for file in files_to_parse]
+    if len(paths_to_parse) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parsed = list(pool.map(parse_week_file, paths_to_parse))
+    else:
+        parsed = [parse_week_file(path) for path in paths_to_parse]
+    for file, score_tuples in zip(files_to_parse, parsed):
+        new_cache[file]["scores"] = score_tuples
+
+    all_score_tuples = []
+    for entry in new_cache.values():
+        all_score_tuples.extend(tuple(score_tuple) for score_tuple in entry["scores"])
+
+    with open(output_path, "w", newline="") as csvfile:
+        csv_writer = csv.writer(csvfile)
+        for entry in sorted(all_score_tuples):
+            csv_writer.writerow(entry)
+    _save_cache(new_cache, cache_path)
+    return len(files_to_parse)
+
 
-with open("scores.csv", "w", newline="") as csvfile:
-    csv_writer = csv.writer(csvfile)
-    for entry in sorted(all_score_tuples):
-        csv_writer.writerow(entry)
+if __name__ == "__main__":
+    ingest()
@@ -0,0 +1,127 @@
+"""
+Timers, counters and an optional profiler for optimization runs, so that we can see where the time goes.
+"""
+import cProfile
+import io
+import json
+import logging
+import pstats
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+
+class Instrumentation:
+    """
+    Accumulates the time spent in each stage of a run, along with counters such as the number of candidates
+    evaluated. Pass one to ParameterTester to have it record its stages:
+
+    - "load": reading the scores (recorded by whoever loads them).
+    - "warmup_replay", "training_replay" and "holdout_replay": replaying seasons before, during and after the
+      tester's training years. Log loss is accumulated inside the replay, so its cost is part of these stages.
+    - "checkpointing": storing rating snapshots in the checkpoint cache.
+    - "evaluation": waiting for each candidate's ratings, which covers the replays above (or worker processes).
+    - "loss_accumulation": recording each candidate's loss and keeping the results sorted.
+    - "generator": the parameter generator deciding which candidates to try next.
+    - "plotting": drawing plots of the results.
+
+    The replay stages are only recorded in this process, so they are empty when candidates are evaluated by workers.
+    """
+
+    def __init__(self, profile=False, profile_every=1):
+        """
+        If profile is set, run_one_cycle runs under cProfile. profile_every samples only one cycle in that many,
+        which keeps the profiler's overhead down on long runs.
+        """
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.profiler = cProfile.Profile() if profile else None
+        self.profile_every = profile_every
+        self._cycles_seen = 0
+
+    def add_time(self, stage, seconds):
+        self.seconds[stage] += seconds
+        self.calls[stage] += 1
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        A context manager that adds the time spent inside it to stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def count(self, counter, n=1):
+        self.counters[counter] += n
+
+    @contextmanager
+    def profiling(self):
+        """
+        A context manager that runs its body under cProfile, if profiling is enabled and this cycle is sampled.
+        """
+        sampled = (
+            self.profiler is not None and self._cycles_seen % self.profile_every == 0
+        )
+        self._cycles_seen += 1
+        if not sampled:
+            yield
+            return
+        self.profiler.enable()
+        try:
+            yield
+        finally:
+            self.profiler.disable()
+
+    def report(self):
+        """
+        Returns a dict of everything that we've recorded, along with the throughput of the evaluation stage.
+        """
+        report = dict(
+            stages={
+                stage: dict(seconds=self.seconds[stage], calls=self.calls[stage])
+                for stage in sorted(self.seconds)
+            },
+            counters=dict(sorted(self.counters.items())),
+        )
+        evaluation_seconds = self.seconds.get("evaluation")
+        if evaluation_seconds:
+            report["candidates_per_second"] = (
+                self.counters["candidates"] / evaluation_seconds
+            )
+            report["games_per_second"] = self.counters["games"] / evaluation_seconds
+        return report
+
+    def to_json(self):
+        return json.dumps(self.report(), indent=2)
+
+    def save(self, path):
+        with open(path, "w") as file_handle:
+            file_handle.write(self.to_json())
+
+    def log_report(self, level=logging.INFO):
+        logger.log(level, "Instrumentation report: %s", self.to_json())
+
+    def profile_stats(self, limit=25, sort_by="cumulative"):
+        """
+        Returns the profiler's statistics for the top limit functions as text, or None if we weren't profiling.
+        """
+        if self.profiler is None:
+            return None
+        stream = io.StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats(sort_by).print_stats(
+            limit
+        )
+        return stream.getvalue()
+
+    def dump_profile(self, path):
+        """
+        Writes the raw profile to path, for use with pstats or a viewer like snakeviz.
+        """
+        self.profiler.dump_stats(path)
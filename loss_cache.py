@@ -0,0 +1,94 @@
+"""
+An in-process memo of the losses that we've already computed, so that optimizers which revisit the same candidates
+don't pay for a full replay each time.
+"""
+from collections import OrderedDict
+
+
+def canonical_key(param_dict, digits=9):
+    """
+    Returns a hashable key for param_dict. Numbers are rounded to digits decimal places, so that values which differ
+    only by floating-point noise (e.g. 0.6 and the 0.6000000000000001 that GridParameterGenerator reaches by adding
+    0.05 repeatedly) share a key, and lists (like k_list) become tuples. ResultsStore encodes its keys from this too
+    (see results_store.canonical_params).
+    """
+
+    def canonical_value(value):
+        if isinstance(value, (list, tuple)):
+            return tuple(canonical_value(item) for item in value)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            # Adding 0.0 turns -0.0 into 0.0.
+            return round(float(value), digits) + 0.0
+        return value
+
+    return tuple(
+        sorted((key, canonical_value(value)) for key, value in param_dict.items())
+    )
+
+
+class LossCache:
+    """
+    A least-recently-used map from canonical parameters to log loss, and optionally to the EloMachine as well.
+
+    Losses are tiny, so we can afford to keep a lot of them. EloMachines hold a rating for every team, so we keep at
+    most max_elos of them (none by default), and a hit without one means the caller has to replay to get ratings.
+    """
+
+    def __init__(self, max_entries=100000, max_elos=0, digits=9):
+        self.max_entries = max_entries
+        self.max_elos = max_elos
+        self.digits = digits
+        self.hits = 0
+        self.misses = 0
+        self._losses = OrderedDict()
+        self._elos = OrderedDict()
+
+    def key(self, param_dict):
+        return canonical_key(param_dict, self.digits)
+
+    def __len__(self):
+        return len(self._losses)
+
+    def get(self, param_dict):
+        """
+        Returns a tuple of (log loss, EloMachine or None) for param_dict, or None if we don't have it. The caller must
+        not mutate the returned EloMachine.
+        """
+        key = self.key(param_dict)
+        log_loss = self._losses.get(key)
+        if log_loss is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._losses.move_to_end(key)
+        elo = self._elos.get(key)
+        if elo is not None:
+            self._elos.move_to_end(key)
+        return log_loss, elo
+
+    def put(self, param_dict, log_loss, elo=None):
+        key = self.key(param_dict)
+        self._losses[key] = log_loss
+        self._losses.move_to_end(key)
+        while len(self._losses) > self.max_entries:
+            evicted_key, _ = self._losses.popitem(last=False)
+            self._elos.pop(evicted_key, None)
+        if elo is not None and self.max_elos > 0:
+            self._elos[key] = elo
+            self._elos.move_to_end(key)
+            while len(self._elos) > self.max_elos:
+                self._elos.popitem(last=False)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hit_rate,
+            entries=len(self._losses),
+            elos=len(self._elos),
+        )
@@ -0,0 +1,81 @@
+"""
+Plots of the results of a parameter search. This is the only module that imports matplotlib, and elo.py only imports
+it when asked to plot, so that replays and searches never pay for it.
+
+Unless MPLBACKEND says otherwise, we draw with the non-interactive Agg backend, which works without a display. Plots
+are then only written to files.
+"""
+import os
+from collections import defaultdict
+
+import matplotlib
+
+if "MPLBACKEND" not in os.environ:
+    matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+from matplotlib import cm
+
+# Registers the "3d" projection with older versions of matplotlib.
+from mpl_toolkits.mplot3d import Axes3D
+
+
+def _finish(fig, outfile):
+    """
+    Saves fig to outfile (if given), shows it if the backend is interactive, and frees it.
+    """
+    if outfile:
+        fig.savefig(outfile)
+    if matplotlib.get_backend().lower() != "agg":
+        plt.show()
+    plt.close(fig)
+
+
+def plot_one_field(results, field, outfile=None):
+    """
+    Given (log loss, param_dict) results, plots the best loss for each value of field.
+    """
+    grouped_results = defaultdict(list)
+    for log_loss, params in results:
+        grouped_results[params[field]].append(log_loss)
+    grouped_results_flattened = [(k, min(v)) for k, v in grouped_results.items()]
+
+    x_list = []
+    y_list = []
+    for x, y in sorted(grouped_results_flattened):
+        x_list.append(x)
+        y_list.append(y)
+
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    ax.plot(x_list, y_list)
+    ax.set_xlabel(field)
+    ax.set_ylabel("log_loss")
+    _finish(fig, outfile)
+
+
+def plot_two_fields(results, first_field, second_field, outfile=None):
+    """
+    Given (log loss, param_dict) results, generates a surface plot of the best loss for each pair of values of
+    first_field and second_field.
+    """
+    grouped_results = defaultdict(list)
+    for log_loss, params in results:
+        grouped_results[(params[first_field], params[second_field])].append(log_loss)
+    grouped_results_flattened = {k: min(v) for k, v in grouped_results.items()}
+
+    x_list = []
+    y_list = []
+    z_list = []
+    for (x, y), z in grouped_results_flattened.items():
+        x_list.append(x)
+        y_list.append(y)
+        z_list.append(z)
+
+    fig = plt.figure()
+    ax = fig.add_subplot(111, projection="3d")
+    ax.plot_trisurf(x_list, y_list, z_list, cmap=cm.coolwarm, linewidth=0.1)
+    ax.set_xlabel(first_field)
+    ax.set_ylabel(second_field)
+    ax.set_zlabel("log_loss")
+    _finish(fig, outfile)
@@ -0,0 +1,416 @@
+"""
+A small HTTP server that answers predictions and rankings from a saved RatingStore, without replaying anything.
+
+    python prediction_server.py --snapshot ratings.json --port 8080
+
+Endpoints (all responses are JSON):
+
+    GET  /predict?team1=Alabama&team2=Auburn&location=home   the probability that team1 wins
+    POST /predict  {"games": [["Alabama", "Auburn", "home"], ...]}   the same for many games at once
+    GET  /rankings?n=25   the n best teams, or /rankings?team=Alabama for one team's rank and rating
+    GET  /snapshot   the parameters and last week of the snapshot that we're serving
+
+location is one of home, road or neutral, and is where team1 plays. Whenever the snapshot file is replaced (e.g. by
+RatingStore.save, which writes atomically), the server loads the new one in the background and swaps it in between
+requests, so no request ever sees a half-loaded snapshot.
+
+Run with --load-test N against a running server to measure its throughput.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import urllib.parse
+from http import HTTPStatus
+
+from game_table import WinningTeamLocation
+from rating_store import RatingStore
+
+
+logger = logging.getLogger(__name__)
+
+LOCATIONS = {
+    "home": WinningTeamLocation.HOME,
+    "road": WinningTeamLocation.ROAD,
+    "neutral": WinningTeamLocation.NEUTRAL_SITE,
+}
+RESPONSE_HEAD = (
+    "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n{}\r\n"
+)
+REQUEST_HEAD = (
+    "{} {} HTTP/1.1\r\nHost: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n"
+)
+
+
+class RequestError(Exception):
+    """
+    A request that we can't answer. Becomes a response with the given HTTP status.
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _load_snapshot(path):
+    store = RatingStore.load(path)
+    # Build the ranking index now, rather than during the first request for rankings.
+    store.elo.ranking
+    return store
+
+
+class PredictionServer:
+    """
+    Serves one RatingStore snapshot at a time, and checks every poll_interval seconds whether the snapshot file has
+    been replaced.
+    """
+
+    def __init__(self, snapshot_path, host="127.0.0.1", port=8080, poll_interval=1.0):
+        self.snapshot_path = snapshot_path
+        self.host = host
+        self.port = port
+        self.poll_interval = poll_interval
+        # The snapshot that new requests see. Requests that started on an older one finish with it.
+        self.store = None
+        self.loaded_at = None
+        # The (inode, modification time, size) of the snapshot file when we last loaded it.
+        self._signature = None
+        self._server = None
+        self._watcher = None
+
+    async def reload_if_changed(self):
+        """
+        Loads the snapshot file if it has changed since we last loaded it, and returns whether we swapped in a new
+        snapshot. A file that fails to load is logged and skipped, and we keep serving the previous snapshot.
+        """
+        try:
+            stat = os.stat(self.snapshot_path)
+        except FileNotFoundError:
+            return False
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return False
+        self._signature = signature
+        try:
+            store = await asyncio.get_running_loop().run_in_executor(
+                None, _load_snapshot, self.snapshot_path
+            )
+        except Exception as error:
+            # Whatever is wrong with the file, the watcher has to survive it to pick up the next snapshot.
+            logger.warning(
+                "Keeping the current snapshot, since %s failed to load: %s",
+                self.snapshot_path,
+                error,
+            )
+            return False
+        self.store = store
+        self.loaded_at = time.time()
+        logger.info(
+            "Serving ratings through week %s of %s from %s",
+            store.last_week,
+            store.last_year,
+            self.snapshot_path,
+        )
+        return True
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            await self.reload_if_changed()
+
+    async def start(self):
+        """
+        Loads the snapshot and starts listening. Raises a FileNotFoundError if there is no snapshot to serve.
+        """
+        await self.reload_if_changed()
+        if self.store is None:
+            raise FileNotFoundError(
+                "No loadable snapshot at {}".format(self.snapshot_path)
+            )
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port
+        )
+        # With port 0, the OS picks a free port.
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._watcher = asyncio.ensure_future(self._watch())
+        logger.info("Listening on http://%s:%s", self.host, self.port)
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def handle_request(self, method, target, body=b""):
+        """
+        Answers one request, and returns a tuple of the HTTP status and the JSON-serializable response.
+        """
+        store = self.store
+        url = urllib.parse.urlsplit(target)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        try:
+            if url.path == "/predict" and method == "GET":
+                return HTTPStatus.OK, self._predict_one(store, query)
+            if url.path == "/predict" and method == "POST":
+                return HTTPStatus.OK, self._predict_many(store, body)
+            if url.path == "/rankings" and method == "GET":
+                return HTTPStatus.OK, self._rankings(store, query)
+            if url.path == "/snapshot" and method == "GET":
+                return HTTPStatus.OK, dict(
+                    params=store.params,
+                    last_year=store.last_year,
+                    last_week=store.last_week,
+                    teams=len(store.elo.player_to_rating),
+                    loaded_at=self.loaded_at,
+                )
+            if url.path in ("/predict", "/rankings", "/snapshot"):
+                raise RequestError(HTTPStatus.METHOD_NOT_ALLOWED, "Method not allowed")
+            raise RequestError(HTTPStatus.NOT_FOUND, "Unknown path " + url.path)
+        except RequestError as error:
+            return error.status, dict(error=str(error))
+        except Exception:
+            logger.exception("Failed to answer %s %s", method, target)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, dict(error="Internal server error")
+
+    @staticmethod
+    def _check_teams(store, teams):
+        for team in teams:
+            if team not in store.elo.player_to_rating:
+                raise RequestError(
+                    HTTPStatus.NOT_FOUND, "Unknown team {!r}".format(team)
+                )
+
+    @staticmethod
+    def _location(name):
+        try:
+            return LOCATIONS[name]
+        except KeyError:
+            raise RequestError(
+                HTTPStatus.BAD_REQUEST,
+                "location must be one of {}".format(", ".join(LOCATIONS)),
+            )
+
+    def _predict_one(self, store, query):
+        try:
+            team1, team2 = query["team1"], query["team2"]
+        except KeyError:
+            raise RequestError(HTTPStatus.BAD_REQUEST, "team1 and team2 are required")
+        location = self._location(query.get("location", "neutral"))
+        self._check_teams(store, (team1, team2))
+        return dict(
+            team1=team1,
+            team2=team2,
+            location=query.get("location", "neutral"),
+            probability=store.elo.predict_outcome(team1, team2, location),
+        )
+
+    def _predict_many(self, store, body):
+        try:
+            games = json.loads(body)["games"]
+            valid = isinstance(games, list) and all(
+                isinstance(game, list)
+                and len(game) == 3
+                and all(isinstance(value, str) for value in game)
+                for game in games
+            )
+        except (ValueError, KeyError, TypeError):
+            valid = False
+        if not valid:
+            raise RequestError(
+                HTTPStatus.BAD_REQUEST,
+                'Expected {"games": [[team1, team2, location], ...]}, all strings',
+            )
+        teams1, teams2, location_names = zip(*games) if games else ((), (), ())
+        self._check_teams(store, teams1 + teams2)
+        locations = [self._location(name) for name in location_names]
+        return dict(
+            probabilities=store.elo.predict_outcomes(
+                list(teams1), list(teams2), locations
+            ).tolist()
+        )
+
+    def _rankings(self, store, query):
+        ranking = store.elo.ranking
+        if "team" in query:
+            team = query["team"]
+            self._check_teams(store, (team,))
+            return dict(
+                team=team,
+                rank=ranking.rank_of(team),
+                rating=store.elo.player_to_rating[team],
+            )
+        try:
+            n = int(query.get("n", 25))
+        except ValueError:
+            n = 0
+        if n < 1:
+            raise RequestError(HTTPStatus.BAD_REQUEST, "n must be a positive integer")
+        return dict(
+            rankings=[
+                [rank, team, rating]
+                for rank, (team, rating) in enumerate(ranking.top(n), 1)
+            ]
+        )
+
+    async def _handle_connection(self, reader, writer):
+        """
+        Serves HTTP/1.1 requests on one connection until the client closes it or asks us to.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, payload = self.handle_request(method, target, body)
+                keep_alive = (
+                    version == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                )
+                response_body = json.dumps(payload).encode()
+                head = RESPONSE_HEAD.format(
+                    status.value,
+                    status.phrase,
+                    len(response_body),
+                    "" if keep_alive else "Connection: close\r\n",
+                )
+                writer.write(head.encode("latin-1") + response_body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # A client that hung up or sent something that isn't HTTP. There's nobody to answer.
+            pass
+        finally:
+            writer.close()
+
+
+async def _read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("The server closed the connection")
+    content_length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            content_length = int(value)
+    body = await reader.readexactly(content_length)
+    return int(status_line.split()[1]), json.loads(body)
+
+
+async def request(host, port, method, target, payload=None):
+    """
+    Sends one request to a PredictionServer, and returns a tuple of the status and the decoded JSON response.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        body = json.dumps(payload).encode() if payload is not None else b""
+        head = REQUEST_HEAD.format(method, target, host, len(body))
+        writer.write(head.encode("latin-1") + body)
+        return await _read_response(reader)
+    finally:
+        writer.close()
+
+
+async def load_test(host, port, target, num_requests=10000, concurrency=8):
+    """
+    Sends num_requests GET requests for target over concurrency keep-alive connections, and returns a dict with the
+    throughput and the number of responses that weren't 200 OK.
+    """
+    request_bytes = "GET {} HTTP/1.1\r\nHost: {}\r\n\r\n".format(target, host).encode(
+        "latin-1"
+    )
+    errors = 0
+
+    async def client(count):
+        nonlocal errors
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for _ in range(count):
+                writer.write(request_bytes)
+                status, _ = await _read_response(reader)
+                if status != HTTPStatus.OK:
+                    errors += 1
+        finally:
+            writer.close()
+
+    counts = [
+        num_requests // concurrency + (i < num_requests % concurrency)
+        for i in range(concurrency)
+    ]
+    start = time.perf_counter()
+    await asyncio.gather(*(client(count) for count in counts))
+    seconds = time.perf_counter() - start
+    return dict(
+        requests=num_requests,
+        errors=errors,
+        seconds=seconds,
+        requests_per_second=num_requests / seconds,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve predictions from a saved RatingStore."
+    )
+    parser.add_argument("--snapshot", default="ratings.json")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=1.0,
+        help="How often to check whether the snapshot has been replaced, in seconds.",
+    )
+    parser.add_argument(
+        "--load-test",
+        type=int,
+        metavar="N",
+        help="Instead of serving, send N requests to a server that is already running and report its throughput.",
+    )
+    parser.add_argument("--load-test-target", default="/rankings?n=25")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(message)s")
+
+    if args.load_test:
+        print(
+            asyncio.run(
+                load_test(
+                    args.host,
+                    args.port,
+                    args.load_test_target,
+                    args.load_test,
+                    args.concurrency,
+                )
+            )
+        )
+    else:
+        server = PredictionServer(
+            args.snapshot, args.host, args.port, args.poll_interval
+        )
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,137 @@
+"""
+A sorted index of players by rating, kept up to date as ratings change so that ranking queries never need a full
+sort.
+"""
+from bisect import bisect_left, bisect_right
+
+
+class RankingIndex:
+    """
+    Keeps players sorted by descending rating. Ties are broken by the order in which players were first added, which
+    matches the order of EloMachine.get_players_with_ratings_descending_order.
+
+    Lookups are binary searches. Moving a player is a binary search plus a shift of a contiguous list, which for a few
+    hundred teams is far cheaper than the pointer-chasing of a balanced tree.
+    """
+
+    def __init__(self, player_to_rating=None):
+        # Sorted list of (-rating, sequence number) keys, and the players in the same order.
+        self._keys = []
+        self._players = []
+        # Map each player to his current key.
+        self._player_to_key = {}
+        self._next_sequence_number = 0
+        if player_to_rating:
+            self.rebuild(player_to_rating)
+
+    def rebuild(self, player_to_rating):
+        """
+        Replaces the contents of the index with player_to_rating, keeping the sequence numbers of known players.
+        """
+        keys_and_players = []
+        for player, rating in player_to_rating.items():
+            old_key = self._player_to_key.get(player)
+            if old_key is None:
+                sequence_number = self._next_sequence_number
+                self._next_sequence_number += 1
+            else:
+                sequence_number = old_key[1]
+            keys_and_players.append(((-rating, sequence_number), player))
+        keys_and_players.sort()
+        self._keys = [key for key, _ in keys_and_players]
+        self._players = [player for _, player in keys_and_players]
+        self._player_to_key = dict(zip(self._players, self._keys))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _position_of(self, player, key):
+        """
+        Returns the position of player, whose key is key, in our lists. Raises a KeyError if he isn't where his key
+        says he should be, which would mean that the index is corrupt.
+        """
+        start = bisect_left(self._keys, key)
+        stop = bisect_right(self._keys, key)
+        for i in range(start, stop):
+            if self._players[i] == player:
+                return i
+        raise KeyError("{!r} is missing from the ranking index".format(player))
+
+    def update(self, player, rating):
+        """
+        Sets the rating of player, adding him to the index if necessary.
+        """
+        old_key = self._player_to_key.get(player)
+        if old_key is None:
+            sequence_number = self._next_sequence_number
+            self._next_sequence_number += 1
+        else:
+            i = self._position_of(player, old_key)
+            del self._keys[i]
+            del self._players[i]
+            sequence_number = old_key[1]
+        key = (-rating, sequence_number)
+        i = bisect_left(self._keys, key)
+        self._keys.insert(i, key)
+        self._players.insert(i, player)
+        self._player_to_key[player] = key
+
+    def transform(self, function, order_preserving=True):
+        """
+        Applies function to every rating. If function preserves the order of ratings (e.g. it is increasing), we
+        don't have to sort again, unless rounding has made two different ratings equal and so put their tie-break in
+        the wrong order. We check for that, and sort in that case.
+        """
+        if not order_preserving:
+            self.rebuild(
+                {
+                    player: function(-key[0])
+                    for player, key in zip(self._players, self._keys)
+                }
+            )
+            return
+        keys = [(-function(-rating), sequence) for rating, sequence in self._keys]
+        if any(key > next_key for key, next_key in zip(keys, keys[1:])):
+            keys_and_players = sorted(zip(keys, self._players))
+            keys = [key for key, _ in keys_and_players]
+            self._players = [player for _, player in keys_and_players]
+        self._keys = keys
+        self._player_to_key = dict(zip(self._players, self._keys))
+
+    def _items(self, start, stop):
+        return [
+            (player, -key[0])
+            for player, key in zip(self._players[start:stop], self._keys[start:stop])
+        ]
+
+    def all(self):
+        """
+        Returns a list of (player, rating) tuples in descending order of rating.
+        """
+        return self._items(0, len(self._keys))
+
+    def top(self, n):
+        """
+        Returns the n highest-rated (player, rating) tuples, best first.
+        """
+        return self._items(0, n)
+
+    def bottom(self, n):
+        """
+        Returns the n lowest-rated (player, rating) tuples, still in descending order of rating.
+        """
+        return self._items(max(len(self._keys) - n, 0), len(self._keys))
+
+    def rank_of(self, player):
+        """
+        Returns the rank of player, where the best player has rank 1. Raises a KeyError for unknown players.
+        """
+        return bisect_left(self._keys, self._player_to_key[player]) + 1
+
+    def range(self, lo, hi):
+        """
+        Returns the (player, rating) tuples with lo <= rating <= hi, in descending order of rating.
+        """
+        start = bisect_left(self._keys, (-hi, -float("inf")))
+        stop = bisect_right(self._keys, (-lo, float("inf")))
+        return self._items(start, stop)
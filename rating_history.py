@@ -0,0 +1,262 @@
+"""
+A record of how every team's rating changed over a replay, so that we can ask for a team's rating at any point in
+time, or its whole trajectory, without replaying anything.
+
+The history is an append-only binary file of fixed-size records, one for each team in each game (holding the team's
+rating after the game) and one for each team at the start of every season (holding its rating after regressing to
+the mean, with week 0). Records are written in the order in which the games were played, so the file is already
+sorted by (year, week). The team names go in a small JSON file next to it, and when the writer is closed, it also
+writes the indexes that queries need to .npy files next to it, so that readers can memory-map them rather than each
+building their own.
+"""
+import json
+import os
+
+import numpy as np
+
+
+RECORD_DTYPE = np.dtype(
+    [
+        ("year", np.int16),
+        ("week", np.int8),
+        ("team_id", np.int32),
+        ("rating", np.float64),
+    ]
+)
+# Weeks of the season start at 1, and the week 0 records hold the ratings after each season's regression to the mean.
+SNAPSHOT_WEEK = 0
+
+
+def _teams_path(path):
+    return path + ".teams.json"
+
+
+def _index_paths(path):
+    """
+    Returns the paths of the three indexes of the history at path (see _build_indexes).
+    """
+    return path + ".by_team.npy", path + ".team_time_keys.npy", path + ".weeks.npy"
+
+
+def _time_keys(years, weeks):
+    """
+    Combines years and weeks into integers that sort in the same order as (year, week).
+    """
+    return np.asarray(years, dtype=np.int64) * 64 + np.asarray(weeks, dtype=np.int64)
+
+
+def _read_records(path):
+    if os.path.getsize(path):
+        return np.memmap(path, dtype=RECORD_DTYPE, mode="r")
+    # An empty file can't be memory-mapped.
+    return np.empty(0, dtype=RECORD_DTYPE)
+
+
+def _build_indexes(records):
+    """
+    Returns the indexes of records:
+
+        by_team: the positions of the records, sorted by team id and then by time
+        team_time_keys: a key for each record in by_team, combining its team id and time, in ascending order
+        weeks: one row for each (year, week) in the records, holding its time key and the position of its first record
+    """
+    # The records are in time order, so sorting by team id alone (stably) gives each team's records in time order.
+    by_team = np.argsort(records["team_id"], kind="stable")
+    team_time_keys = (records["team_id"][by_team].astype(np.int64) << 32) | _time_keys(
+        records["year"][by_team], records["week"][by_team]
+    )
+    time_keys = _time_keys(records["year"], records["week"])
+    week_starts = np.flatnonzero(np.diff(time_keys, prepend=-1))
+    weeks = np.column_stack((time_keys[week_starts], week_starts))
+    return by_team, team_time_keys, weeks
+
+
+class RatingHistoryWriter:
+    """
+    Appends records to a rating history file. Records are buffered in memory and written in blocks.
+    """
+
+    def __init__(self, path, teams, buffer_size=65536):
+        """
+        teams lists the team names, indexed by the team ids in the records (e.g. GameTable.teams).
+        """
+        self.path = path
+        self.teams = teams
+        self.buffer_size = buffer_size
+        # Arrays of records waiting to be written, and (year, week, team id, rating) tuples that were added one at a
+        # time since the last array.
+        self._buffer = []
+        self._buffered = 0
+        self._pending = []
+        self._file = open(path, "wb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _collect_pending(self):
+        if self._pending:
+            self._buffer.append(np.array(self._pending, dtype=RECORD_DTYPE))
+            self._pending = []
+
+    def _append(self, years, weeks, team_ids, ratings):
+        self._collect_pending()
+        records = np.empty(len(team_ids), dtype=RECORD_DTYPE)
+        records["year"] = years
+        records["week"] = weeks
+        records["team_id"] = team_ids
+        records["rating"] = ratings
+        self._buffer.append(records)
+        self._buffered += len(records)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def add_snapshot(self, year, team_ids, ratings):
+        """
+        Records the ratings of the given teams at the start of year, after they have regressed to the mean.
+        """
+        self._append(year, SNAPSHOT_WEEK, team_ids, ratings)
+
+    def add_game(self, year, week, winner_id, winner_rating, loser_id, loser_rating):
+        """
+        Records the ratings of both teams after one game.
+        """
+        self._pending.append((year, week, winner_id, winner_rating))
+        self._pending.append((year, week, loser_id, loser_rating))
+        self._buffered += 2
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def add_games(
+        self, years, weeks, winner_ids, winner_ratings, loser_ids, loser_ratings
+    ):
+        """
+        Like add_game, for many games at once. Each argument is an array with one entry per game.
+        """
+        self._append(
+            np.repeat(years, 2),
+            np.repeat(weeks, 2),
+            np.column_stack((winner_ids, loser_ids)).ravel(),
+            np.column_stack((winner_ratings, loser_ratings)).ravel(),
+        )
+
+    def flush(self):
+        self._collect_pending()
+        for records in self._buffer:
+            records.tofile(self._file)
+        self._buffer = []
+        self._buffered = 0
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+        with open(_teams_path(self.path), "w") as file_handle:
+            json.dump(list(self.teams), file_handle)
+        for index_path, index in zip(
+            _index_paths(self.path), _build_indexes(_read_records(self.path))
+        ):
+            np.save(index_path, index)
+
+
+class RatingHistory:
+    """
+    Answers questions about a rating history file written by RatingHistoryWriter. The records and their indexes are
+    memory-mapped read-only, so processes that open the same file share one copy of them in the page cache. Every
+    query is a binary search.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(_teams_path(path)) as file_handle:
+            self.teams = json.load(file_handle)
+        self._team_to_id = {team: i for i, team in enumerate(self.teams)}
+        self.records = _read_records(path)
+        index_paths = _index_paths(path)
+        if all(os.path.exists(index_path) for index_path in index_paths):
+            indexes = [np.load(index_path, mmap_mode="r") for index_path in index_paths]
+        else:
+            # The writer never finished, so build the indexes in memory.
+            indexes = _build_indexes(self.records)
+        self._by_team, self._team_time_keys, self._weeks = indexes
+
+    def __len__(self):
+        return len(self.records)
+
+    def _team_range(self, team):
+        """
+        Returns the start and stop of the records of team in _by_team.
+        """
+        team_id = self._team_to_id[team]
+        return np.searchsorted(
+            self._team_time_keys, [team_id << 32, (team_id + 1) << 32]
+        )
+
+    def rating_before(self, team, year, week):
+        """
+        Returns the rating of team going into week of year (i.e. after every earlier game, and after the regression
+        to the mean at the start of the season), or None if it had no rating yet. Raises a KeyError for unknown
+        teams.
+        """
+        team_id = self._team_to_id[team]
+        start, _ = self._team_range(team)
+        i = np.searchsorted(
+            self._team_time_keys,
+            (team_id << 32) | int(_time_keys(year, week)),
+            side="left",
+        )
+        if i <= start:
+            return None
+        return float(self.records["rating"][self._by_team[i - 1]])
+
+    def ratings_before(self, year, week):
+        """
+        Returns a dict mapping every team that had a rating going into week of year to that rating.
+        """
+        team_ids = np.arange(len(self.teams), dtype=np.int64)
+        starts = np.searchsorted(self._team_time_keys, team_ids << 32)
+        positions = np.searchsorted(
+            self._team_time_keys, (team_ids << 32) | int(_time_keys(year, week))
+        )
+        has_rating = positions > starts
+        ratings = self.records["rating"][self._by_team[positions[has_rating] - 1]]
+        return dict(
+            zip([self.teams[i] for i in np.flatnonzero(has_rating)], ratings.tolist())
+        )
+
+    def ratings_in_week(self, year, week):
+        """
+        Returns the (team, rating) records of week of year, in the order in which they were written. Week 0 holds the
+        ratings after the regression to the mean.
+        """
+        time_key = int(_time_keys(year, week))
+        i = np.searchsorted(self._weeks[:, 0], time_key)
+        if i == len(self._weeks) or self._weeks[i, 0] != time_key:
+            return []
+        stop = self._weeks[i + 1, 1] if i + 1 < len(self._weeks) else len(self.records)
+        records = self.records[self._weeks[i, 1] : stop]
+        return list(
+            zip(
+                [self.teams[team_id] for team_id in records["team_id"].tolist()],
+                records["rating"].tolist(),
+            )
+        )
+
+    def trajectory(self, team):
+        """
+        Returns every (year, week, rating) record of team in time order. Week 0 of each year is the rating after
+        the regression to the mean, and there may be several records in the same week.
+        """
+        start, stop = self._team_range(team)
+        records = self.records[self._by_team[start:stop]]
+        return list(
+            zip(
+                records["year"].tolist(),
+                records["week"].tolist(),
+                records["rating"].tolist(),
+            )
+        )
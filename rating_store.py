@@ -0,0 +1,131 @@
+"""
+A persistent Elo rating state that can be brought up to date one week at a time, without replaying every season.
+"""
+import json
+import os
+from itertools import groupby
+from math import log
+
+from elo import TRAINING_YEARS, EloMachine, get_k_for_week
+from game_table import get_winner_loser_and_location
+
+
+class RatingStore:
+    """
+    Holds an EloMachine along with the parameters that produced it and the last (year, week) that it has seen.
+
+    Applying every week of scores.csv in order, one week at a time, gives exactly the same ratings and log loss as
+    ParameterTester.run_one_cycle.
+    """
+
+    def __init__(self, params, elo=None, last_year=None, last_week=None):
+        self.params = params
+        if elo is None:
+            elo = EloMachine(home_team_advantage=params["home_field"])
+        self.elo = elo
+        self.last_year = last_year
+        self.last_week = last_week
+        # The log loss of every game that we've applied, whether or not it's in TRAINING_YEARS.
+        self.running_log_loss = 0
+
+    @classmethod
+    def from_scores(cls, params, scores):
+        """
+        Builds a store by applying scores (a list of (year, week, visiting_school, visiting_score, home_school,
+        home_score) tuples) one week at a time.
+        """
+        store = cls(params)
+        for _, games in groupby(scores, key=lambda score: score[:2]):
+            store.apply_week(list(games))
+        return store
+
+    def apply_week(self, games):
+        """
+        Updates the ratings with one week of games, given as (year, week, visiting_school, visiting_score,
+        home_school, home_score) tuples in the order in which they appear in scores.csv. If the week belongs to a
+        new season, the ratings regress to the mean first.
+
+        Returns the log loss of just these games. Raises a ValueError if the week is not after the last one that
+        we've seen.
+        """
+        if not games:
+            return 0
+        year, week = games[0][:2]
+        if any(game[:2] != (year, week) for game in games):
+            raise ValueError("All the games in a week must share a year and a week.")
+        if self.last_year is not None and (year, week) <= (
+            self.last_year,
+            self.last_week,
+        ):
+            raise ValueError(
+                "Week {} of {} is not after the last week that we applied (week {} of {}).".format(
+                    week, year, self.last_week, self.last_year
+                )
+            )
+
+        if year != self.last_year:
+            self.elo.regress_to_mean(self.params["season_regression"])
+        k = get_k_for_week(self.params, week)
+        week_log_loss = 0
+        for _, _, visiting_school, visiting_score, home_school, home_score in games:
+            winning_team, losing_team, winning_team_location = (
+                get_winner_loser_and_location(
+                    week, visiting_school, visiting_score, home_school, home_score
+                )
+            )
+            week_log_loss -= log(
+                self.elo.predict_outcome(
+                    winning_team, losing_team, winning_team_location
+                )
+            )
+            self.elo.update_ratings_with_result(
+                winning_team,
+                losing_team,
+                winning_team_location,
+                k=k,
+                include_in_log_loss=year in TRAINING_YEARS,
+            )
+
+        self.last_year = year
+        self.last_week = week
+        self.running_log_loss += week_log_loss
+        return week_log_loss
+
+    def to_dict(self):
+        return dict(
+            params=self.params,
+            last_year=self.last_year,
+            last_week=self.last_week,
+            initial_rating=self.elo.initial_rating,
+            log_loss=self.elo.log_loss,
+            running_log_loss=self.running_log_loss,
+            # A list rather than a dict, so that the order of the teams survives the round trip.
+            ratings=list(self.elo.player_to_rating.items()),
+        )
+
+    @classmethod
+    def from_dict(cls, state):
+        params = state["params"]
+        elo = EloMachine(
+            initial_rating=state["initial_rating"],
+            home_team_advantage=params["home_field"],
+        )
+        elo.player_to_rating = dict(state["ratings"])
+        elo.log_loss = state["log_loss"]
+        store = cls(params, elo, state["last_year"], state["last_week"])
+        store.running_log_loss = state["running_log_loss"]
+        return store
+
+    def save(self, path):
+        """
+        Atomically writes the store to path as JSON.
+        """
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as file_handle:
+            json.dump(self.to_dict(), file_handle)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as file_handle:
+            return cls.from_dict(json.load(file_handle))
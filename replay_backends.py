@@ -0,0 +1,369 @@
+"""
+Interchangeable implementations of the replay at the heart of ParameterTester.run_one_cycle.
+
+The reference backend feeds every game through an EloMachine, one dict lookup and enum comparison at a time. The
+compiled backend runs the same arithmetic over integer-encoded games and a flat array of ratings, using Numba when
+it is installed and falling back to a plain Python loop over lists when it isn't.
+"""
+from math import log, nan
+
+import numpy as np
+
+from elo import TRAINING_YEARS, EloMachine, get_k_for_week
+from game_table import WEEKS_IN_SEASON
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def _replay_games(
+    winner_ids,
+    loser_ids,
+    weeks,
+    signs,
+    in_training,
+    start,
+    stop,
+    k_for_week,
+    home_field,
+    ratings,
+    log_loss,
+    max_log_loss,
+    history,
+    record_history,
+):
+    """
+    Replays games start through stop - 1, updating ratings in place, and returns a tuple of the new log loss and the
+    index after the last game that we replayed. The arithmetic is done in exactly the same order as in
+    EloMachine.update_ratings_with_result. We give up as soon as the log loss exceeds max_log_loss. If record_history
+    is set, row i of history receives the ratings of the winner and loser of game i after the game.
+
+    Works on numpy arrays (when compiled by Numba) as well as on plain lists.
+    """
+    for i in range(start, stop):
+        winner = winner_ids[i]
+        loser = loser_ids[i]
+        initial_rating_winner = ratings[winner]
+        initial_rating_loser = ratings[loser]
+        adjusted_rating_winner = initial_rating_winner
+        if signs[i] > 0:
+            adjusted_rating_winner += home_field
+        elif signs[i] < 0:
+            adjusted_rating_winner -= home_field
+        predicted_outcome = 1 / (
+            1 + 10 ** ((initial_rating_loser - adjusted_rating_winner) / 400)
+        )
+        if in_training[i]:
+            log_loss -= log(predicted_outcome)
+            if log_loss > max_log_loss:
+                return log_loss, i + 1
+        delta = k_for_week[weeks[i] - 1] * (1 - predicted_outcome)
+        ratings[winner] = initial_rating_winner + delta
+        ratings[loser] = initial_rating_loser - delta
+        if record_history:
+            history[i, 0] = ratings[winner]
+            history[i, 1] = ratings[loser]
+    return log_loss, stop
+
+
+def _regress_ratings(ratings, initial_rating, z):
+    for i in range(len(ratings)):
+        ratings[i] = initial_rating + (ratings[i] - initial_rating) * z
+
+
+# Kept for CompiledBackend(use_numba=False).
+_python_replay_games = _replay_games
+_python_regress_ratings = _regress_ratings
+if numba is not None:
+    _replay_games = numba.njit(cache=True)(_replay_games)
+    _regress_ratings = numba.njit(cache=True)(_regress_ratings)
+
+
+class ReferenceBackend:
+    """
+    Replays games with an EloMachine. This is the definition of correct behavior for the other backends.
+    """
+
+    def __init__(self, game_table, initial_rating=1000, training_years=None):
+        """
+        Only games in training_years (which defaults to TRAINING_YEARS) count towards the log loss.
+        """
+        # The number of games that we have replayed in total. Replays that start from a checkpoint or stop early only
+        # count the games that they actually played.
+        self.games_replayed = 0
+        self.initial_rating = initial_rating
+        if training_years is None:
+            training_years = TRAINING_YEARS
+        self.training_years = training_years
+        self.team_registry = game_table.team_registry
+        # Decode the games once, so that each cycle doesn't have to work out the winner, loser and location again.
+        self.games = list(game_table.iter_games())
+
+    def replay(
+        self,
+        param_dict,
+        start=0,
+        player_to_rating=None,
+        log_loss=0,
+        on_season_start=None,
+        stop=None,
+        max_log_loss=float("inf"),
+        history=None,
+    ):
+        """
+        Replays the games from index start up to (but not including) index stop, beginning with the given ratings and
+        log loss, and returns the resulting EloMachine. stop defaults to the end of the games. If given,
+        on_season_start(index, player_to_rating, log_loss) is called at the start of every season after start,
+        before the ratings regress to the mean.
+
+        The log loss never goes down as we replay, so once it exceeds max_log_loss we know that the final loss will
+        too. At that point we stop, and return an EloMachine whose log loss is only a lower bound.
+
+        If given a RatingHistoryWriter, we record the ratings at the start of every season and after every game.
+        """
+        elo = EloMachine(
+            initial_rating=self.initial_rating,
+            home_team_advantage=param_dict["home_field"],
+            teams=self.team_registry,
+        )
+        if player_to_rating is not None:
+            elo.player_to_rating = player_to_rating
+            elo.log_loss = log_loss
+        last_year = None
+        for index, (
+            year,
+            week,
+            winning_team,
+            losing_team,
+            winning_team_location,
+        ) in enumerate(self.games[start:stop], start):
+            if year != last_year:
+                if on_season_start is not None and index > start:
+                    on_season_start(index, elo.player_to_rating, elo.log_loss)
+                elo.regress_to_mean(param_dict["season_regression"])
+                last_year = year
+                if history is not None:
+                    player_to_rating = elo.player_to_rating
+                    history.add_snapshot(
+                        year,
+                        [self.team_registry.get(team) for team in player_to_rating],
+                        list(player_to_rating.values()),
+                    )
+
+            elo.update_ratings_with_result(
+                winning_team,
+                losing_team,
+                winning_team_location,
+                k=get_k_for_week(param_dict, week),
+                include_in_log_loss=year in self.training_years,
+            )
+            self.games_replayed += 1
+            if history is not None:
+                player_to_rating = elo.player_to_rating
+                history.add_game(
+                    year,
+                    week,
+                    self.team_registry.get(winning_team),
+                    player_to_rating[winning_team],
+                    self.team_registry.get(losing_team),
+                    player_to_rating[losing_team],
+                )
+            if elo.log_loss > max_log_loss:
+                break
+        return elo
+
+
+class CompiledBackend:
+    """
+    Replays games over integer team ids and a flat list of ratings, one season at a time. Gives the same ratings and
+    log loss as ReferenceBackend.
+    """
+
+    # Whether the inner loop is compiled. If not, it runs as ordinary Python, which is still a few times faster than
+    # going through an EloMachine.
+    compiled = numba is not None
+
+    def __init__(
+        self, game_table, initial_rating=1000, training_years=None, use_numba=True
+    ):
+        """
+        Same arguments as ReferenceBackend. If use_numba is unset, we run as ordinary Python even if Numba is
+        installed, as we would without it.
+        """
+        self.compiled = self.compiled and use_numba
+        if self.compiled:
+            self._replay_games, self._regress_ratings = _replay_games, _regress_ratings
+        else:
+            self._replay_games = _python_replay_games
+            self._regress_ratings = _python_regress_ratings
+        self.games_replayed = 0
+        self.initial_rating = initial_rating
+        if training_years is None:
+            training_years = TRAINING_YEARS
+        self.teams = game_table.teams
+        self.team_registry = game_table.team_registry
+        self._team_to_id = {team: i for i, team in enumerate(self.teams)}
+        self._num_games = len(game_table)
+
+        self._years = np.asarray(game_table.year)
+        self._weeks = np.asarray(game_table.week)
+        years = self._years.tolist()
+        in_training = [year in training_years for year in years]
+        self._season_starts = [
+            index
+            for index, year in enumerate(years)
+            if index == 0 or year != years[index - 1]
+        ]
+        # Teams are numbered in the order in which they first appear, so the teams that have played before any game
+        # are always a prefix of self.teams. This is the length of that prefix.
+        self._num_teams_seen_before = np.concatenate(
+            (
+                [0],
+                np.maximum.accumulate(
+                    np.maximum(game_table.winner_id, game_table.loser_id) + 1
+                ),
+            )
+        ).tolist()
+
+        arrays = (
+            game_table.winner_id,
+            game_table.loser_id,
+            game_table.week,
+            game_table.home_sign,
+            np.array(in_training, dtype=np.bool_),
+        )
+        if self.compiled:
+            self._game_arrays = tuple(np.ascontiguousarray(array) for array in arrays)
+        else:
+            # Indexing a list is much faster than indexing a numpy array from Python.
+            self._game_arrays = tuple(array.tolist() for array in arrays)
+
+    def _new_ratings(self, player_to_rating):
+        ratings = [float(self.initial_rating)] * len(self.teams)
+        if player_to_rating is not None:
+            for player, rating in player_to_rating.items():
+                ratings[self._team_to_id[player]] = rating
+        if self.compiled:
+            return np.array(ratings)
+        return ratings
+
+    def _player_to_rating(self, ratings, index):
+        num_teams = self._num_teams_seen_before[index]
+        if self.compiled:
+            return dict(zip(self.teams[:num_teams], ratings[:num_teams].tolist()))
+        return dict(zip(self.teams[:num_teams], ratings[:num_teams]))
+
+    def replay(
+        self,
+        param_dict,
+        start=0,
+        player_to_rating=None,
+        log_loss=0,
+        on_season_start=None,
+        stop=None,
+        max_log_loss=float("inf"),
+        history=None,
+    ):
+        """
+        Same interface as ReferenceBackend.replay.
+        """
+        k_for_week = [
+            float(get_k_for_week(param_dict, week))
+            for week in range(1, WEEKS_IN_SEASON + 1)
+        ]
+        if self.compiled:
+            k_for_week = np.array(k_for_week)
+        home_field = float(param_dict["home_field"])
+        season_regression = float(param_dict["season_regression"])
+        ratings = self._new_ratings(player_to_rating)
+        log_loss = float(log_loss)
+        if stop is None:
+            stop = self._num_games
+        # The kernel always needs an array here, but only writes to it when we're recording.
+        history_ratings = np.empty((stop if history is not None else 0, 2))
+
+        segment_starts = [start] + [
+            index for index in self._season_starts if start < index < stop
+        ]
+        segment_stops = segment_starts[1:] + [stop]
+        for segment_start, segment_stop in zip(segment_starts, segment_stops):
+            if on_season_start is not None and segment_start > start:
+                on_season_start(
+                    segment_start,
+                    self._player_to_rating(ratings, segment_start),
+                    log_loss,
+                )
+            if segment_start < segment_stop:
+                self._regress_ratings(
+                    ratings, float(self.initial_rating), season_regression
+                )
+                if history is not None:
+                    num_teams = self._num_teams_seen_before[segment_start]
+                    history.add_snapshot(
+                        int(self._years[segment_start]),
+                        np.arange(num_teams),
+                        np.asarray(ratings[:num_teams]),
+                    )
+            log_loss, replayed_stop = self._replay_games(
+                *self._game_arrays,
+                segment_start,
+                segment_stop,
+                k_for_week,
+                home_field,
+                ratings,
+                log_loss,
+                float(max_log_loss),
+                history_ratings,
+                history is not None,
+            )
+            self.games_replayed += replayed_stop - segment_start
+            if log_loss > max_log_loss:
+                # The ratings after the game at which we stopped were never written, so we leave out the season.
+                break
+            if history is not None:
+                games = slice(segment_start, segment_stop)
+                winner_ids, loser_ids = self._game_arrays[:2]
+                history.add_games(
+                    self._years[games],
+                    self._weeks[games],
+                    np.asarray(winner_ids[games]),
+                    history_ratings[games, 0],
+                    np.asarray(loser_ids[games]),
+                    history_ratings[games, 1],
+                )
+
+        elo = EloMachine(
+            initial_rating=self.initial_rating,
+            home_team_advantage=param_dict["home_field"],
+            teams=self.team_registry,
+        )
+        # Our team ids are the registry's, so the machine can take the ratings as they are, apart from the teams that
+        # haven't played yet.
+        num_teams = self._num_teams_seen_before[stop]
+        ratings = ratings.tolist() if self.compiled else ratings
+        elo.load_ratings(ratings[:num_teams] + [nan] * (len(ratings) - num_teams))
+        elo.log_loss = log_loss
+        return elo
+
+
+class VectorizedBackend(CompiledBackend):
+    """
+    Tells ParameterTester to replay whole batches of candidates at once (see ParameterTester.run_many_cycles), which
+    costs little more than replaying one of them. Single replays, such as those that resume from a checkpoint,
+    record a history or stop after through_year, go through CompiledBackend as usual.
+
+    NumPy's log and power don't round exactly like the math module's, so the log losses of batched replays agree with
+    the other backends' to about 1e-12 rather than exactly. A batched replay can't stop early for one candidate, so
+    candidates are never pruned.
+    """
+
+    replays_batches = True
+
+
+BACKENDS = {
+    "reference": ReferenceBackend,
+    "compiled": CompiledBackend,
+    "vectorized": VectorizedBackend,
+}
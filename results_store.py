@@ -0,0 +1,119 @@
+"""
+A persistent, append-only store of the loss of every set of parameters that we've evaluated, so that searches can be
+interrupted and resumed, and overlapping searches only pay for the new points.
+"""
+import hashlib
+import json
+import sqlite3
+
+from loss_cache import canonical_key
+
+
+def canonical_params(param_dict):
+    """
+    Returns a canonical JSON encoding of param_dict, built from the same canonical_key as LossCache uses. Keys are
+    sorted and every number is written as a float rounded to nine decimal places, so that e.g. dict(k=100, ...) and
+    dict(k=100.0, ...) are treated as the same candidate, and so are values that differ only by floating-point noise.
+    """
+    return json.dumps(
+        dict(canonical_key(param_dict)), sort_keys=True, separators=(",", ":")
+    )
+
+
+def params_hash(param_dict):
+    return hashlib.sha256(canonical_params(param_dict).encode()).hexdigest()
+
+
+class ResultsStore:
+    """
+    A SQLite table of (data fingerprint, parameter hash) -> log loss. The data fingerprint identifies the games (and
+    anything else that the loss depends on besides the parameters), so results for different data never mix.
+
+    Every write is committed straight away, so nothing that we've evaluated is lost if a search is killed.
+    """
+
+    def __init__(self, path="results.sqlite"):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS results (
+                data_fingerprint TEXT NOT NULL,
+                params_hash TEXT NOT NULL,
+                params TEXT NOT NULL,
+                log_loss REAL NOT NULL,
+                PRIMARY KEY (data_fingerprint, params_hash)
+            );
+            CREATE INDEX IF NOT EXISTS results_by_loss ON results (data_fingerprint, log_loss);
+            """)
+        # How many lookups found a stored result, and how many didn't.
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, data_fingerprint, param_dicts):
+        """
+        Returns a list holding the stored log loss of each dict in param_dicts, or None for dicts that we haven't
+        evaluated.
+        """
+        hashes = [params_hash(param_dict) for param_dict in param_dicts]
+        stored = {}
+        # Stay well below SQLite's limit on the number of parameters in a query.
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start : start + 500]
+            stored.update(
+                self._connection.execute(
+                    "SELECT params_hash, log_loss FROM results WHERE data_fingerprint = ? AND params_hash IN ({})".format(
+                        ",".join("?" * len(chunk))
+                    ),
+                    [data_fingerprint] + chunk,
+                )
+            )
+        losses = [stored.get(hash_) for hash_ in hashes]
+        num_hits = sum(loss is not None for loss in losses)
+        self.hits += num_hits
+        self.misses += len(losses) - num_hits
+        return losses
+
+    def get(self, data_fingerprint, param_dict):
+        return self.get_many(data_fingerprint, [param_dict])[0]
+
+    def add_many(self, data_fingerprint, losses_and_params):
+        """
+        Stores a list of (log loss, param_dict) tuples. Storing a result that we already have leaves it unchanged.
+        """
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        data_fingerprint,
+                        params_hash(param_dict),
+                        canonical_params(param_dict),
+                        log_loss,
+                    )
+                    for log_loss, param_dict in losses_and_params
+                ],
+            )
+
+    def add(self, data_fingerprint, param_dict, log_loss):
+        self.add_many(data_fingerprint, [(log_loss, param_dict)])
+
+    def top(self, data_fingerprint, n):
+        """
+        Returns the n best (log loss, param_dict) tuples for the data, best first. This reads only n rows of the
+        index on log loss, rather than sorting every result.
+        """
+        rows = self._connection.execute(
+            "SELECT log_loss, params FROM results WHERE data_fingerprint = ? ORDER BY log_loss LIMIT ?",
+            (data_fingerprint, n),
+        )
+        return [(log_loss, json.loads(params)) for log_loss, params in rows]
+
+    def count(self, data_fingerprint):
+        ((count,),) = self._connection.execute(
+            "SELECT COUNT(*) FROM results WHERE data_fingerprint = ?",
+            (data_fingerprint,),
+        )
+        return count
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,200 @@
+"""
+Simulates the rest of a season many times over, starting from the current Elo ratings, to turn point ratings into
+distributions of final records and ranks.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from elo import get_k_for_week
+from game_table import home_field_signs
+
+
+class SeasonSimulator:
+    """
+    Plays out a schedule of remaining games many times. Every simulated game is won at random with the probability
+    that the EloMachine predicts, and then updates the ratings the same way as update_ratings_with_result, so later
+    games see the effect of earlier upsets.
+
+    The simulations run side by side: the ratings are a matrix of shape (n_simulations, n_teams), and each game is a
+    handful of NumPy operations on two of its columns.
+    """
+
+    def __init__(self, elo, schedule, param_dict, records=None, top_n=25):
+        """
+        elo holds the ratings at the start of the remaining schedule. schedule is a list of (week, team1, team2,
+        team1_location) tuples in the order in which the games will be played, and param_dict supplies k (or
+        k_list) for each week. records optionally maps teams to the (wins, losses) that they already have.
+
+        We rank every team that has a rating or appears in the schedule, and report how often each finishes in the
+        top_n.
+        """
+        self.top_n = top_n
+        self.home_field = float(elo.home_team_advantage)
+        team_to_id = {team: i for i, team in enumerate(elo.player_to_rating)}
+        for _, team1, team2, _ in schedule:
+            for team in (team1, team2):
+                team_to_id.setdefault(team, len(team_to_id))
+        self.teams = list(team_to_id)
+        self.initial_ratings = np.array(
+            [elo.player_to_rating.get(team, elo.initial_rating) for team in self.teams],
+            dtype=float,
+        )
+
+        self.team1_ids = np.array([team_to_id[game[1]] for game in schedule], int)
+        self.team2_ids = np.array([team_to_id[game[2]] for game in schedule], int)
+        self.signs = home_field_signs([game[3] for game in schedule])
+        self.k_values = np.array(
+            [get_k_for_week(param_dict, game[0]) for game in schedule], float
+        )
+
+        records = records or {}
+        self.current_wins = np.array(
+            [records.get(team, (0, 0))[0] for team in self.teams], int
+        )
+        self.current_losses = np.array(
+            [records.get(team, (0, 0))[1] for team in self.teams], int
+        )
+        self.games_remaining = np.bincount(
+            np.concatenate((self.team1_ids, self.team2_ids)), minlength=len(self.teams)
+        )
+
+    def simulate(self, num_simulations, seed=0, workers=None, chunk_size=10000):
+        """
+        Runs num_simulations simulations of the schedule and returns a dict mapping each team to its statistics,
+        ordered by mean rank:
+
+            rating, rating_std: the mean and standard deviation of the final rating
+            wins, losses: the mean final record, including the games already played
+            wins_distribution: a dict mapping each possible final number of wins to its probability
+            rank: the mean final rank, where 1 is the best
+            first_probability, top_n_probability: how often the team finishes first, and in the top_n
+
+        The simulations run in chunks of at most chunk_size, each with its own random stream derived from seed, so
+        the results depend only on seed and chunk_size. If workers is set, the chunks run in a process pool of that
+        size.
+        """
+        chunk_sizes = [
+            min(chunk_size, num_simulations - start)
+            for start in range(0, num_simulations, chunk_size)
+        ]
+        seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+        chunk_args = [
+            (
+                self.initial_ratings,
+                self.team1_ids,
+                self.team2_ids,
+                self.signs * self.home_field,
+                self.k_values,
+                self.games_remaining.max(initial=0),
+                self.top_n,
+                size,
+                chunk_seed,
+            )
+            for size, chunk_seed in zip(chunk_sizes, seeds)
+        ]
+        if workers:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                chunk_totals = list(pool.map(_simulate_chunk, chunk_args))
+        else:
+            chunk_totals = [_simulate_chunk(args) for args in chunk_args]
+        totals = [sum(parts) for parts in zip(*chunk_totals)]
+        return self._summarize(totals, num_simulations)
+
+    def _summarize(self, totals, num_simulations):
+        (
+            win_counts,
+            rating_sums,
+            rating_square_sums,
+            rank_sums,
+            first_counts,
+            top_counts,
+        ) = totals
+        mean_ratings = rating_sums / num_simulations
+        # Clip the variance at 0, since rounding can make it very slightly negative for teams that don't play.
+        rating_stds = np.sqrt(
+            np.maximum(rating_square_sums / num_simulations - mean_ratings**2, 0)
+        )
+        mean_simulated_wins = (
+            win_counts @ np.arange(win_counts.shape[1]) / num_simulations
+        )
+        stats = {}
+        for i in np.argsort(rank_sums, kind="stable"):
+            team = self.teams[i]
+            remaining = self.games_remaining[i]
+            stats[team] = dict(
+                rating=float(mean_ratings[i]),
+                rating_std=float(rating_stds[i]),
+                wins=float(self.current_wins[i] + mean_simulated_wins[i]),
+                losses=float(
+                    self.current_losses[i] + remaining - mean_simulated_wins[i]
+                ),
+                wins_distribution={
+                    int(self.current_wins[i] + wins): float(count / num_simulations)
+                    for wins, count in enumerate(win_counts[i, : remaining + 1])
+                    if count
+                },
+                rank=float(rank_sums[i] / num_simulations),
+                first_probability=float(first_counts[i] / num_simulations),
+                top_n_probability=float(top_counts[i] / num_simulations),
+            )
+        return stats
+
+
+def _simulate_chunk(args):
+    """
+    Runs one chunk of simulations and returns the totals that SeasonSimulator._summarize needs, as arrays with one
+    row per team: the counts of simulations in which the team won 0, 1, 2... of its remaining games, the sums of its
+    final ratings and of their squares, the sum of its ranks, and how often it finished first and in the top_n.
+    """
+    (
+        initial_ratings,
+        team1_ids,
+        team2_ids,
+        home_field_adjustments,
+        k_values,
+        max_games,
+        top_n,
+        num_simulations,
+        seed,
+    ) = args
+    rng = np.random.default_rng(seed)
+    num_teams = len(initial_ratings)
+    # Column-major, so that one team's ratings across all the simulations are contiguous.
+    ratings = np.empty((num_simulations, num_teams), order="F")
+    ratings[:] = initial_ratings
+    wins = np.zeros((num_simulations, num_teams), dtype=np.int16, order="F")
+
+    for team1, team2, home_field_adjustment, k in zip(
+        team1_ids, team2_ids, home_field_adjustments, k_values
+    ):
+        # The same arithmetic as EloMachine.predict_outcome, for every simulation at once.
+        predicted_outcome = 1 / (
+            1
+            + 10
+            ** ((ratings[:, team2] - (ratings[:, team1] + home_field_adjustment)) / 400)
+        )
+        team1_won = rng.random(num_simulations) < predicted_outcome
+        # If team1 wins, this is k * (1 - predicted_outcome), as in update_ratings_with_result. If team2 wins, it's
+        # minus k times team2's chance of losing, which is the same update from team2's point of view.
+        delta = k * (team1_won - predicted_outcome)
+        ratings[:, team1] += delta
+        ratings[:, team2] -= delta
+        wins[:, team1] += team1_won
+        wins[:, team2] += ~team1_won
+
+    # ranks[s, i] is the rank of team i in simulation s.
+    order = np.argsort(-ratings, axis=1, kind="stable")
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(1, num_teams + 1)[np.newaxis, :], axis=1)
+    win_counts = np.zeros((num_teams, max_games + 1), dtype=np.int64)
+    for i in range(num_teams):
+        win_counts[i] = np.bincount(wins[:, i], minlength=max_games + 1)
+    return (
+        win_counts,
+        ratings.sum(axis=0),
+        (ratings**2).sum(axis=0),
+        ranks.sum(axis=0),
+        (ranks == 1).sum(axis=0),
+        (ranks <= top_n).sum(axis=0),
+    )
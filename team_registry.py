@@ -0,0 +1,40 @@
+"""
+Dense integer ids for team names, so that ratings can live in flat arrays instead of dicts keyed by name.
+"""
+
+
+class TeamRegistry:
+    """
+    Hands out ids 0, 1, 2, ... to team names in the order in which they are first registered. Ids are never reused or
+    reassigned, so many EloMachines can share one registry and index their ratings arrays by the same ids.
+    """
+
+    def __init__(self, names=()):
+        # The name of each team, indexed by id.
+        self.names = []
+        self._name_to_id = {}
+        for name in names:
+            self.id_of(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._name_to_id
+
+    def id_of(self, name):
+        """
+        Returns the id of name, registering it if we haven't seen it before.
+        """
+        team_id = self._name_to_id.get(name)
+        if team_id is None:
+            team_id = len(self.names)
+            self._name_to_id[name] = team_id
+            self.names.append(name)
+        return team_id
+
+    def get(self, name, default=None):
+        """
+        Returns the id of name, or default if it isn't registered. Unlike id_of, this never registers anything.
+        """
+        return self._name_to_id.get(name, default)
@@ -0,0 +1,97 @@
+import pytest
+
+from adaptive_search import *
+from checkpoints import CheckpointCache
+from elo import ParameterTester
+from test_elo import SAMPLE_SCORES
+
+
+def test_partial_replays():
+    params = dict(k=40, home_field=50, season_regression=0.9)
+    searcher = ParameterTester(SAMPLE_SCORES, checkpoint_cache=CheckpointCache())
+    # Only 2013 is a training year, so a replay through 2012 has no loss at all.
+    assert searcher.evaluate_partial_losses([params], 2012) == [0]
+    full_elo = ParameterTester(SAMPLE_SCORES).run_one_cycle(params)
+    assert searcher.evaluate_partial_losses([params], 2013) == [full_elo.log_loss]
+    # The full replay carries on from the checkpoint at the end of the partial one.
+    assert searcher.run_one_cycle(params).player_to_rating == full_elo.player_to_rating
+    assert searcher.checkpoint_cache.hits == 2
+
+
+def test_successive_halving_only_fully_replays_survivors():
+    searcher = ParameterTester(SAMPLE_SCORES, training_years=(2012, 2013))
+    partial_batches = []
+
+    def partial_evaluator(param_dicts, through_year):
+        partial_batches.append((len(param_dicts), through_year))
+        return searcher.evaluate_partial_losses(param_dicts, through_year)
+
+    generator = TPEParameterGenerator(
+        partial_evaluator=partial_evaluator,
+        num_brackets=4,
+        num_startup=9,
+        training_years=searcher.training_years,
+    )
+    assert generator.rung_years == (2012,)
+    searcher.optimize(generator)
+    assert partial_batches == [(9, 2012)] * 4
+    assert len(searcher.results) == 12
+    for _, params in searcher.results:
+        for field, (low, high) in DEFAULT_SEARCH_SPACE.items():
+            assert low <= params[field] <= high
+
+
+def test_tpe_proposals_improve_on_random_ones():
+    searcher = ParameterTester(SAMPLE_SCORES)
+    batches = TPEParameterGenerator(
+        num_brackets=8, num_startup=18
+    ).get_next_param_batches()
+    bracket_losses = []
+    losses = None
+    for _ in range(8):
+        candidates = batches.send(losses)
+        losses = [searcher.run_one_cycle(params).log_loss for params in candidates]
+        bracket_losses.append(sum(losses) / len(losses))
+    # The first two brackets are random, and the rest are guided by the model.
+    assert max(bracket_losses[4:]) < min(bracket_losses[:2])
+
+
+def test_rung_years_fit_the_training_years():
+    assert default_rung_years(range(2013, 2019)) == (2014, 2016)
+    assert default_rung_years(range(2016, 2019)) == (2016, 2017)
+    assert default_rung_years([2018]) == ()
+    assert TPEParameterGenerator(training_years=range(2016, 2019)).rung_years == (
+        2016,
+        2017,
+    )
+    for rung_years in [(2014, 2016), (2017, 2018), (2017, 2016)]:
+        with pytest.raises(ValueError):
+            TPEParameterGenerator(
+                rung_years=rung_years, training_years=range(2016, 2019)
+            )
+
+
+def test_full_losses_take_over_the_model():
+    # The partial losses favour a high k, but the full losses favour a low one.
+    def partial_evaluator(param_dicts, through_year):
+        return [-params["k"] for params in param_dicts]
+
+    proposals = []
+
+    def recording_evaluator(param_dicts, through_year):
+        proposals.append([params["k"] for params in param_dicts])
+        return partial_evaluator(param_dicts, through_year)
+
+    batches = TPEParameterGenerator(
+        partial_evaluator=recording_evaluator,
+        num_brackets=30,
+        num_startup=6,
+        rung_years=(2014,),
+    ).get_next_param_batches()
+    losses = None
+    for _ in range(30):
+        candidates = batches.send(losses)
+        losses = [params["k"] for params in candidates]
+    later_proposals = [k for ks in proposals[10:] for k in ks]
+    low, high = DEFAULT_SEARCH_SPACE["k"]
+    assert sum(later_proposals) / len(later_proposals) < (low + high) / 2
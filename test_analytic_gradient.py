@@ -0,0 +1,49 @@
+import pytest
+
+from analytic_gradient import *
+from elo import ParameterTester
+from test_elo import SAMPLE_SCORES
+
+
+def test_gradient_matches_finite_differences():
+    searcher = ParameterTester(SAMPLE_SCORES)
+    params = dict(k_list=list(range(10, 28)), home_field=80, season_regression=0.8)
+    elo, gradient = loss_and_gradient(SAMPLE_SCORES, params)
+    assert elo.log_loss == pytest.approx(
+        searcher.run_one_cycle(params).log_loss, rel=1e-12
+    )
+
+    h = 1e-5
+    for name in ["home_field", "season_regression"]:
+        up = searcher.run_one_cycle(dict(params, **{name: params[name] + h}))
+        down = searcher.run_one_cycle(dict(params, **{name: params[name] - h}))
+        expected = (up.log_loss - down.log_loss) / (2 * h)
+        assert gradient[name] == pytest.approx(expected, rel=1e-5, abs=1e-9)
+    for week in [1, 3, 18]:
+        up = dict(params, k_list=list(params["k_list"]))
+        up["k_list"][week - 1] += h
+        down = dict(params, k_list=list(params["k_list"]))
+        down["k_list"][week - 1] -= h
+        expected = (
+            searcher.run_one_cycle(up).log_loss - searcher.run_one_cycle(down).log_loss
+        ) / (2 * h)
+        assert gradient["k_list"][week - 1] == pytest.approx(
+            expected, rel=1e-5, abs=1e-9
+        )
+
+
+def test_lbfgs_reduces_loss():
+    searcher = ParameterTester(SAMPLE_SCORES)
+    start = dict(k=40, home_field=50, season_regression=0.9)
+    searcher.optimize(LBFGSParameterGenerator(max_iterations=10, **start))
+    assert searcher.min_loss < searcher.run_one_cycle(start).log_loss
+    # The candidates hold plain floats, not NumPy scalars, so that they print and serialize cleanly.
+    searcher.optimize(
+        LBFGSParameterGenerator(
+            max_iterations=3, allow_different_k_different_weeks=True, **start
+        )
+    )
+    for _, params in searcher.results:
+        values = [params["home_field"], params["season_regression"]]
+        values += params["k_list"] if "k_list" in params else [params["k"]]
+        assert all(type(value) in (int, float) for value in values)
@@ -0,0 +1,71 @@
+from backtest import *
+from elo import GridParameterGenerator, ParameterTester
+
+
+# Four games a season, with the winners changing from season to season. Visiting scores are odd and home scores are
+# even, so there are no ties.
+SCORES = [
+    (
+        year,
+        week,
+        visiting_school,
+        11 + 2 * ((year * week) % 7),
+        home_school,
+        10 + 2 * ((year + week) % 5),
+    )
+    for year in range(2010, 2016)
+    for week, visiting_school, home_school in [
+        (1, "USC", "Notre Dame"),
+        (2, "Navy", "Notre Dame"),
+        (5, "Navy", "USC"),
+        (18, "USC", "Navy"),
+    ]
+]
+
+
+def small_grid_search(best_params):
+    return GridParameterGenerator(
+        k_min=20,
+        k_max=60,
+        k_step=20,
+        home_field_min=0,
+        home_field_max=100,
+        home_field_step=50,
+        season_regression_min=0.8,
+        season_regression_max=1.05,
+        season_regression_step=0.1,
+    )
+
+
+def test_rolling_origin_splits():
+    assert rolling_origin_splits(2012, 2015, min_training_years=2) == [
+        ((2012, 2013), (2014,)),
+        ((2012, 2013, 2014), (2015,)),
+    ]
+    assert rolling_origin_splits(2011, 2015, test_years=2, window=2) == [
+        ((2011, 2012), (2013, 2014)),
+        ((2012, 2013), (2014, 2015)),
+    ]
+
+
+def test_splits_share_checkpoints_without_changing_results():
+    game_table = GameTable.from_scores(SCORES)
+    splits = rolling_origin_splits(2012, 2015, min_training_years=1)
+    backtest = Backtest(game_table, splits, stages=(small_grid_search,))
+    results = backtest.run()
+    assert backtest.checkpoint_cache.hits > 0
+
+    for split, result in zip(splits, results):
+        (alone,) = Backtest(game_table, [split], stages=(small_grid_search,)).run()
+        assert result == alone
+        training_years, test_years = split
+        assert result["test_years"] == list(test_years)
+        # Scoring the test years is the same as training on them.
+        held_out = ParameterTester(
+            game_table.through_year(max(test_years)), training_years=test_years
+        ).run_one_cycle(result["params"])
+        assert result["test_log_loss"] == held_out.log_loss
+        assert result["test_games"] == 4
+        assert sum(row["games"] for row in result["calibration"]) == 4
+
+    assert backtest.run(workers=2) == results
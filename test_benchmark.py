@@ -0,0 +1,36 @@
+from benchmark import *
+
+
+def test_synthetic_scores_scale():
+    scores = list(synthetic_scores(num_teams=40, num_seasons=3))
+    assert scores == list(synthetic_scores(num_teams=40, num_seasons=3))
+    assert sorted({score[0] for score in scores}) == [2010, 2011, 2012]
+    assert len({score[2] for score in scores} | {score[4] for score in scores}) <= 40
+    # Every game has a winner, so the table can be built and replayed.
+    assert all(score[3] != score[5] for score in scores)
+    assert len(GameTable.from_scores(scores)) == len(scores)
+
+
+def test_find_regressions_only_flags_costs_beyond_threshold():
+    baseline = dict(
+        replay=dict(reference=dict(games=100, seconds_per_game=1.0)),
+        html_parsing=dict(streaming=dict(pages_per_second=10, peak_bytes=1000)),
+    )
+    results = dict(
+        replay=dict(reference=dict(games=1000, seconds_per_game=1.2)),
+        html_parsing=dict(streaming=dict(pages_per_second=1, peak_bytes=2000)),
+        ranking=dict(cold_seconds=5.0),
+    )
+    assert find_regressions(results, baseline, threshold=0.25) == [
+        ("html_parsing.streaming.peak_bytes", 1000, 2000)
+    ]
+    assert find_regressions(results, baseline, threshold=0.1) == [
+        ("replay.reference.seconds_per_game", 1.0, 1.2),
+        ("html_parsing.streaming.peak_bytes", 1000, 2000),
+    ]
+
+
+def test_core_import_stays_within_budget():
+    result = bench_import("elo")
+    assert not result["loads_matplotlib"]
+    assert result["seconds"] < IMPORT_BUDGET_SECONDS
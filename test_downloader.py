@@ -0,0 +1,75 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from downloader import *
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Serves every page with a fixed ETag, and fails the first request for each page to exercise retries.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.client_ports.add(self.client_address[1])
+            attempts = server.attempts.get(self.path, 0) + 1
+            server.attempts[self.path] = attempts
+        if attempts == 1:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+        else:
+            body = "<html>{}</html>".format(self.path).encode()
+            self.send_response(200)
+            self.send_header("ETag", '"v1"')
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.lock = threading.Lock()
+    server.client_ports = set()
+    server.attempts = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_all_retries_and_fetches_conditionally(stand_in_server, tmp_path):
+    root_url = "http://127.0.0.1:{}/scores.html?lg=FBS".format(
+        stand_in_server.server_address[1]
+    )
+    targets = get_targets(years=[2019], weeks=[1, 2, 3], root_url=root_url)
+    downloader = Downloader(str(tmp_path), max_workers=2, backoff_seconds=0)
+
+    results = downloader.download_all(targets)
+    assert set(results.values()) == {"downloaded"}
+    assert (tmp_path / "year-2019-week-18.html").read_text().startswith("<html>")
+    # Connections are reused, so we never open more than one per worker.
+    assert len(stand_in_server.client_ports) <= 2
+
+    results = Downloader(str(tmp_path), max_workers=2).download_all(targets)
+    assert set(results.values()) == {"not modified"}
+
+    (tmp_path / "year-2019-week-3.html").unlink()
+    results = Downloader(str(tmp_path), max_workers=2).download_all(
+        targets, skip_existing=True
+    )
+    assert results["year-2019-week-3.html"] == "downloaded"
+    assert results["year-2019-week-1.html"] == "skipped"
@@ -1,6 +1,9 @@
+import numpy as np
 import pytest
 
+from adaptive_search import TPEParameterGenerator
 from elo import *
+from loss_cache import canonical_key
 
 
 def test_grid_parameter_search():
@@ -46,3 +49,295 @@ def test_elo_machine_prediction():
         )
         == 0.09
     )
+
+
+SAMPLE_SCORES = [
+    (2012, 1, "USC", 24, "Notre Dame", 31),
+    (2012, 2, "Navy", 10, "Notre Dame", 14),
+    (2012, 18, "USC", 35, "Navy", 21),
+    (2013, 1, "Notre Dame", 20, "USC", 17),
+    (2013, 3, "Navy", 28, "USC", 27),
+    (2013, 18, "Navy", 13, "Notre Dame", 38),
+]
+
+
+def test_run_many_cycles_matches_run_one_cycle():
+    searcher = ParameterTester(SAMPLE_SCORES)
+    param_dicts = [
+        dict(k=40, home_field=50, season_regression=0.9),
+        dict(k=100, home_field=0, season_regression=0.5),
+        dict(k_list=list(range(10, 28)), home_field=80, season_regression=1.0),
+    ]
+    batch_elos = searcher.run_many_cycles(param_dicts)
+    for param_dict, batch_elo in zip(param_dicts, batch_elos):
+        elo = searcher.run_one_cycle(param_dict)
+        assert pytest.approx(elo.log_loss, rel=1e-12) == batch_elo.log_loss
+        assert list(elo.player_to_rating) == list(batch_elo.player_to_rating)
+        for team, rating in elo.player_to_rating.items():
+            assert pytest.approx(rating, rel=1e-12) == batch_elo.player_to_rating[team]
+
+
+def test_parallel_optimize_matches_serial():
+    serial = ParameterTester(SAMPLE_SCORES)
+    serial.optimize(GradientParameterGenerator(k=40, home_field=50))
+    parallel = ParameterTester(SAMPLE_SCORES, workers=2)
+    try:
+        parallel.optimize(GradientParameterGenerator(k=40, home_field=50))
+    finally:
+        parallel.close()
+    assert parallel.results == serial.results
+    assert parallel.best_elo.player_to_rating == serial.best_elo.player_to_rating
+
+
+def test_worker_results_share_the_parents_registry():
+    param_dicts = [
+        dict(k=40, home_field=50, season_regression=0.9),
+        dict(k=60, home_field=0, season_regression=1.0),
+    ]
+    serial = ParameterTester(SAMPLE_SCORES)
+    parallel = ParameterTester(SAMPLE_SCORES, workers=2)
+    try:
+        for with_gradients in (False, True):
+            results = list(
+                parallel.evaluate_batch(param_dicts, with_gradients=with_gradients)
+            )
+            expected = list(
+                serial.evaluate_batch(param_dicts, with_gradients=with_gradients)
+            )
+            if with_gradients:
+                assert [gradient for _, gradient in results] == [
+                    gradient for _, gradient in expected
+                ]
+                results = [elo for elo, _ in results]
+                expected = [elo for elo, _ in expected]
+            for elo, expected_elo, param_dict in zip(results, expected, param_dicts):
+                assert elo.teams is parallel.game_table.team_registry
+                assert elo.home_team_advantage == param_dict["home_field"]
+                assert elo.log_loss == expected_elo.log_loss
+                assert elo.player_to_rating == expected_elo.player_to_rating
+    finally:
+        parallel.close()
+
+
+@pytest.mark.parametrize("backend", ["reference", "compiled"])
+def test_pruning_keeps_the_optimum(backend):
+    plain = ParameterTester(SAMPLE_SCORES, backend=backend)
+    pruning = ParameterTester(SAMPLE_SCORES, backend=backend, pruning_margin=0)
+    for searcher in (plain, pruning):
+        searcher.optimize(GridParameterGenerator(k_step=20, batch_size=10))
+        searcher.optimize(GradientParameterGenerator(**searcher.results[0][1]))
+    assert pruning.results[0] == plain.results[0]
+    assert pruning.best_elo.player_to_rating == plain.best_elo.player_to_rating
+    assert pruning.pruned_results
+    # Pruned candidates are still in results (with lower bounds), so the plots cover every point of the grid.
+    assert sorted(canonical_key(params) for _, params in pruning.results) == sorted(
+        canonical_key(params) for _, params in plain.results
+    )
+    # Every candidate that we gave up on really was worse than the best.
+    plain_losses = {canonical_key(params): loss for loss, params in plain.results}
+    for lower_bound, params in pruning.pruned_results:
+        assert (
+            pruning.results[0][0] < lower_bound <= plain_losses[canonical_key(params)]
+        )
+
+
+def test_pruning_only_applies_to_generators_that_support_it():
+    plain = ParameterTester(SAMPLE_SCORES)
+    pruning = ParameterTester(SAMPLE_SCORES, pruning_margin=0)
+    for searcher in (plain, pruning):
+        searcher.optimize(TPEParameterGenerator(num_brackets=4, num_startup=9))
+    # TPE models the losses that it's sent, so lower bounds would mislead it.
+    assert not pruning.pruned_results
+    assert pruning.results == plain.results
+
+
+def test_grid_parameter_batches():
+    searcher = GridParameterGenerator(
+        k_min=1,
+        k_max=2,
+        k_step=1,
+        home_field_min=0,
+        home_field_max=1,
+        home_field_step=1,
+        season_regression_min=0,
+        season_regression_max=0.06,
+        season_regression_step=0.05,
+        batch_size=3,
+    )
+    batch_generator = searcher.get_next_param_batches()
+    batch_sizes = []
+    losses = None
+    while True:
+        try:
+            batch = batch_generator.send(losses)
+        except StopIteration:
+            break
+        batch_sizes.append(len(batch))
+        losses = [0.0] * len(batch)
+    assert batch_sizes == [3, 3, 2]
+
+
+def test_one_at_a_time_generator_adapter():
+    class FixedParameterGenerator:
+        def get_next_params(self):
+            for k in [20, 40]:
+                yield dict(k=k, home_field=50, season_regression=0.9)
+
+    searcher = ParameterTester(SAMPLE_SCORES)
+    searcher.optimize(FixedParameterGenerator())
+    assert sorted(params["k"] for _, params in searcher.results) == [20, 40]
+
+
+def test_checkpoint_cache_resumes_from_matching_season():
+    cache = CheckpointCache()
+    searcher = ParameterTester(SAMPLE_SCORES, checkpoint_cache=cache)
+    reference = ParameterTester(SAMPLE_SCORES)
+    k_list = [40] * WEEKS_IN_SEASON
+    searcher.run_one_cycle(dict(k_list=k_list, home_field=50, season_regression=0.9))
+    assert cache.hits == 0
+
+    # Week 3 is only played in 2013, so the state at the start of 2013 can be reused.
+    k_list[2] = 60
+    param_dict = dict(k_list=k_list, home_field=50, season_regression=0.9)
+    elo = searcher.run_one_cycle(param_dict)
+    assert cache.hits == 1
+    expected_elo = reference.run_one_cycle(param_dict)
+    assert elo.log_loss == expected_elo.log_loss
+    assert elo.player_to_rating == expected_elo.player_to_rating
+
+
+def test_checkpoint_cache_respects_memory_budget():
+    cache = CheckpointCache(max_bytes=1000)
+    for i in range(10):
+        cache.put(i, {"Notre Dame": 1000.0 + i, "USC": 1000.0 - i}, 0.0)
+    assert cache.num_bytes <= 1000
+    assert 0 < len(cache) < 10
+    assert 9 in cache and 0 not in cache
+
+
+def test_game_table_cache_round_trip(tmp_path):
+    csv_path = tmp_path / "scores.csv"
+    csv_path.write_text(
+        "".join("{},{},{},{},{},{}\n".format(*score) for score in SAMPLE_SCORES)
+    )
+    table = GameTable.load_cached(str(csv_path))
+    cached_table = GameTable.load_cached(str(csv_path))
+    assert cached_table.teams == table.teams == ["Notre Dame", "USC", "Navy"]
+    assert cached_table.games.tolist() == table.games.tolist()
+    assert list(cached_table.iter_games())[0] == (
+        2012,
+        1,
+        "Notre Dame",
+        "USC",
+        WinningTeamLocation.HOME,
+    )
+    location_to_sign = {
+        WinningTeamLocation.HOME: 1.0,
+        WinningTeamLocation.ROAD: -1.0,
+        WinningTeamLocation.NEUTRAL_SITE: 0.0,
+    }
+    assert cached_table.home_sign.tolist() == [
+        location_to_sign[game[4]] for game in cached_table.iter_games()
+    ]
+    assert set(cached_table.home_sign.tolist()) == {1.0, -1.0, 0.0}
+
+    param_dict = dict(k=40, home_field=50, season_regression=0.9)
+    assert (
+        ParameterTester(cached_table).run_one_cycle(param_dict).log_loss
+        == ParameterTester(SAMPLE_SCORES).run_one_cycle(param_dict).log_loss
+    )
+
+
+def test_ranking_index_survives_ratings_that_round_to_ties():
+    ranking = RankingIndex()
+    ranking.update("B", 1000.0)
+    # A is ahead of B, but joined later, so it loses any tie with B.
+    ranking.update("A", 1000.0000000000001)
+    # Regressing almost all the way to the mean rounds both ratings to 1000.
+    ranking.transform(lambda rating: 1000 + (rating - 1000) * 1e-3)
+    assert ranking.all() == [("B", 1000.0), ("A", 1000.0)]
+    ranking.update("B", 990.0)
+    assert ranking.all() == [("A", 1000.0), ("B", 990.0)]
+
+
+def test_ranking_index_is_maintained_incrementally():
+    elo = EloMachine(home_team_advantage=50)
+    elo.player_to_rating = {"Navy": 1000.0, "USC": 1100.0, "Army": 1000.0}
+    ranking = elo.ranking
+    assert ranking.top(1) == [("USC", 1100.0)]
+    # Ties are listed in the order in which the players were added.
+    assert ranking.bottom(2) == [("Navy", 1000.0), ("Army", 1000.0)]
+
+    elo.update_ratings_with_result("Army", "USC", WinningTeamLocation.ROAD, k=100)
+    assert ranking.rank_of("Army") == 1
+    elo.regress_to_mean(0.5)
+    assert elo.ranking is ranking
+    assert ranking.all() == sorted(
+        elo.player_to_rating.items(), key=lambda item: -item[1]
+    )
+    assert ranking.range(999, 1000) == [("Navy", 1000.0)]
+    assert ranking.range(1000, 2000) == ranking.all()
+
+
+def test_elo_machines_share_a_team_registry():
+    searcher = ParameterTester(SAMPLE_SCORES)
+    first = searcher.run_one_cycle(dict(k=40, home_field=50, season_regression=0.9))
+    second = searcher.run_one_cycle(dict(k=80, home_field=50, season_regression=0.9))
+    assert first.teams is second.teams is searcher.game_table.team_registry
+    assert not hasattr(first, "__dict__")
+    assert list(first.player_to_rating) == ["Notre Dame", "USC", "Navy"]
+
+    # A team that we haven't rated yet is registered, but only has a rating once it plays.
+    elo = EloMachine(home_team_advantage=50, teams=first.teams)
+    elo.player_to_rating = {"USC": 1100.0}
+    assert "Notre Dame" not in elo.player_to_rating
+    assert (
+        elo.predict_outcome("Army", "Notre Dame", WinningTeamLocation.NEUTRAL_SITE)
+        == 0.5
+    )
+    elo.update_ratings_with_result("Army", "USC", WinningTeamLocation.HOME)
+    delta = 40 * (1 - EloMachine.expected_outcome(1050, 1100))
+    elo.regress_to_mean(0.5)
+    assert elo.player_to_rating == {
+        "USC": 1000 + (100 - delta) * 0.5,
+        "Army": 1000 + delta * 0.5,
+    }
+    assert len(elo.player_to_rating) == 2
+    assert "Army" in searcher.game_table.team_registry
+
+
+def test_bulk_predictions_match_predict_outcome():
+    elo = ParameterTester(SAMPLE_SCORES).run_one_cycle(
+        dict(k=40, home_field=50, season_regression=0.9)
+    )
+    teams1 = ["Notre Dame", "USC", "Navy", "Army"]
+    teams2 = ["USC", "Navy", "Notre Dame", "USC"]
+    locations = list(WinningTeamLocation) + [WinningTeamLocation.HOME]
+    expected = [
+        elo.predict_outcome(team1, team2, location)
+        for team1, team2, location in zip(teams1, teams2, locations)
+    ]
+    assert elo.predict_outcomes(teams1, teams2, locations) == pytest.approx(
+        expected, rel=1e-12
+    )
+    # Team ids and location values work too, and so does a single location for every game.
+    assert elo.predict_outcomes(
+        np.array([0, 1]), np.array([1, 2]), np.array([1, 2])
+    ) == pytest.approx(expected[:2], rel=1e-12)
+    assert elo.predict_outcomes(
+        teams1[:2], teams2[:2], WinningTeamLocation.HOME
+    ) == pytest.approx(
+        [expected[0], elo.predict_outcome("USC", "Navy", WinningTeamLocation.HOME)],
+        rel=1e-12,
+    )
+
+    teams = list(elo.player_to_rating)
+    for location in WinningTeamLocation:
+        matrix = elo.outcome_matrix(location)
+        assert matrix.shape == (3, 3)
+        for i, team1 in enumerate(teams):
+            for j, team2 in enumerate(teams):
+                assert matrix[i, j] == pytest.approx(
+                    elo.predict_outcome(team1, team2, location), rel=1e-12
+                )
+    assert elo.outcome_matrix(teams=["Navy", "Army"]).shape == (2, 2)
@@ -0,0 +1,40 @@
+import os
+import shutil
+
+from html_parser import *
+
+
+def test_ingest_only_parses_new_files(tmp_path):
+    raw_data_dir = tmp_path / "raw_data"
+    raw_data_dir.mkdir()
+    shutil.copy("raw_data/year-2015-week-3.html", raw_data_dir)
+    output_path = str(tmp_path / "scores.csv")
+    cache_path = str(tmp_path / "parse_cache.json")
+
+    assert ingest(str(raw_data_dir), output_path, cache_path, workers=1) == 1
+    with open(output_path) as file_handle:
+        first_output = file_handle.read()
+    assert "2015,3,Clemson,20,Louisville,17" in first_output
+
+    # Touching a file without changing it shouldn't force a parse.
+    os.utime(raw_data_dir / "year-2015-week-3.html")
+    assert ingest(str(raw_data_dir), output_path, cache_path, workers=1) == 0
+
+    shutil.copy("raw_data/year-2015-week-4.html", raw_data_dir)
+    assert ingest(str(raw_data_dir), output_path, cache_path, workers=1) == 1
+    with open(output_path) as file_handle:
+        second_output = file_handle.read()
+    assert len(second_output) > len(first_output)
+
+
+def test_streaming_extraction_matches_dom(capsys):
+    with open("raw_data/year-2015-week-1.html") as file_handle:
+        contents = file_handle.read()
+    dom_score_tuples = extract_score_tuples(contents, features="html.parser")
+    dom_output = capsys.readouterr().out
+    streaming_score_tuples = extract_score_tuples(contents, streaming=True)
+    streaming_output = capsys.readouterr().out
+    assert streaming_score_tuples == dom_score_tuples
+    assert streaming_output.count("likely cancelled") == dom_output.count(
+        "likely cancelled"
+    )
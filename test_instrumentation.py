@@ -0,0 +1,60 @@
+import json
+
+from checkpoints import CheckpointCache
+from elo import GradientParameterGenerator, GridParameterGenerator, ParameterTester
+from instrumentation import *
+from test_elo import SAMPLE_SCORES
+
+
+def test_instrumented_optimize_records_stages():
+    plain = ParameterTester(SAMPLE_SCORES)
+    plain.optimize(GradientParameterGenerator(k=40, home_field=50))
+
+    instrumentation = Instrumentation(profile=True, profile_every=2)
+    searcher = ParameterTester(SAMPLE_SCORES, instrumentation=instrumentation)
+    searcher.optimize(GradientParameterGenerator(k=40, home_field=50))
+    assert searcher.results == plain.results
+
+    report = json.loads(instrumentation.to_json())
+    num_candidates = len(searcher.results)
+    assert report["counters"] == dict(
+        candidates=num_candidates, games=num_candidates * len(SAMPLE_SCORES)
+    )
+    assert report["stages"]["evaluation"]["calls"] == num_candidates
+    # SAMPLE_SCORES covers one warm-up season (2012) and one training season (2013).
+    assert report["stages"]["warmup_replay"]["calls"] == num_candidates
+    assert report["stages"]["training_replay"]["calls"] == num_candidates
+    assert "generator" in report["stages"]
+    assert report["candidates_per_second"] > 0
+    assert "replay" in instrumentation.profile_stats()
+
+
+def test_games_counter_only_counts_games_actually_replayed():
+    grid = dict(
+        k_min=20,
+        k_max=60,
+        k_step=20,
+        home_field_min=0,
+        home_field_max=100,
+        home_field_step=50,
+        season_regression_min=0.8,
+        season_regression_max=1.05,
+        season_regression_step=0.1,
+    )
+    counters = []
+    for backend in ["reference", "compiled"]:
+        instrumentation = Instrumentation()
+        searcher = ParameterTester(
+            SAMPLE_SCORES,
+            backend=backend,
+            checkpoint_cache=CheckpointCache(),
+            pruning_margin=0,
+            instrumentation=instrumentation,
+        )
+        searcher.optimize(GridParameterGenerator(**grid))
+        assert instrumentation.counters["games"] == searcher.games_replayed
+        counters.append(dict(instrumentation.counters))
+    # Both backends stop at the same game when they prune.
+    assert counters[0] == counters[1]
+    # Candidates that share a home field resume the second season from a checkpoint.
+    assert counters[0]["games"] < counters[0]["candidates"] * len(SAMPLE_SCORES)
@@ -0,0 +1,55 @@
+from elo import GradientParameterGenerator, ParameterTester
+from instrumentation import Instrumentation
+from loss_cache import *
+from test_elo import SAMPLE_SCORES
+
+
+def test_canonical_key_ignores_float_noise():
+    assert canonical_key(dict(season_regression=0.1 + 0.2, k=100)) == canonical_key(
+        dict(k=100.0, season_regression=0.3)
+    )
+    assert canonical_key(dict(k_list=[1, 2])) == canonical_key(dict(k_list=(1.0, 2.0)))
+    assert canonical_key(dict(k=100)) != canonical_key(dict(k=100.001))
+
+
+def test_loss_cache_evicts_least_recently_used():
+    cache = LossCache(max_entries=2, max_elos=1)
+    cache.put(dict(k=1), 1.0, elo="first")
+    cache.put(dict(k=2), 2.0, elo="second")
+    assert cache.get(dict(k=1)) == (1.0, None)
+    cache.put(dict(k=3), 3.0)
+    assert cache.get(dict(k=2)) is None
+    assert cache.get(dict(k=3)) == (3.0, None)
+    assert cache.stats()["hit_rate"] == 2 / 3
+
+
+def test_optimize_with_loss_cache_skips_repeated_candidates():
+    plain = ParameterTester(SAMPLE_SCORES)
+    plain.optimize(GradientParameterGenerator(k=40, home_field=50))
+
+    instrumentation = Instrumentation()
+    cached = ParameterTester(
+        SAMPLE_SCORES, loss_cache=LossCache(), instrumentation=instrumentation
+    )
+    cached.optimize(GradientParameterGenerator(k=40, home_field=50))
+    assert cached.results == plain.results
+    assert cached.best_elo.player_to_rating == plain.best_elo.player_to_rating
+    assert cached.loss_cache.hits > 0
+    assert instrumentation.counters["candidates"] == len(plain.results) - (
+        instrumentation.counters["reused_candidates"]
+    )
+
+
+def test_duplicates_in_a_batch_are_evaluated_once():
+    class Duplicates:
+        def get_next_param_batches(self):
+            params = dict(k=40, home_field=50, season_regression=0.9)
+            yield [params, dict(params), dict(params, season_regression=0.3 + 0.6)]
+
+    instrumentation = Instrumentation()
+    searcher = ParameterTester(
+        SAMPLE_SCORES, loss_cache=LossCache(), instrumentation=instrumentation
+    )
+    searcher.optimize(Duplicates())
+    assert instrumentation.counters["candidates"] == 1
+    assert len({log_loss for log_loss, _ in searcher.results}) == 1
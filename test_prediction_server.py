@@ -0,0 +1,144 @@
+import asyncio
+
+from game_table import WinningTeamLocation
+from prediction_server import *
+from rating_store import RatingStore
+from test_elo import SAMPLE_SCORES
+
+
+PARAMS = dict(k=40, home_field=50, season_regression=0.9)
+
+
+def test_handle_request_answers_from_the_snapshot(tmp_path):
+    path = str(tmp_path / "ratings.json")
+    store = RatingStore.from_scores(PARAMS, SAMPLE_SCORES)
+    store.save(path)
+    server = PredictionServer(path)
+    assert asyncio.run(server.reload_if_changed())
+
+    status, response = server.handle_request(
+        "GET", "/predict?team1=USC&team2=Navy&location=home"
+    )
+    assert status == 200
+    assert response["probability"] == store.elo.predict_outcome(
+        "USC", "Navy", WinningTeamLocation.HOME
+    )
+
+    status, response = server.handle_request(
+        "POST",
+        "/predict",
+        b'{"games": [["USC", "Navy", "home"], ["Navy", "Notre Dame", "neutral"]]}',
+    )
+    assert status == 200
+    assert response["probabilities"] == [
+        store.elo.predict_outcome("USC", "Navy", WinningTeamLocation.HOME),
+        store.elo.predict_outcome(
+            "Navy", "Notre Dame", WinningTeamLocation.NEUTRAL_SITE
+        ),
+    ]
+
+    status, response = server.handle_request("GET", "/rankings?n=2")
+    assert [team for _, team, _ in response["rankings"]] == [
+        team for team, _ in store.elo.ranking.top(2)
+    ]
+    status, response = server.handle_request("GET", "/rankings?team=Navy")
+    assert response["rank"] == store.elo.ranking.rank_of("Navy")
+
+    assert server.handle_request("GET", "/predict?team1=USC&team2=Army")[0] == 404
+    assert (
+        server.handle_request("GET", "/predict?team1=USC&team2=Navy&location=away")[0]
+        == 400
+    )
+    assert server.handle_request("POST", "/predict", b"not json")[0] == 400
+    assert (
+        server.handle_request(
+            "POST", "/predict", b'{"games": [[["USC"], "Navy", "home"]]}'
+        )[0]
+        == 400
+    )
+    assert (
+        server.handle_request("POST", "/predict", b'{"games": [["USC", "Navy"]]}')[0]
+        == 400
+    )
+    for n in ("-1", "0", "ten"):
+        assert server.handle_request("GET", "/rankings?n=" + n)[0] == 400
+    assert server.handle_request("DELETE", "/rankings")[0] == 405
+    assert server.handle_request("GET", "/nowhere")[0] == 404
+
+    # A bug in the server becomes a 500 rather than a dropped connection.
+    server.store = None
+    assert server.handle_request("GET", "/rankings")[0] == 500
+
+
+def test_server_swaps_in_new_snapshots_between_requests(tmp_path):
+    path = str(tmp_path / "ratings.json")
+    *earlier_weeks, last_week = SAMPLE_SCORES
+    RatingStore.from_scores(PARAMS, earlier_weeks).save(path)
+
+    async def run():
+        server = PredictionServer(path, port=0, poll_interval=3600)
+        await server.start()
+        try:
+            target = "/predict?team1=Navy&team2=Notre%20Dame"
+            status, before = await request(server.host, server.port, "GET", target)
+            assert status == 200
+
+            store = RatingStore.load(path)
+            store.apply_week([last_week])
+            store.save(path)
+            assert await server.reload_if_changed()
+            assert not await server.reload_if_changed()
+
+            status, after = await request(server.host, server.port, "GET", target)
+            assert after["probability"] == store.elo.predict_outcome(
+                "Navy", "Notre Dame", WinningTeamLocation.NEUTRAL_SITE
+            )
+            assert after["probability"] != before["probability"]
+            status, snapshot = await request(
+                server.host, server.port, "GET", "/snapshot"
+            )
+            assert (snapshot["last_year"], snapshot["last_week"]) == (2013, 18)
+
+            # A broken snapshot is skipped, and we keep serving the last good one.
+            with open(path, "w") as file_handle:
+                file_handle.write("{")
+            assert not await server.reload_if_changed()
+            assert (await request(server.host, server.port, "GET", target))[1] == after
+
+            results = await load_test(
+                server.host, server.port, target, num_requests=200, concurrency=4
+            )
+            assert results["errors"] == 0
+        finally:
+            await server.close()
+
+    asyncio.run(run())
+
+
+def test_watcher_survives_malformed_snapshots(tmp_path):
+    path = str(tmp_path / "ratings.json")
+    *earlier_weeks, last_week = SAMPLE_SCORES
+    RatingStore.from_scores(PARAMS, earlier_weeks).save(path)
+
+    async def run():
+        server = PredictionServer(path, port=0, poll_interval=0.01)
+        await server.start()
+        try:
+            first_store = server.store
+            # Valid JSON, but not a snapshot.
+            with open(path, "w") as file_handle:
+                file_handle.write("[]")
+            await asyncio.sleep(0.1)
+            assert server.store is first_store
+
+            store = RatingStore.from_scores(PARAMS, SAMPLE_SCORES)
+            store.save(path)
+            for _ in range(100):
+                if server.store is not first_store:
+                    break
+                await asyncio.sleep(0.01)
+            assert server.store.last_year == 2013 and server.store.last_week == 18
+        finally:
+            await server.close()
+
+    asyncio.run(run())
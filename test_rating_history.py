@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pytest
+
+from elo import ParameterTester
+import rating_history
+from rating_history import *
+from rating_store import RatingStore
+from test_elo import SAMPLE_SCORES
+
+
+PARAMS = dict(k=40, home_field=50, season_regression=0.9)
+
+
+@pytest.mark.parametrize("backend", ["reference", "compiled"])
+def test_history_answers_point_in_time_queries(tmp_path, backend):
+    path = str(tmp_path / "history.bin")
+    searcher = ParameterTester(SAMPLE_SCORES, backend=backend)
+    with RatingHistoryWriter(path, searcher.game_table.teams) as writer:
+        final_elo = searcher.run_one_cycle(PARAMS, history=writer)
+    history = RatingHistory(path)
+
+    # Two records per game, plus a snapshot of the three teams at the start of 2013.
+    assert len(history) == 2 * len(SAMPLE_SCORES) + 3
+    assert history.ratings_before(2014, 1) == final_elo.player_to_rating
+    for year, week in [(2012, 2), (2012, 18), (2013, 1), (2013, 3)]:
+        store = RatingStore.from_scores(
+            PARAMS, [score for score in SAMPLE_SCORES if score[:2] < (year, week)]
+        )
+        if (year, week) == (2013, 1):
+            # Going into the first week of a season includes the regression to the mean.
+            store.elo.regress_to_mean(PARAMS["season_regression"])
+        assert history.ratings_before(year, week) == store.elo.player_to_rating
+    assert history.rating_before("Navy", 2012, 2) is None
+    assert history.rating_before("Navy", 2012, 3) == history.trajectory("Navy")[0][2]
+    assert [record[:2] for record in history.trajectory("Navy")] == [
+        (2012, 2),
+        (2012, 18),
+        (2013, SNAPSHOT_WEEK),
+        (2013, 3),
+        (2013, 18),
+    ]
+    with pytest.raises(KeyError):
+        history.rating_before("Army", 2013, 1)
+
+    assert history.ratings_in_week(2013, SNAPSHOT_WEEK) == sorted(
+        history.ratings_before(2013, 1).items(),
+        key=lambda item: searcher.game_table.teams.index(item[0]),
+    )
+    assert {team for team, _ in history.ratings_in_week(2012, 2)} == {
+        "Navy",
+        "Notre Dame",
+    }
+    assert history.ratings_in_week(2012, 3) == []
+    assert history.ratings_in_week(2020, 1) == []
+
+    # The indexes come from the files that the writer left next to the history, and match those built from scratch.
+    assert all(
+        isinstance(index, np.memmap) for index in (history._by_team, history._weeks)
+    )
+    for path_index, built_index in zip(
+        (history._by_team, history._team_time_keys, history._weeks),
+        rating_history._build_indexes(history.records),
+    ):
+        np.testing.assert_array_equal(path_index, built_index)
+
+    # Without the indexes (e.g. if the writer never finished), the reader builds its own.
+    for index_path in rating_history._index_paths(path):
+        os.remove(index_path)
+    rebuilt = RatingHistory(path)
+    assert rebuilt.ratings_before(2014, 1) == final_elo.player_to_rating
+    assert rebuilt.ratings_in_week(2012, 2) == history.ratings_in_week(2012, 2)
@@ -0,0 +1,22 @@
+import pytest
+
+from elo import ParameterTester
+from rating_store import *
+from test_elo import SAMPLE_SCORES
+
+
+def test_apply_week_reproduces_full_replay(tmp_path):
+    params = dict(k=40, home_field=50, season_regression=0.9)
+    *earlier_weeks, last_week = SAMPLE_SCORES
+    path = str(tmp_path / "ratings.json")
+    RatingStore.from_scores(params, earlier_weeks).save(path)
+
+    store = RatingStore.load(path)
+    store.apply_week([last_week])
+    expected_elo = ParameterTester(SAMPLE_SCORES).run_one_cycle(params)
+    assert store.elo.log_loss == expected_elo.log_loss
+    assert store.elo.player_to_rating == expected_elo.player_to_rating
+    assert (store.last_year, store.last_week) == (2013, 18)
+
+    with pytest.raises(ValueError):
+        store.apply_week([last_week])
@@ -0,0 +1,97 @@
+import pytest
+
+from checkpoints import CheckpointCache
+from elo import GridParameterGenerator, ParameterTester
+from game_table import GameTable
+from loss_cache import canonical_key
+from replay_backends import *
+from test_elo import SAMPLE_SCORES
+
+
+PARAM_DICTS = [
+    dict(k=40, home_field=50, season_regression=0.9),
+    dict(k=100, home_field=0, season_regression=0.5),
+    dict(k_list=list(range(10, 28)), home_field=80, season_regression=1.0),
+]
+
+
+@pytest.mark.parametrize("backend", sorted(BACKENDS))
+def test_backend_matches_reference(backend):
+    reference = ParameterTester(SAMPLE_SCORES, backend="reference")
+    searcher = ParameterTester(SAMPLE_SCORES, backend=backend)
+    for param_dict in PARAM_DICTS:
+        expected_elo = reference.run_one_cycle(param_dict)
+        elo = searcher.run_one_cycle(param_dict)
+        assert elo.log_loss == expected_elo.log_loss
+        assert list(elo.player_to_rating.items()) == list(
+            expected_elo.player_to_rating.items()
+        )
+
+
+@pytest.mark.parametrize("backend", sorted(BACKENDS))
+def test_backend_resumes_from_checkpoints(backend):
+    reference = ParameterTester(SAMPLE_SCORES)
+    searcher = ParameterTester(
+        SAMPLE_SCORES, backend=backend, checkpoint_cache=CheckpointCache()
+    )
+    param_dict = PARAM_DICTS[0]
+    searcher.run_one_cycle(param_dict)
+    elo = searcher.run_one_cycle(param_dict)
+    assert searcher.checkpoint_cache.hits == 1
+    assert elo.log_loss == reference.run_one_cycle(param_dict).log_loss
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        ParameterTester(SAMPLE_SCORES, backend="quantum")
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_vectorized_backend_optimizes_like_the_reference(workers):
+    grid = GridParameterGenerator(k_step=20, batch_size=10)
+    reference = ParameterTester(SAMPLE_SCORES, backend="reference")
+    reference.optimize(grid)
+    searcher = ParameterTester(
+        SAMPLE_SCORES, backend="vectorized", workers=workers, pruning_margin=0
+    )
+    try:
+        searcher.optimize(grid)
+    finally:
+        searcher.close()
+    assert len(searcher.results) == len(reference.results)
+    assert searcher.games_replayed == len(searcher.results) * len(SAMPLE_SCORES)
+    assert not searcher.pruned_results
+    # Batched replays round differently, so near-ties may come out in either order.
+    expected = {canonical_key(params): loss for loss, params in reference.results}
+    for loss, params in searcher.results:
+        assert loss == pytest.approx(expected[canonical_key(params)], rel=1e-12)
+    assert searcher.results[0][1] == reference.results[0][1]
+    assert searcher.best_elo.player_to_rating == pytest.approx(
+        reference.best_elo.player_to_rating, rel=1e-12
+    )
+
+
+@pytest.mark.parametrize("use_numba", [True, False])
+def test_compiled_backend_with_and_without_numba(use_numba):
+    game_table = GameTable.from_scores(SAMPLE_SCORES)
+    backend = CompiledBackend(game_table, use_numba=use_numba)
+    assert backend.compiled == (use_numba and CompiledBackend.compiled)
+    reference = ReferenceBackend(game_table)
+    for param_dict in PARAM_DICTS:
+        full_loss = reference.replay(param_dict).log_loss
+        # The second replay gives up partway through 2013.
+        for max_log_loss in (float("inf"), full_loss / 2):
+            games_replayed = backend.games_replayed
+            expected_games_replayed = reference.games_replayed
+            expected_elo = reference.replay(param_dict, max_log_loss=max_log_loss)
+            elo = backend.replay(param_dict, max_log_loss=max_log_loss)
+            assert elo.log_loss == expected_elo.log_loss
+            games_replayed = backend.games_replayed - games_replayed
+            assert games_replayed == reference.games_replayed - expected_games_replayed
+            if max_log_loss == float("inf"):
+                assert games_replayed == len(game_table)
+                assert list(elo.player_to_rating.items()) == list(
+                    expected_elo.player_to_rating.items()
+                )
+            else:
+                assert games_replayed < len(game_table)
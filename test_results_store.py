@@ -0,0 +1,85 @@
+import pytest
+
+from elo import GridParameterGenerator, ParameterTester
+from loss_cache import LossCache
+from results_store import *
+from test_elo import SAMPLE_SCORES
+
+
+def small_grid(k_max, batch_size=100):
+    return GridParameterGenerator(
+        k_min=10,
+        k_max=k_max,
+        k_step=10,
+        home_field_min=0,
+        home_field_max=50,
+        home_field_step=50,
+        season_regression_min=0.5,
+        season_regression_max=1.0,
+        season_regression_step=0.25,
+        batch_size=batch_size,
+    )
+
+
+def test_canonical_params():
+    assert params_hash(dict(k=100, home_field=50)) == params_hash(
+        dict(home_field=50.0, k=100.0)
+    )
+    assert params_hash(dict(k_list=[1, 2])) != params_hash(dict(k_list=[2, 1]))
+
+
+def test_drifted_floats_hit_the_loss_cache_and_the_store(tmp_path):
+    params = dict(k=40, home_field=50, season_regression=0.6)
+    drifted = dict(k=40, home_field=50, season_regression=0.6000000000000001)
+    loss_cache = LossCache()
+    loss_cache.put(params, 1.5)
+    store = ResultsStore(str(tmp_path / "results.sqlite"))
+    store.add("data", params, 1.5)
+    assert loss_cache.get(drifted) == (1.5, None)
+    assert store.get("data", drifted) == 1.5
+    assert store.get("data", dict(drifted, k_list=[1, 2])) is None
+
+
+def test_overlapping_searches_only_evaluate_new_points(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    first = ParameterTester(SAMPLE_SCORES, results_store=ResultsStore(path))
+    first.optimize(small_grid(k_max=20))
+    assert first.results_store.count(first.data_fingerprint) == 8
+
+    second = ParameterTester(SAMPLE_SCORES, results_store=ResultsStore(path))
+    second.optimize(small_grid(k_max=30))
+    assert (second.results_store.hits, second.results_store.misses) == (8, 4)
+
+    fresh = ParameterTester(SAMPLE_SCORES)
+    fresh.optimize(small_grid(k_max=30))
+    assert second.results == fresh.results
+    assert second.best_elo.player_to_rating == fresh.best_elo.player_to_rating
+    assert second.top_results(3) == [
+        (log_loss, {key: float(value) for key, value in params.items()})
+        for log_loss, params in fresh.results[:3]
+    ]
+
+    # Results for different data are kept apart.
+    other = ParameterTester(SAMPLE_SCORES[:-1], results_store=ResultsStore(path))
+    assert other.data_fingerprint != second.data_fingerprint
+    assert other.results_store.get(other.data_fingerprint, fresh.results[0][1]) is None
+
+
+def test_interrupted_search_resumes(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+
+    class InterruptedGrid:
+        def get_next_param_batches(self):
+            batches = small_grid(k_max=30, batch_size=5).get_next_param_batches()
+            losses = yield next(batches)
+            batches.send(losses)
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        ParameterTester(SAMPLE_SCORES, results_store=ResultsStore(path)).optimize(
+            InterruptedGrid()
+        )
+
+    searcher = ParameterTester(SAMPLE_SCORES, results_store=ResultsStore(path))
+    searcher.optimize(small_grid(k_max=30, batch_size=5))
+    assert (searcher.results_store.hits, searcher.results_store.misses) == (5, 7)
@@ -0,0 +1,52 @@
+import pytest
+
+from elo import EloMachine
+from game_table import WinningTeamLocation
+from season_simulator import *
+
+
+PARAMS = dict(k=40, home_field=50, season_regression=0.9)
+
+
+def make_elo():
+    elo = EloMachine(home_team_advantage=PARAMS["home_field"])
+    elo.player_to_rating = {"Notre Dame": 1100.0, "USC": 1000.0, "Navy": 900.0}
+    return elo
+
+
+def test_simulated_results_follow_the_ratings():
+    elo = make_elo()
+    # Two games between the same teams, so the second depends on the first.
+    schedule = [
+        (1, "Notre Dame", "USC", WinningTeamLocation.ROAD),
+        (2, "Notre Dame", "USC", WinningTeamLocation.HOME),
+    ]
+    simulator = SeasonSimulator(elo, schedule, PARAMS, records={"Navy": (3, 1)})
+    stats = simulator.simulate(200000, seed=1)
+
+    first_game = elo.predict_outcome("Notre Dame", "USC", WinningTeamLocation.ROAD)
+    elo.update_ratings_with_result("Notre Dame", "USC", WinningTeamLocation.ROAD)
+    second_game = elo.predict_outcome("Notre Dame", "USC", WinningTeamLocation.HOME)
+    assert stats["Notre Dame"]["wins_distribution"][2] == pytest.approx(
+        first_game * second_game, abs=0.005
+    )
+    assert sum(stats["USC"]["wins_distribution"].values()) == pytest.approx(1)
+    assert stats["Notre Dame"]["wins"] + stats["USC"]["wins"] == pytest.approx(2)
+    # Navy doesn't play, so its record and rating don't change.
+    assert stats["Navy"]["wins_distribution"] == {3: 1.0}
+    assert stats["Navy"]["rating"] == 900.0
+    assert stats["Navy"]["rating_std"] == 0
+    assert list(stats) == ["Notre Dame", "USC", "Navy"]
+
+
+def test_simulation_is_reproducible_across_workers():
+    schedule = [
+        (week, "Navy", team, WinningTeamLocation.NEUTRAL_SITE)
+        for week, team in enumerate(["USC", "Notre Dame", "Army"], 1)
+    ]
+    simulator = SeasonSimulator(make_elo(), schedule, PARAMS, top_n=2)
+    stats = simulator.simulate(5000, seed=7, chunk_size=1000)
+    assert simulator.simulate(5000, seed=7, chunk_size=1000, workers=2) == stats
+    assert simulator.simulate(5000, seed=8, chunk_size=1000) != stats
+    assert sum(team["top_n_probability"] for team in stats.values()) == pytest.approx(2)
+    assert sum(team["first_probability"] for team in stats.values()) == pytest.approx(1)
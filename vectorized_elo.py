@@ -0,0 +1,115 @@
+"""
+Replays the full history of games for many sets of Elo parameters at once.
+
+Rather than running one EloMachine per set of parameters, we hold every candidate's ratings in a single matrix and
+step through the games once, updating every candidate at the same time.
+"""
+import numpy as np
+
+from elo import TRAINING_YEARS, EloMachine
+from game_table import WEEKS_IN_SEASON, GameTable
+
+
+class VectorizedEloReplay:
+    """
+    Replays a fixed list of games for a batch of parameter dicts simultaneously.
+
+    Ratings are stored in a matrix of shape (n_param_sets, n_teams), so the cost of a replay is dominated by the
+    number of games rather than the number of parameter sets.
+    """
+
+    def __init__(self, scores, initial_rating=1000, training_years=None):
+        """
+        scores may be a GameTable or a list of (year, week, visiting_school, visiting_score, home_school,
+        home_score) tuples. Only games in training_years (which defaults to TRAINING_YEARS) count towards the log loss.
+        """
+        self.initial_rating = initial_rating
+        if training_years is None:
+            training_years = TRAINING_YEARS
+        self.training_years = training_years
+        if not isinstance(scores, GameTable):
+            scores = GameTable.from_scores(scores)
+        self.game_table = scores
+        self.teams = scores.teams
+        self.team_registry = scores.team_registry
+
+    def _k_table(self, param_dicts):
+        """
+        Returns a matrix of shape (n_param_sets, WEEKS_IN_SEASON) holding the value of k for every week.
+        """
+        k_table = np.empty((len(param_dicts), WEEKS_IN_SEASON))
+        for i, param_dict in enumerate(param_dicts):
+            if "k_list" in param_dict:
+                k_table[i, :] = param_dict["k_list"]
+            else:
+                k_table[i, :] = param_dict["k"]
+        return k_table
+
+    def replay(self, param_dicts):
+        """
+        Returns a tuple of the log loss for every parameter dict (as an array) and the final ratings matrix of shape
+        (n_param_sets, n_teams).
+        """
+        home_field = np.array([params["home_field"] for params in param_dicts], float)
+        season_regression = np.array(
+            [params["season_regression"] for params in param_dicts], float
+        )
+        k_table = self._k_table(param_dicts)
+
+        # Store the matrix in column-major order so that pulling out one team's ratings across all parameter sets
+        # touches contiguous memory.
+        ratings = np.full(
+            (len(param_dicts), len(self.teams)), float(self.initial_rating), order="F"
+        )
+        log_loss = np.zeros(len(param_dicts))
+
+        # The sign of each game decides which way home field advantage shifts the winner's rating.
+        last_year = None
+        for year, week, winner, loser, sign in zip(
+            self.game_table.year.tolist(),
+            self.game_table.week.tolist(),
+            self.game_table.winner_id.tolist(),
+            self.game_table.loser_id.tolist(),
+            self.game_table.home_sign.tolist(),
+        ):
+            if year != last_year:
+                ratings -= self.initial_rating
+                ratings *= season_regression[:, None]
+                ratings += self.initial_rating
+                last_year = year
+
+            initial_rating_winner = ratings[:, winner]
+            initial_rating_loser = ratings[:, loser]
+            if sign:
+                adjusted_rating_winner = initial_rating_winner + sign * home_field
+            else:
+                adjusted_rating_winner = initial_rating_winner
+            predicted_outcome = 1 / (
+                1 + 10 ** ((initial_rating_loser - adjusted_rating_winner) / 400)
+            )
+
+            if year in self.training_years:
+                log_loss -= np.log(predicted_outcome)
+
+            delta = k_table[:, week - 1] * (1 - predicted_outcome)
+            ratings[:, winner] = initial_rating_winner + delta
+            ratings[:, loser] = initial_rating_loser - delta
+
+        return log_loss, ratings
+
+    def replay_to_elo_machines(self, param_dicts):
+        """
+        Like replay(), but returns one EloMachine per parameter dict, as ParameterTester.run_one_cycle would.
+        """
+        log_loss, ratings = self.replay(param_dicts)
+        elos = []
+        for i, param_dict in enumerate(param_dicts):
+            elo = EloMachine(
+                initial_rating=self.initial_rating,
+                home_team_advantage=param_dict["home_field"],
+                teams=self.team_registry,
+            )
+            elo.load_ratings(ratings[i].tolist())
+            elo.log_loss = float(log_loss[i])
+            elos.append(elo)
+        return elos